@@ -1,72 +1,146 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-import numpy as np
-from sentence_transformers import SentenceTransformer, util
+from config import ENCODE_BATCH_SIZE, RESULT_TEXT_CHARS, TOP_K_BASELINE
+from retrieval.profiling import LatencyHistogram, StageTimer, timed_setup, timer_or_new
+from retrieval.queries import stream_batch_results
+from retrieval.registry import ResourceRegistry, get_registry
 
-from config import CHUNKS_PATH, EMBEDDING_MODEL_NAME, TOP_K_BASELINE
+STRATEGY = "baseline_dense_cosine"
 
 
 class BaselineRetriever:
     """
     Baseline retriever:
-    - SentenceTransformer embeddings
+    - SentenceTransformer embeddings (cached on disk, memory-mapped)
     - Cosine similarity
     - Top-k selection
     - Serves as the control arm for evaluation
-    """
 
-    def __init__(self, chunks_path: Path = CHUNKS_PATH):
-        self.chunks_path = chunks_path
-        self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        self.chunks = self._load_chunks()
-        self.corpus_texts = [c["text"] for c in self.chunks]
-        self.corpus_embeddings = self.model.encode(
-            self.corpus_texts, convert_to_tensor=True, show_progress_bar=True
-        )
+    Models, chunks and embeddings come from the shared ResourceRegistry, so
+    constructing a retriever is cheap once the registry is warm.
+    """
 
-    def _load_chunks(self) -> List[Dict[str, Any]]:
-        with open(self.chunks_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+    def __init__(self, chunks_path: Optional[Path] = None, registry: Optional[ResourceRegistry] = None):
+        self.registry = registry or get_registry(chunks_path)
+        self.chunks_path = self.registry.chunks_path
+        self.model = self.registry.bi_encoder
+        self.chunks = self.registry.chunks
+        self.corpus_texts = self.registry.corpus_texts
+        self.corpus_embeddings = self.registry.corpus_embeddings
+        self.dense_index = self.registry.dense_index
+        self.metadata = self.registry.metadata
 
-    def retrieve(self, query: str, top_k: int = TOP_K_BASELINE) -> List[Dict[str, Any]]:
-        query_emb = self.model.encode(query, convert_to_tensor=True)
-        scores = util.cos_sim(query_emb, self.corpus_embeddings)[0].cpu().numpy()
-        top_indices = np.argsort(-scores)[:top_k]
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = TOP_K_BASELINE,
+        papers: Optional[List[str]] = None,
+        sections: Optional[List[str]] = None,
+        timer: Optional[StageTimer] = None,
+        text_chars: Optional[int] = RESULT_TEXT_CHARS,
+    ) -> List[Dict[str, Any]]:
+        return self.retrieve_batch([query], top_k, papers, sections, timer, text_chars)[0]
 
-        results = []
-        for rank, idx in enumerate(top_indices, start=1):
-            chunk = self.chunks[idx]
-            results.append(
-                {
-                    "rank": rank,
-                    "score": float(scores[idx]),
-                    "chunk_id": chunk.get("id", idx),
-                    "paper_id": chunk.get("paper_id"),
-                    "section": chunk.get("section"),
-                    "text": chunk["text"],
-                }
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        top_k: int = TOP_K_BASELINE,
+        papers: Optional[List[str]] = None,
+        sections: Optional[List[str]] = None,
+        timer: Optional[StageTimer] = None,
+        text_chars: Optional[int] = RESULT_TEXT_CHARS,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Encode all queries in batches and search the dense index for all of
+        them at once (exact argpartition top-k or an approximate backend,
+        per DENSE_INDEX_BACKEND). ``papers`` / ``sections`` filters are
+        applied as a precomputed mask before the top-k search. Each stage is
+        recorded as a span on ``timer`` when one is given. ``text_chars``
+        bounds the chunk text copied into each result (see RESULT_TEXT_CHARS).
+        """
+        timer = timer_or_new(timer)
+        with timer.span("dense_encode"):
+            query_embs = self.model.encode(
+                queries,
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
             )
-        return results
+        with timer.span("filter_mask"):
+            mask = self.metadata.mask(papers, sections)
+        with timer.span("dense_search"):
+            top_scores, top_indices = self.dense_index.search(query_embs, top_k, mask)
 
+        with timer.span("format"):
+            all_results = []
+            for qi in range(len(queries)):
+                results = []
+                valid = top_indices[qi] >= 0
+                for rank, (idx, score) in enumerate(
+                    zip(top_indices[qi][valid], top_scores[qi][valid]), start=1
+                ):
+                    results.append(
+                        {
+                            "rank": rank,
+                            "score": float(score),
+                            **self.chunks.result_fields(idx, text_chars),
+                        }
+                    )
+                all_results.append(results)
+        return all_results
 
-def run_baseline(query: str, output_path: Path) -> Dict[str, Any]:
+
+def run_baseline(
+    query: str,
+    output_path: Path,
+    registry: Optional[ResourceRegistry] = None,
+    papers: Optional[List[str]] = None,
+    sections: Optional[List[str]] = None,
+) -> Dict[str, Any]:
     """
     Run the baseline retrieval and persist outputs for evaluation and comparison.
     Returns the payload so downstream steps (evaluation/generation) do not need
     to re-read from disk.
     """
-    retriever = BaselineRetriever()
-    results = retriever.retrieve(query)
+    registry = registry or get_registry()
+    retriever, setup_ms = timed_setup(registry, lambda: BaselineRetriever(registry=registry))
+    timer = StageTimer()
+    results = retriever.retrieve(query, papers=papers, sections=sections, timer=timer)
     payload = {
         "query": query,
-        "strategy": "baseline_dense_cosine",
+        "strategy": STRATEGY,
         "top_k": len(results),
         "results": results,
         "notes": "Pure dense cosine similarity without query expansion, sparse signals, or reranking.",
+        "timings": {**timer.as_dict(), "setup_ms": setup_ms},
     }
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(payload, f, indent=2)
     return payload
+
+
+def run_baseline_batch(
+    queries_path: Path,
+    output_path: Path,
+    registry: Optional[ResourceRegistry] = None,
+    papers: Optional[List[str]] = None,
+    sections: Optional[List[str]] = None,
+    histogram: Optional[LatencyHistogram] = None,
+) -> int:
+    """
+    Run baseline retrieval for every query in a JSONL file, streaming one
+    result line per query to ``output_path``. Returns the number of queries.
+    """
+    retriever = BaselineRetriever(registry=registry)
+    return stream_batch_results(
+        lambda queries, timer: retriever.retrieve_batch(
+            queries, papers=papers, sections=sections, timer=timer
+        ),
+        queries_path,
+        output_path,
+        STRATEGY,
+        histogram=histogram,
+    )
@@ -0,0 +1,309 @@
+"""
+Scaling benchmark for the baseline and improved retrieval pipelines.
+
+For each corpus size this generates a synthetic chunk store, then measures:
+- cold index build time per resource (embeddings, BM25, dense index, ...)
+- warm start time (a fresh registry re-opening the on-disk caches)
+- per-stage p50/p95/p99 latency and throughput for both pipelines
+- with ``--rerankers cross-encoder late-interaction``: rerank latency of both
+  and how closely the late-interaction ranking agrees with the cross-encoder
+- with ``--cascade``: an adaptive cross-encoder cascade arm per fusion mode,
+  its agreement with the full rerank and how many candidates it reranked
+- resident/traced memory and index sizes
+
+Results are written as JSON so runs can be diffed. The default ``hashing``
+encoder backend runs fully offline on CPU; pass ``--encoder
+sentence-transformers`` to benchmark the real models.
+
+    python -m benchmark.run_benchmark --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+import config
+from baseline.baseline_retrieval import BaselineRetriever
+from benchmark.synthetic import synthetic_queries, write_corpus
+from improved.improved_retrieval import FUSION_MODES, ImprovedRetriever
+from retrieval.late_interaction import RERANKERS
+from retrieval.profiling import LatencyHistogram, StageTimer, set_memory_tracking
+from retrieval.queries import batched
+from retrieval.registry import ResourceRegistry
+from retrieval.rerank_cache import RerankCache
+
+RESULTS_DIR = Path(__file__).parent / "results"
+WORK_DIR = config.CACHE_DIR / "benchmark"
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux, bytes on macOS; process-wide high-water mark.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if platform.system() == "Darwin" else 2**10)
+
+
+def _array_bytes(obj: Any) -> int:
+    return sum(v.nbytes for v in vars(obj).values() if isinstance(v, np.ndarray))
+
+
+def _run_arm(arm: str, retrieve_batch, queries: List[str], batch_size: int, histogram: LatencyHistogram) -> Dict[str, Any]:
+    peak_memory: Dict[str, float] = {}
+    start = time.perf_counter()
+    for batch in batched(queries, batch_size):
+        timer = StageTimer()
+        retrieve_batch(batch, timer=timer)
+        histogram.observe_timer(arm, timer)
+        histogram.observe(arm, "per_query", timer.total_ms() / len(batch))
+        for stage, mb in timer.peak_memory_mb.items():
+            peak_memory[stage] = max(peak_memory.get(stage, 0.0), mb)
+    elapsed = time.perf_counter() - start
+    out: Dict[str, Any] = {"queries": len(queries), "throughput_qps": round(len(queries) / elapsed, 2)}
+    if peak_memory:
+        out["peak_traced_memory_mb"] = {k: round(v, 3) for k, v in peak_memory.items()}
+    return out
+
+
+def _ranking_agreement(reference, candidate, queries: List[str], batch_size: int) -> Dict[str, float]:
+    """Mean top-k overlap and top-1 agreement of ``candidate``'s rankings with ``reference``'s."""
+    overlaps, top1 = [], []
+    for batch in batched(queries, batch_size):
+        for ref, cand in zip(
+            reference.retrieve_batch(batch, text_chars=0), candidate.retrieve_batch(batch, text_chars=0)
+        ):
+            if not ref:
+                continue
+            ref_ids = [r["chunk_index"] for r in ref]
+            cand_ids = [r["chunk_index"] for r in cand]
+            overlaps.append(len(set(ref_ids) & set(cand_ids)) / len(ref_ids))
+            top1.append(float(bool(cand_ids) and cand_ids[0] == ref_ids[0]))
+    return {
+        "queries": len(overlaps),
+        "overlap_at_k": round(float(np.mean(overlaps)), 4) if overlaps else 0.0,
+        "top1_agreement": round(float(np.mean(top1)), 4) if top1 else 0.0,
+    }
+
+
+def _arm_name(mode: str, reranker: str, cascade: bool, args: argparse.Namespace) -> str:
+    parts = ["improved"]
+    if len(args.fusion) > 1:
+        parts.append(mode)
+    if len(args.rerankers) > 1:
+        parts.append("late" if reranker == "late-interaction" else "ce")
+    if cascade:
+        parts.append("cascade")
+    return "_".join(parts)
+
+
+def _improved_arms(args: argparse.Namespace) -> List[Tuple[str, str, bool]]:
+    """(fusion mode, reranker, cascade) of every improved arm."""
+    arms = [(mode, reranker, False) for mode in args.fusion for reranker in args.rerankers]
+    if args.cascade:
+        arms += [(mode, "cross-encoder", True) for mode in args.fusion]
+    return arms
+
+
+def bench_size(n_chunks: int, args: argparse.Namespace) -> Dict[str, Any]:
+    work = args.work_dir / f"n{n_chunks}"
+    shutil.rmtree(work, ignore_errors=True)
+    store = work / "chunks.jsonl"
+
+    t0 = time.perf_counter()
+    n_written = write_corpus(store, n_chunks, args.words_per_chunk, args.seed)
+    generate_ms = 1000 * (time.perf_counter() - t0)
+
+    def make_registry() -> ResourceRegistry:
+        return ResourceRegistry(
+            store, encoder_backend=args.encoder, cache_dir=work / "cache", index_dir=work / "index"
+        )
+
+    # Cold build: nothing on disk yet
+    registry = make_registry()
+    baseline = BaselineRetriever(registry=registry)
+    improved = {
+        (mode, reranker, cascade): ImprovedRetriever(
+            registry=registry, fusion_mode=mode, reranker=reranker, cascade=cascade
+        )
+        for mode, reranker, cascade in _improved_arms(args)
+    }
+    # A private in-memory score cache per cross-encoder arm, so an arm's
+    # latency does not include scores another arm already computed
+    for retriever in improved.values():
+        if retriever.rerank_cache is not None:
+            retriever.rerank_cache = RerankCache(retriever.rerank_cache.model_name, path=None)
+    build_ms = dict(registry.load_times_ms)
+
+    # Warm start: a fresh registry re-opening the caches written above
+    warm = make_registry()
+    BaselineRetriever(registry=warm)
+    for reranker in {reranker for _, reranker, _ in improved}:
+        ImprovedRetriever(registry=warm, reranker=reranker)
+    warm_ms = dict(warm.load_times_ms)
+    del warm
+
+    queries = synthetic_queries(args.queries, args.seed)
+    histogram = LatencyHistogram()
+    arms = {
+        "baseline": _run_arm(
+            "baseline", baseline.retrieve_batch, queries, args.query_batch, histogram
+        ),
+    }
+    for (mode, reranker, cascade), retriever in improved.items():
+        arm = _arm_name(mode, reranker, cascade, args)
+        arms[arm] = _run_arm(arm, retriever.retrieve_batch, queries, args.query_batch, histogram)
+    summary = histogram.summary()
+    for arm in arms:
+        arms[arm]["latency"] = summary.get(arm, {})
+    # Reranked depth of the timed runs only (the agreement runs below add more)
+    cascade_stats = {
+        _arm_name(*key, args): retriever.cascade.stats()
+        for key, retriever in improved.items()
+        if retriever.cascade is not None
+    }
+
+    # Same candidates, different reranker: how often do the rankings agree?
+    agreement = {}
+    if "cross-encoder" in args.rerankers:
+        for (mode, reranker, cascade), retriever in improved.items():
+            if reranker != "cross-encoder" or cascade:
+                agreement[_arm_name(mode, reranker, cascade, args)] = _ranking_agreement(
+                    improved[(mode, "cross-encoder", False)], retriever, queries, args.query_batch
+                )
+
+    result = {
+        "chunks": n_written,
+        "generate_ms": round(generate_ms, 3),
+        "build_ms": build_ms,
+        "warm_start_ms": warm_ms,
+        "index_bytes": {
+            "embeddings": int(registry.corpus_embeddings.nbytes),
+            "bm25": _array_bytes(registry.bm25),
+            "dense_index": registry.dense_index.nbytes,
+            "chunk_table": registry.chunks.nbytes,
+        },
+        "arms": arms,
+        "rerank_agreement": agreement,
+        "cascade": cascade_stats,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rerank_cache": {
+            _arm_name(*key, args): retriever.rerank_cache.stats()
+            for key, retriever in improved.items()
+            if retriever.rerank_cache is not None
+        },
+    }
+    if "late-interaction" in {reranker for _, reranker, _ in improved}:
+        result["index_bytes"]["token_index"] = registry.token_index.nbytes
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def _print_row(size: Dict[str, Any]) -> None:
+    build_total = sum(size["build_ms"].values())
+    warm_total = sum(size["warm_start_ms"].values())
+    print(f"\n{size['chunks']:,} chunks: build {build_total:,.0f} ms, warm start {warm_total:,.0f} ms, peak RSS {size['peak_rss_mb']:,.0f} MB")
+    for arm, stats in size["arms"].items():
+        per_query = stats["latency"].get("per_query", {})
+        print(
+            f"  {arm:<26} {stats['throughput_qps']:>9.1f} q/s   per-query p50 {per_query.get('p50_ms', 0):.2f} ms"
+            f"  p95 {per_query.get('p95_ms', 0):.2f} ms  p99 {per_query.get('p99_ms', 0):.2f} ms"
+        )
+    for arm, agreement in size["rerank_agreement"].items():
+        print(
+            f"  {arm:<26} vs cross-encoder: top-k overlap {agreement['overlap_at_k']:.2f}"
+            f"  top-1 agreement {agreement['top1_agreement']:.2f}"
+        )
+    for arm, stats in size["cascade"].items():
+        reasons = ", ".join(f"{k} {v}" for k, v in stats["stop_reasons"].items())
+        print(
+            f"  {arm:<26} reranked per query: mean {stats['reranked_mean']:.1f}  p50 {stats['reranked_p50']:.0f}"
+            f"  p90 {stats['reranked_p90']:.0f}  max {stats['reranked_max']}  ({reasons})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval pipelines on synthetic corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-batch", type=int, default=16)
+    parser.add_argument("--words-per-chunk", type=int, default=120)
+    parser.add_argument("--encoder", default="hashing", choices=["hashing", "sentence-transformers"])
+    parser.add_argument("--seed", type=int, default=config.RANDOM_SEED)
+    parser.add_argument("--memory", action="store_true", help="Track peak traced memory per stage (slower).")
+    parser.add_argument(
+        "--fusion",
+        nargs="+",
+        choices=FUSION_MODES,
+        default=[config.FUSION_MODE],
+        help="Improved-retriever fusion modes to compare (one improved arm each).",
+    )
+    parser.add_argument(
+        "--rerankers",
+        nargs="+",
+        choices=RERANKERS,
+        default=[config.RERANKER],
+        help="Improved-retriever rerankers to compare (one improved arm each, per fusion mode).",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Add an adaptive cross-encoder cascade arm per fusion mode (see retrieval/cascade.py).",
+    )
+    parser.add_argument("--work-dir", type=Path, default=WORK_DIR)
+    parser.add_argument("--keep", action="store_true", help="Keep generated corpora and indexes.")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    if args.memory:
+        set_memory_tracking(True)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            "encoder": args.encoder,
+            "queries": args.queries,
+            "query_batch": args.query_batch,
+            "words_per_chunk": args.words_per_chunk,
+            "dense_index_backend": config.DENSE_INDEX_BACKEND,
+            "embedding_storage": config.EMBEDDING_STORAGE,
+            "rescore_candidates": config.RESCORE_CANDIDATES,
+            "top_k_baseline": config.TOP_K_BASELINE,
+            "top_k_improved_candidates": config.TOP_K_IMPROVED_CANDIDATES,
+            "top_k_improved_final": config.TOP_K_IMPROVED_FINAL,
+            "fusion_modes": args.fusion,
+            "fusion_depth": config.FUSION_DEPTH,
+            "rerankers": args.rerankers,
+            "late_interaction_dim": config.LATE_INTERACTION_DIM,
+            "cascade": args.cascade,
+            "rerank_latency_budget_ms": config.RERANK_LATENCY_BUDGET_MS,
+            "rerank_cascade_batch": config.RERANK_CASCADE_BATCH,
+        },
+        "sizes": [],
+    }
+    for n in args.sizes:
+        size = bench_size(n, args)
+        results["sizes"].append(size)
+        _print_row(size)
+
+    output = args.output or RESULTS_DIR / f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Synthetic chunk corpora and query sets for scaling benchmarks.
+
+Corpora mimic the shape of an ingested paper collection: paper lengths are
+heavy-tailed, each paper walks through the usual section sequence with
+realistic section sizes, and chunk text is drawn from a Zipfian vocabulary mixed
+with a handful of per-paper topic terms. Everything is seeded, so the same
+size and seed always produce the same corpus.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from config import RANDOM_SEED
+
+# (section name, relative share of a paper's chunks)
+SECTION_PROFILE = [
+    ("Abstract", 0.04),
+    ("Introduction", 0.12),
+    ("Related Work", 0.10),
+    ("Method", 0.22),
+    ("Experiments", 0.20),
+    ("Results", 0.16),
+    ("Discussion", 0.08),
+    ("Conclusion", 0.05),
+    ("Appendix", 0.03),
+]
+
+TOPICS = [
+    "retrieval", "augmented", "generation", "hallucination", "factuality", "grounding",
+    "reranking", "bm25", "dense", "embedding", "attention", "transformer", "scaling",
+    "pretraining", "context", "window", "distillation", "quantization", "latency",
+    "benchmark", "evaluation", "question", "answering", "instruction", "alignment",
+    "memory", "compression", "sparse", "mixture", "experts", "tokenizer", "decoding",
+]
+
+
+def _vocabulary(size: int) -> List[str]:
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "vi", "so", "de", "pa", "zo", "fe"]
+    words = []
+    i = 0
+    while len(words) < size:
+        n, w = i, ""
+        while True:
+            w += syllables[n % len(syllables)]
+            n //= len(syllables)
+            if n == 0:
+                break
+        words.append(w)
+        i += 1
+    return words
+
+
+def iter_synthetic_chunks(
+    n_chunks: int,
+    words_per_chunk: int = 120,
+    vocab_size: int = 50_000,
+    seed: int = RANDOM_SEED,
+) -> Iterator[Dict[str, Any]]:
+    """Yield ``n_chunks`` chunk dicts in the chunks.json schema."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(_vocabulary(vocab_size) + TOPICS)
+    ranks = np.arange(1, vocab_size + 1)
+    zipf_cdf = np.cumsum(1.0 / ranks**1.05)
+    zipf_cdf /= zipf_cdf[-1]
+    shares = np.array([s for _, s in SECTION_PROFILE])
+
+    produced, paper = 0, 0
+    while produced < n_chunks:
+        paper += 1
+        paper_len = int(min(max(rng.lognormal(3.2, 0.7), 5), 400))
+        paper_len = min(paper_len, n_chunks - produced)
+        per_section = np.maximum(1, np.round(shares * paper_len)).astype(int)
+        topics = rng.choice(len(TOPICS), size=4, replace=False)
+        chunk_no = 0
+        for (section, _), count in zip(SECTION_PROFILE, per_section):
+            for _ in range(count):
+                if chunk_no >= paper_len:
+                    break
+                n_topic = rng.binomial(words_per_chunk, 0.06)
+                body = np.searchsorted(zipf_cdf, rng.random(words_per_chunk - n_topic))
+                topic_words = vocab_size + topics[rng.integers(0, len(topics), size=n_topic)]
+                words = np.concatenate([body, topic_words])
+                rng.shuffle(words)
+                yield {
+                    "id": f"paper_{paper}_chunk_{chunk_no}",
+                    "paper_id": f"paper_{paper}",
+                    "source": f"Synthetic Paper {paper}",
+                    "section": section,
+                    "text": " ".join(vocab[words]),
+                }
+                chunk_no += 1
+        produced += chunk_no
+
+
+def write_corpus(path: Path, n_chunks: int, words_per_chunk: int = 120, seed: int = RANDOM_SEED) -> int:
+    """Stream a synthetic corpus to a JSONL chunk store. Returns the chunk count."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in iter_synthetic_chunks(n_chunks, words_per_chunk, seed=seed):
+            f.write(json.dumps(chunk) + "\n")
+            count += 1
+    return count
+
+
+def synthetic_queries(n_queries: int, seed: int = RANDOM_SEED) -> List[str]:
+    """Short topical queries, some of which trigger the improved query expansion."""
+    rng = np.random.default_rng(seed + 1)
+    templates = [
+        "how does {} improve {}",
+        "{} and {} for rag",
+        "reducing hallucination with {} {}",
+        "{} {} latency efficiency",
+        "long context {} {}",
+    ]
+    queries = []
+    for _ in range(n_queries):
+        a, b = rng.choice(TOPICS, size=2, replace=False)
+        queries.append(templates[rng.integers(len(templates))].format(a, b))
+    return queries
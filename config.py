@@ -3,15 +3,160 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).parent
 DATA_DIR = ROOT_DIR / "data"
 CHUNKS_PATH = DATA_DIR / "chunks.json"
+CHUNK_STORE_PATH = DATA_DIR / "chunks.jsonl"
+PAPERS_DIR = DATA_DIR / "papers"
+RAW_TEXT_DIR = DATA_DIR / "raw_text"
+INGEST_MANIFEST_PATH = DATA_DIR / "ingest_manifest.json"
+QRELS_PATH = DATA_DIR / "qrels.jsonl"
+CACHE_DIR = DATA_DIR / "cache"
+EMBEDDING_CACHE_DIR = CACHE_DIR / "embeddings"
+RUN_CACHE_DIR = CACHE_DIR / "runs"
+STAGE_CACHE_DIR = CACHE_DIR / "stages"
+INDEX_DIR = DATA_DIR / "index"
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
 
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 CROSS_ENCODER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
+# "sentence-transformers" (real models) or "hashing" (deterministic offline
+# stand-ins for benchmarks; no network or model download)
+ENCODER_BACKEND = "sentence-transformers"
+HASHING_DIM = 384
+
+# CPU inference for the sentence-transformers models: "torch" (eager float32,
+# the reference), "torch-int8" (dynamic int8 quantization of Linear layers) or
+# "onnx" (ONNX Runtime export; needs sentence-transformers[onnx]).
+# Non-reference backends get their own embedding / rerank cache entries.
+INFERENCE_BACKEND = "torch"
+INFERENCE_THREADS = 0  # intra-op threads; 0 = runtime default
+# Score cross-encoder pairs in length order so each batch pads to similar lengths
+RERANK_SORT_BY_LENGTH = True
+
+# Ingestion (ingest.py)
+CHUNK_SIZE_WORDS = 200
+CHUNK_OVERLAP_WORDS = 40
+INGEST_WORKERS = 0  # 0 = one worker per CPU core
+
+# Corpus versions whose embeddings are kept per model under the cache
+# directory; the most recent one seeds the next version (unchanged chunks
+# are copied, not re-encoded)
+EMBEDDING_CACHE_KEEP = 2
+
+ENCODE_BATCH_SIZE = 64
+QUERY_BATCH_SIZE = 64
+RERANK_BATCH_SIZE = 128
+
+# Cross-encoder score cache: in-memory LRU size (0 disables) and optional SQLite
+# tier (rerank_scores.sqlite under the cache directory)
+RERANK_CACHE_SIZE = 100_000
+RERANK_CACHE_PERSIST = True
+
+# Semantic result cache for the improved pipeline (service and batch mode):
+# max entries (0 disables), cosine similarity a query needs to reuse a cached
+# query's results, and entry lifetime in seconds (None = no expiry)
+RESULT_CACHE_SIZE = 0
+RESULT_CACHE_THRESHOLD = 0.97
+RESULT_CACHE_TTL_S = 600
+
+# Improved-pipeline reranker: "cross-encoder" (full transformer pass per
+# query/candidate pair) or "late-interaction" (MaxSim over bi-encoder token
+# embeddings precomputed at index time). Token vectors are PCA-projected to
+# LATE_INTERACTION_DIM dimensions (0 = model dimension) and stored as int8.
+RERANKER = "cross-encoder"
+LATE_INTERACTION_DIM = 64
+
+# Adaptive cross-encoder cascade (improved pipeline): instead of reranking all
+# TOP_K_IMPROVED_CANDIDATES, score candidates in hybrid order in mini-batches
+# of RERANK_CASCADE_BATCH and stop once a batch no longer changes the top
+# TOP_K_IMPROVED_FINAL, or when the query's latency budget is spent. The budget
+# is per query and counts only the cross-encoder time charged to that query
+# (None = no budget); evaluation runs ignore it. Queries whose hybrid ranking
+# is already decisive (normalized score margin at the top-k boundary >=
+# CASCADE_SKIP_MARGIN and normalized entropy of a softmax at CASCADE_TEMPERATURE
+# over the min-max normalized scores <= CASCADE_SKIP_ENTROPY) skip the
+# cross-encoder; otherwise the entropy scales how deep the cascade may go.
+RERANK_CASCADE = False
+RERANK_LATENCY_BUDGET_MS = 50
+RERANK_CASCADE_BATCH = 5
+CASCADE_SKIP_MARGIN = 0.3
+CASCADE_SKIP_ENTROPY = 0.5
+CASCADE_TEMPERATURE = 0.25
+
+# Dense index: "exact" (brute force) or "ivf" (approximate inverted file)
+DENSE_INDEX_BACKEND = "exact"
+IVF_NLIST = 0  # 0 = sqrt(corpus size)
+IVF_NPROBE = 8
+IVF_TRAIN_ITERS = 10
+IVF_TRAIN_SAMPLE = 50000
+# Matrix the dense index scores against: "float32", "float16" or "int8"
+# (per-dimension scale). Quantized searches re-rank their top
+# RESCORE_CANDIDATES hits by exact float32 similarity (0 disables).
+EMBEDDING_STORAGE = "float32"
+RESCORE_CANDIDATES = 200
+
+# Improved retriever: >1 splits BM25 and dense scoring across this many worker
+# processes (scatter-gather over corpus shards); 0 or 1 = in-process
+SHARDS = 0
+
+# Characters of chunk text serialized with each result (None = full text,
+# 0 = none). Results always carry ``chunk_index`` into the chunk table.
+RESULT_TEXT_CHARS = 300
+
+# Context packing for generation: LLM token budget for the packed evidence,
+# max SimHash Hamming distance (of 64 bits) treated as a near-duplicate
+# (a few edited words give ~7-11, unrelated chunks ~20-32), and the smallest
+# truncated passage worth including. The budget is kept below the evidence
+# generation.py gave before packing (top 3 results x 180 characters, ~135
+# estimated tokens), so packing spends fewer tokens per answer; with the
+# minimum passage size it still leaves room for three cited papers.
+CONTEXT_TOKEN_BUDGET = 96
+SIMHASH_MAX_DISTANCE = 10
+CONTEXT_MIN_PASSAGE_TOKENS = 32
+
 TOP_K_BASELINE = 5
 TOP_K_IMPROVED_CANDIDATES = 15
 TOP_K_IMPROVED_FINAL = 5
 
+# Evaluation: metric cutoffs and how deep each cached retrieval run goes
+EVAL_CUTOFFS = (1, 5, 10)
+EVAL_RUN_DEPTH = 10
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
 BM25_WEIGHT = 0.4
 VECTOR_WEIGHT = 0.6
 
+# Improved retriever candidate fusion:
+# - "full": min-max normalize BM25 and dense scores over every (filtered) row
+# - "rrf": weighted reciprocal rank fusion of the BM25 and dense top lists
+# - "weighted": min-max weighted fusion over the union of the two top lists
+# The list modes only see the top FUSION_DEPTH hits of each retriever (BM25
+# MaxScore search and the dense index), so they do not score the whole corpus.
+FUSION_MODE = "full"
+FUSION_DEPTH = 100
+RRF_K = 60
+
+# Instrumentation: tracemalloc peak memory per stage, histogram buckets (ms)
+PROFILE_MEMORY = False
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LATENCY_SAMPLE_LIMIT = 10_000
+
+# main.py pipeline: worker threads for independent stages (the two retrieval
+# arms, evaluation and generation). Stage outputs are cached under
+# STAGE_CACHE_DIR keyed by their inputs, so unchanged stages are skipped.
+PIPELINE_WORKERS = 4
+
+# Retrieval service (server.py)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_MAX_BATCH_SIZE = 32
+SERVER_MAX_WAIT_MS = 5.0
+# Larger /retrieve bodies are rejected with 413 before they are read
+SERVER_MAX_BODY_BYTES = 64 * 1024
+# How often the server checks data/snapshots/CURRENT for a newly published version
+SNAPSHOT_POLL_SECONDS = 5.0
+SNAPSHOT_KEEP = 3
+
 RANDOM_SEED = 42
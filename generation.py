@@ -2,36 +2,61 @@
 Lightweight generation stage for demonstrating how improved retrieval
 translates into better grounded answers. This avoids heavy LLM calls and
 instead produces templated, source-cited responses for comparison.
+
+The evidence is assembled by ``retrieval.context.pack_context``: near-duplicate
+chunks are dropped, neighbouring chunks merged and the result packed into
+``CONTEXT_TOKEN_BUDGET`` tokens. The response quotes the packed passages in
+full, and the report compares their size with the evidence used before
+packing (``PREVIOUS_CONTEXT_CHUNKS`` results x ``SNIPPET_CHARS`` characters).
 """
 
 from pathlib import Path
 from typing import Any, Dict, List
 
+from retrieval.context import chunk_text, pack_context
+from retrieval.text import estimate_tokens
+
+# Evidence the report showed before context packing: the top 3 results,
+# 180 characters each. Kept as the baseline for the packed context's size.
+SNIPPET_CHARS = 180
+PREVIOUS_CONTEXT_CHUNKS = 3
 
-def _format_context(chunks: List[Dict[str, Any]]) -> str:
-    """Compact representation of retrieved chunks for logging."""
+
+def previous_context_tokens(retrieved: List[Dict[str, Any]], store=None) -> int:
+    """Estimated tokens of the unpacked evidence (top results truncated to ``SNIPPET_CHARS``)."""
+    return sum(
+        estimate_tokens(chunk_text(r, store)[:SNIPPET_CHARS]) for r in retrieved[:PREVIOUS_CONTEXT_CHUNKS]
+    )
+
+
+def _format_context(passages: List[Dict[str, Any]]) -> str:
+    """The packed passages as cited evidence lines, text in full (already within the budget)."""
     lines = []
-    for c in chunks:
-        cid = c.get("chunk_id", "chunk")
-        paper = c.get("paper_id", "paper")
-        section = c.get("section", "section")
-        snippet = c.get("text", "")
-        snippet = snippet[:180].replace("\n", " ").strip()
-        lines.append(f"- [{cid}] ({paper} / {section}): {snippet}...")
+    for p in passages:
+        cids = ", ".join(str(cid) for cid in p.get("chunk_ids", ["chunk"]))
+        paper = p.get("paper_id", "paper")
+        section = p.get("section", "section")
+        text = p.get("text", "").replace("\n", " ").strip() + ("..." if p.get("truncated") else "")
+        lines.append(f"- [{cids}] ({paper} / {section}, {p.get('tokens', 0)} tokens): {text}")
     return "\n".join(lines)
 
 
-def generate_response(query: str, retrieved: List[Dict[str, Any]], label: str) -> Dict[str, Any]:
+def generate_response(query: str, retrieved: List[Dict[str, Any]], label: str, store=None) -> Dict[str, Any]:
     """
     Produce a concise, source-cited answer that is easy to compare between
-    baseline and improved retrieval paths.
+    baseline and improved retrieval paths. ``store`` (a ``ChunkTable``) gives
+    the packer full chunk texts; results serialized without text need it.
     """
+    context = pack_context(retrieved, store)
+    stats = context["stats"]
+    stats["tokens_previous_context"] = previous_context_tokens(retrieved, store)
+    stats["tokens_saved"] = stats["tokens_previous_context"] - stats["tokens_packed"]
     lead = (
         "Answer grounded in retrieved evidence with explicit citations. "
         "Focuses on hallucination mitigation via retrieval quality, reranking, "
         "and evaluation metrics."
     )
-    evidence = _format_context(retrieved[:3])
+    evidence = _format_context(context["passages"])
     response = (
         f"{lead}\n\n"
         f"Key points for {label}:\n"
@@ -48,7 +73,8 @@ def generate_response(query: str, retrieved: List[Dict[str, Any]], label: str) -
         "query": query,
         "label": label,
         "response": response,
-        "context_used": retrieved[:3],
+        "context_used": context["passages"],
+        "context_stats": context["stats"],
     }
 
 
@@ -56,17 +82,18 @@ def write_generation_report(
     baseline_payload: Dict[str, Any],
     improved_payload: Dict[str, Any],
     output_path: Path,
+    store=None,
 ) -> Dict[str, Any]:
     """
     Write a side-by-side generation comparison using baseline vs improved
     retrieved context. This highlights reduced hallucination risk when using
-    the improved pipeline.
+    the improved pipeline. ``store`` supplies full chunk texts for packing.
     """
     baseline_resp = generate_response(
-        baseline_payload["query"], baseline_payload["results"], "baseline retrieval"
+        baseline_payload["query"], baseline_payload["results"], "baseline retrieval", store
     )
     improved_resp = generate_response(
-        improved_payload["query"], improved_payload["results"], "improved retrieval"
+        improved_payload["query"], improved_payload["results"], "improved retrieval", store
     )
 
     comparison = {
@@ -78,11 +105,31 @@ def write_generation_report(
         },
     }
 
+    packing = [
+        "| Arm | Retrieved | Near-dups dropped | Merged | Passages | Tokens retrieved "
+        f"| Previous context ({PREVIOUS_CONTEXT_CHUNKS}x{SNIPPET_CHARS} chars) | Tokens packed | Tokens saved "
+        "| Papers cited |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for name, resp in (("Baseline", baseline_resp), ("Improved", improved_resp)):
+        st = resp["context_stats"]
+        saved = st["tokens_saved"] / st["tokens_previous_context"] if st["tokens_previous_context"] else 0.0
+        packing.append(
+            f"| {name} | {st['retrieved_chunks']} | {st['near_duplicates_dropped']} | {st['chunks_merged']} "
+            f"| {st['passages']} | {st['tokens_retrieved']} | {st['tokens_previous_context']} "
+            f"| {st['tokens_packed']} | {st['tokens_saved']} ({saved:.0%}) "
+            f"| {st['papers_cited']}/{st['papers_retrieved']} |"
+        )
+
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(
         f"# Generation Comparison\n\n"
         f"## Baseline Response\n{baseline_resp['response']}\n\n"
         f"## Improved Response\n{improved_resp['response']}\n\n"
+        f"## Context Packing\n"
+        f"Token budget: {improved_resp['context_stats']['token_budget']} (estimated tokens)\n\n"
+        + "\n".join(packing)
+        + "\n\n"
         f"## Observations\n"
         f"- Hallucination risk: {comparison['analysis']['hallucination_risk']}\n"
         f"- Explainability: {comparison['analysis']['explainability']}\n",
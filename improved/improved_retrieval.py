@@ -1,20 +1,41 @@
 import json
+import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np
-from rank_bm25 import BM25Okapi
-from sentence_transformers import SentenceTransformer, CrossEncoder, util
 
 from config import (
-    CHUNKS_PATH,
-    EMBEDDING_MODEL_NAME,
-    CROSS_ENCODER_MODEL_NAME,
+    ENCODE_BATCH_SIZE,
+    FUSION_DEPTH,
+    FUSION_MODE,
+    RERANK_BATCH_SIZE,
+    RERANK_CASCADE,
+    RERANKER,
+    RESULT_TEXT_CHARS,
+    RRF_K,
+    SHARDS,
     TOP_K_IMPROVED_CANDIDATES,
     TOP_K_IMPROVED_FINAL,
     BM25_WEIGHT,
     VECTOR_WEIGHT,
 )
+from retrieval.cascade import RerankCascade
+from retrieval.profiling import LatencyHistogram, StageTimer, timed_setup, timer_or_new
+from retrieval.queries import stream_batch_results
+from retrieval.ranking import top_k_indices
+from retrieval.late_interaction import RERANKERS, query_tokens
+from retrieval.registry import ResourceRegistry, get_registry
+from retrieval.result_cache import SemanticResultCache, get_result_cache
+from retrieval.sharding import ShardPool
+from retrieval.text import tokenize
+
+STRATEGY = "improved_hybrid_bm25_dense_rerank"
+
+FUSION_MODES = ("full", "rrf", "weighted")
+
+# (scores, corpus indices) of one retriever's top hits for one query, best first
+RankedList = Tuple[np.ndarray, np.ndarray]
 
 
 class ImprovedRetriever:
@@ -23,32 +44,61 @@ class ImprovedRetriever:
     - Query expansion
     - Hybrid BM25 + dense retrieval
     - Section-aware boosting
-    - Cross-encoder reranking
+    - Cross-encoder or late-interaction (MaxSim) reranking, per ``reranker``;
+      with ``cascade``, the cross-encoder only scores as many candidates as
+      the query needs (see ``retrieval/cascade.py``)
+
+    Models, chunks, embeddings and the BM25 index come from the shared
+    ResourceRegistry, so they are loaded once per process.
     """
 
-    def __init__(self, chunks_path: Path = CHUNKS_PATH):
-        self.chunks_path = chunks_path
-        self.bi_encoder = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        self.cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL_NAME)
-        self.chunks = self._load_chunks()
-        self.corpus_texts = [c["text"] for c in self.chunks]
+    def __init__(
+        self,
+        chunks_path: Optional[Path] = None,
+        registry: Optional[ResourceRegistry] = None,
+        fusion_mode: str = FUSION_MODE,
+        result_cache: Optional[SemanticResultCache] = None,
+        reranker: str = RERANKER,
+        cascade: bool = RERANK_CASCADE,
+    ):
+        if fusion_mode not in FUSION_MODES:
+            raise ValueError(f"Unknown fusion mode: {fusion_mode!r} (expected one of {FUSION_MODES})")
+        self.fusion_mode = fusion_mode
+        self.result_cache = result_cache
+        self.registry = registry or get_registry(chunks_path)
+        self.chunks_path = self.registry.chunks_path
+        self.bi_encoder = self.registry.bi_encoder
+        self._init_reranker(reranker, cascade)
+        self.chunks = self.registry.chunks
+        self.corpus_texts = self.registry.corpus_texts
+        self.corpus_embeddings = self.registry.corpus_embeddings
+        self.metadata = self.registry.metadata
+        # Section boost evaluated once per distinct section, applied as a vector
+        self.section_boost = self.metadata.per_section(self._section_boost)
+        self._init_indexes()
 
-        # Precompute dense embeddings
-        self.corpus_embeddings = self.bi_encoder.encode(
-            self.corpus_texts, convert_to_tensor=True, show_progress_bar=True
-        )
+    def _init_indexes(self) -> None:
+        """BM25 and dense indexes scored by ``_hybrid_candidates``."""
+        self.dense_index = self.registry.dense_index
+        self.bm25 = self.registry.bm25
 
-        # Build BM25 index
-        tokenized = [self._tokenize(t) for t in self.corpus_texts]
-        self.bm25 = BM25Okapi(tokenized)
-
-    def _load_chunks(self) -> List[Dict[str, Any]]:
-        with open(self.chunks_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+    def _init_reranker(self, reranker: str, cascade: bool = False) -> None:
+        """Load only the resources of the selected reranker (the cascade applies to the cross-encoder)."""
+        if reranker not in RERANKERS:
+            raise ValueError(f"Unknown reranker: {reranker!r} (expected one of {RERANKERS})")
+        self.reranker = reranker
+        self.cross_encoder = self.rerank_cache = self.token_index = self.cascade = None
+        if reranker == "cross-encoder":
+            self.cross_encoder = self.registry.cross_encoder
+            self.rerank_cache = self.registry.rerank_cache
+            if cascade:
+                self.cascade = RerankCascade()
+        else:
+            self.token_index = self.registry.token_index
 
     @staticmethod
     def _tokenize(text: str) -> List[str]:
-        return text.lower().split()
+        return tokenize(text)
 
     def _expand_query(self, query: str) -> str:
         """
@@ -84,74 +134,486 @@ class ImprovedRetriever:
             return 1.05
         return 1.0
 
-    def retrieve(self, query: str) -> List[Dict[str, Any]]:
-        expanded_query = self._expand_query(query)
+    def retrieve(
+        self,
+        query: str,
+        papers: Optional[List[str]] = None,
+        sections: Optional[List[str]] = None,
+        timer: Optional[StageTimer] = None,
+        text_chars: Optional[int] = RESULT_TEXT_CHARS,
+    ) -> List[Dict[str, Any]]:
+        return self.retrieve_batch([query], papers, sections, timer, text_chars=text_chars)[0]
 
-        # BM25 scores
-        bm25_scores = np.array(self.bm25.get_scores(self._tokenize(expanded_query)))
-
-        # Dense scores
-        q_emb = self.bi_encoder.encode(expanded_query, convert_to_tensor=True)
-        dense_scores = util.cos_sim(q_emb, self.corpus_embeddings)[0].cpu().numpy()
-
-        # Normalize to [0,1]
-        def norm(x: np.ndarray) -> np.ndarray:
-            if x.max() == x.min():
-                return np.zeros_like(x)
-            return (x - x.min()) / (x.max() - x.min())
-
-        bm25_n = norm(bm25_scores)
-        dense_n = norm(dense_scores)
-        hybrid = BM25_WEIGHT * bm25_n + VECTOR_WEIGHT * dense_n
-
-        # Section-aware boost to encourage evidence-heavy sections
-        for i, chunk in enumerate(self.chunks):
-            hybrid[i] *= self._section_boost(chunk.get("section"))
-
-        # Candidate set
-        cand_idx = np.argsort(-hybrid)[:TOP_K_IMPROVED_CANDIDATES]
-
-        # Cross-encoder rerank
-        pairs = [(query, self.corpus_texts[i]) for i in cand_idx]
-        rerank_scores = np.array(self.cross_encoder.predict(pairs))
-        order = np.argsort(-rerank_scores)[:TOP_K_IMPROVED_FINAL]
-        final_idx = [cand_idx[i] for i in order]
-
-        results = []
-        for rank, idx in enumerate(final_idx, start=1):
-            chunk = self.chunks[idx]
-            results.append(
-                {
-                    "rank": rank,
-                    "hybrid_score": float(hybrid[idx]),
-                    "cross_encoder_score": float(rerank_scores[order[rank - 1]]),
-                    "chunk_id": chunk.get("id", idx),
-                    "paper_id": chunk.get("paper_id"),
-                    "section": chunk.get("section"),
-                    "text": chunk["text"],
-                }
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        papers: Optional[List[str]] = None,
+        sections: Optional[List[str]] = None,
+        timer: Optional[StageTimer] = None,
+        top_k: Optional[int] = None,
+        text_chars: Optional[int] = RESULT_TEXT_CHARS,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Run the full pipeline for many queries at once: batched query encoding,
+        one (queries x corpus) matrix product for dense scores, BM25 scored for
+        the whole batch, and every (query, candidate) pair reranked through
+        large CrossEncoder.predict batches.
+
+        ``papers`` / ``sections`` restrict retrieval to matching chunks; the
+        filter mask is applied before scoring, so BM25, dense scoring and
+        normalization only run over the matching rows. Each stage is recorded
+        as a span on ``timer`` when one is given. ``top_k`` overrides
+        TOP_K_IMPROVED_FINAL (the candidate pool grows to at least ``top_k``);
+        ``text_chars`` bounds the chunk text copied into each result.
+
+        With a ``result_cache``, queries whose embedding is close enough to a
+        cached one (same filters and depth) reuse its results; only the misses
+        encode their expansions and run the rest of the pipeline. The cache is
+        keyed on the original query, not the expansion: the shared expansion
+        phrases would make different queries look alike, and the reranker
+        scores the original query.
+        """
+        timer = timer_or_new(timer)
+        final_k = top_k or TOP_K_IMPROVED_FINAL
+
+        with timer.span("query_expansion"):
+            expanded_queries = [self._expand_query(q) for q in queries]
+        if self.result_cache is None:
+            q_embs = self._encode_queries(expanded_queries, timer)
+            return self._retrieve_encoded(
+                queries, expanded_queries, q_embs, papers, sections, final_k, timer, text_chars
             )
+
+        scope = (
+            tuple(sorted(papers)) if papers else None,
+            tuple(sorted(sections)) if sections else None,
+            final_k,
+            text_chars,
+            self.fusion_mode,
+            self.reranker,
+            self.cascade is not None,
+        )
+        version = self.registry.version
+        key_embs = self._encode_queries(queries, timer, "result_cache_encode")
+        with timer.span("result_cache"):
+            results = self.result_cache.lookup(key_embs, scope, version)
+        misses = [i for i, r in enumerate(results) if r is None]
+        if misses:
+            start = time.perf_counter()
+            miss_expanded = [expanded_queries[i] for i in misses]
+            fresh = self._retrieve_encoded(
+                [queries[i] for i in misses],
+                miss_expanded,
+                self._encode_queries(miss_expanded, timer),
+                papers,
+                sections,
+                final_k,
+                timer,
+                text_chars,
+            )
+            cost_ms = 1000 * (time.perf_counter() - start) / len(misses)
+            self.result_cache.store(key_embs[misses], scope, fresh, cost_ms, version)
+            for i, ranked in zip(misses, fresh):
+                results[i] = ranked
         return results
 
+    def _retrieve_encoded(
+        self,
+        queries: List[str],
+        expanded_queries: List[str],
+        q_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        final_k: int,
+        timer: StageTimer,
+        text_chars: Optional[int],
+    ) -> List[List[Dict[str, Any]]]:
+        """Candidate generation and rerank for queries whose expansions are already encoded."""
+        candidates = self._hybrid_candidates(
+            expanded_queries, q_embs, papers, sections, max(TOP_K_IMPROVED_CANDIDATES, final_k), timer
+        )
+        if candidates is None:
+            return [[] for _ in queries]
+        cand_idx, cand_hybrid = candidates
+        return self._rerank(queries, cand_idx, cand_hybrid, final_k, timer, text_chars)
+
+    def _encode_queries(self, texts: List[str], timer: StageTimer, span: str = "dense_encode") -> np.ndarray:
+        with timer.span(span):
+            return self.bi_encoder.encode(
+                texts,
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+
+    def _hybrid_candidates(
+        self,
+        expanded_queries: List[str],
+        q_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        n_candidates: int,
+        timer: StageTimer,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top ``n_candidates`` corpus indices per query by boosted hybrid score,
+        with those scores; None when the filters match no chunk. Rows may be
+        padded with index -1 when the list fusion modes find fewer candidates.
+        """
+        if self.fusion_mode != "full":
+            return self._list_candidates(expanded_queries, q_embs, papers, sections, n_candidates, timer)
+
+        with timer.span("filter_mask"):
+            mask = self.metadata.mask(papers, sections)
+            rows = None if mask is None else np.flatnonzero(mask)
+        if rows is not None and not len(rows):
+            return None
+
+        # BM25 scores
+        with timer.span("bm25"):
+            bm25_scores = self.bm25.score_batch(
+                [self._tokenize(q) for q in expanded_queries], rows
+            )
+
+        # Dense scores (every candidate row: the min-max fusion below needs them all)
+        with timer.span("dense_score"):
+            dense_scores = self.dense_index.score_all(q_embs, rows)
+
+        # Normalize each query's scores to [0,1]
+        with timer.span("fusion"):
+            hybrid = fuse_scores(
+                bm25_scores, dense_scores, score_range(bm25_scores), score_range(dense_scores)
+            )
+
+        # Section-aware boost to encourage evidence-heavy sections (precomputed)
+        with timer.span("section_boost"):
+            hybrid *= self.section_boost if rows is None else self.section_boost[rows]
+
+        # Candidate sets (positions in the hybrid matrix, then corpus indices)
+        with timer.span("candidate_select"):
+            local_idx = top_k_indices(hybrid, n_candidates)
+            cand_hybrid = np.take_along_axis(hybrid, local_idx, axis=-1)
+            cand_idx = local_idx if rows is None else rows[local_idx]
+        return cand_idx, cand_hybrid
+
+    def _list_candidates(
+        self,
+        expanded_queries: List[str],
+        q_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        n_candidates: int,
+        timer: StageTimer,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """RRF / weighted fusion over each retriever's top ``FUSION_DEPTH`` hits only."""
+        with timer.span("filter_mask"):
+            mask = self.metadata.mask(papers, sections)
+        if mask is not None and not mask.any():
+            return None
+        depth = max(FUSION_DEPTH, n_candidates)
+
+        with timer.span("bm25"):
+            bm25_lists = [self.bm25.top_k(self._tokenize(q), depth, mask) for q in expanded_queries]
+
+        with timer.span("dense_search"):
+            dense_scores, dense_idx = self.dense_index.search(q_embs, depth, mask)
+            dense_lists = [(s[i >= 0], i[i >= 0]) for s, i in zip(dense_scores, dense_idx)]
+
+        with timer.span("fusion"):
+            return fuse_lists(bm25_lists, dense_lists, self.fusion_mode, self.section_boost, n_candidates)
+
+    def _rerank(
+        self,
+        queries: List[str],
+        cand_idx: np.ndarray,
+        cand_hybrid: np.ndarray,
+        final_k: int,
+        timer: StageTimer,
+        text_chars: Optional[int] = RESULT_TEXT_CHARS,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Rerank each query's candidates (corpus indices in hybrid order, -1
+        padded) and format its top ``final_k``. Candidates the cascade did
+        not score follow the scored ones in hybrid order, with a None score.
+        """
+        valid = cand_idx >= 0
+        rerank_scores = np.full(cand_idx.shape, -np.inf)
+        if self.reranker == "late-interaction":
+            # One token-level encode of the queries, then MaxSim against the
+            # precomputed candidate token embeddings
+            with timer.span("query_token_encode"):
+                q_tokens = query_tokens(self.token_index, self.bi_encoder, queries)
+            with timer.span("rerank"):
+                for qi, tokens in enumerate(q_tokens):
+                    rerank_scores[qi, valid[qi]] = self.token_index.maxsim(tokens, cand_idx[qi, valid[qi]])
+        elif self.cascade is not None:
+            with timer.span("rerank"):
+                rerank_scores = self.cascade.run(
+                    lambda positions, idx: self.rerank_cache.predict(
+                        self.cross_encoder,
+                        [queries[qi] for qi in positions],
+                        [self.corpus_texts[i] for i in idx],
+                        [self.registry.corpus_hashes[i] for i in idx],
+                        batch_size=RERANK_BATCH_SIZE,
+                    ),
+                    cand_idx,
+                    cand_hybrid,
+                    final_k,
+                )
+        else:
+            # Cross-encoder rerank: cached pairs are reused, the rest go to the
+            # model together in RERANK_BATCH_SIZE batches
+            with timer.span("rerank"):
+                flat_idx = cand_idx[valid]
+                rerank_scores[valid] = self.rerank_cache.predict(
+                    self.cross_encoder,
+                    [q for q, n in zip(queries, valid.sum(axis=1)) for _ in range(n)],
+                    [self.corpus_texts[i] for i in flat_idx],
+                    [self.registry.corpus_hashes[i] for i in flat_idx],
+                    batch_size=RERANK_BATCH_SIZE,
+                )
+        score_key = "cross_encoder_score" if self.reranker == "cross-encoder" else "late_interaction_score"
+
+        with timer.span("format"):
+            scored = ~np.isnan(rerank_scores) & valid
+            # Scored candidates by rerank score, then unscored valid ones in
+            # hybrid (column) order, then padding
+            tier = np.where(scored, 0, np.where(valid, 1, 2))
+            key = np.where(scored, -rerank_scores, 0.0)
+            columns = np.broadcast_to(np.arange(cand_idx.shape[1]), cand_idx.shape)
+            all_results = []
+            for qi in range(len(queries)):
+                n_valid = int(valid[qi].sum())
+                order = np.lexsort((columns[qi], key[qi], tier[qi]))[: min(final_k, n_valid)]
+                results = []
+                for rank, ci in enumerate(order, start=1):
+                    results.append(
+                        {
+                            "rank": rank,
+                            "hybrid_score": float(cand_hybrid[qi, ci]),
+                            score_key: float(rerank_scores[qi, ci]) if scored[qi, ci] else None,
+                            **self.chunks.result_fields(cand_idx[qi, ci], text_chars),
+                        }
+                    )
+                all_results.append(results)
+        return all_results
+
+
+class ShardedImprovedRetriever(ImprovedRetriever):
+    """
+    ImprovedRetriever whose BM25 and dense scoring run in ``shards`` worker
+    processes, one corpus partition each (see ``retrieval/sharding.py``).
+    Query expansion, query encoding and the cross-encoder rerank of the merged
+    candidates stay in this process; results match the in-process pipeline.
+    """
+
+    def __init__(
+        self,
+        chunks_path: Optional[Path] = None,
+        registry: Optional[ResourceRegistry] = None,
+        shards: int = SHARDS,
+        fusion_mode: str = FUSION_MODE,
+        result_cache: Optional[SemanticResultCache] = None,
+        reranker: str = RERANKER,
+        cascade: bool = RERANK_CASCADE,
+    ):
+        self.shards = shards
+        super().__init__(chunks_path, registry, fusion_mode, result_cache, reranker, cascade)
+
+    def _init_indexes(self) -> None:
+        """
+        Start the shard workers instead; each loads BM25 and dense indexes for
+        its own rows from the embedding store ``__init__`` made sure is on disk.
+        """
+        self.pool = ShardPool(
+            self.shards,
+            self.chunks.path,
+            len(self.chunks),
+            self.registry.embeddings_path,
+            ImprovedRetriever._section_boost,
+            self.registry.index_dir,
+        )
+
+    def _hybrid_candidates(
+        self,
+        expanded_queries: List[str],
+        q_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        n_candidates: int,
+        timer: StageTimer,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        tokenized = [self._tokenize(q) for q in expanded_queries]
+        if self.fusion_mode != "full":
+            with timer.span("shard_scatter_gather"):
+                bm25_lists, dense_lists = self.pool.top_lists(
+                    tokenized, q_embs, papers, sections, max(FUSION_DEPTH, n_candidates)
+                )
+            with timer.span("fusion"):
+                return fuse_lists(bm25_lists, dense_lists, self.fusion_mode, self.section_boost, n_candidates)
+        with timer.span("shard_scatter_gather"):
+            return self.pool.candidates(
+                tokenized,
+                q_embs,
+                papers,
+                sections,
+                n_candidates,
+                fuse_scores,
+            )
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+def create_improved_retriever(
+    registry: Optional[ResourceRegistry] = None,
+    shards: int = SHARDS,
+    fusion_mode: str = FUSION_MODE,
+    result_cache: Optional[SemanticResultCache] = None,
+    reranker: str = RERANKER,
+    cascade: bool = RERANK_CASCADE,
+) -> ImprovedRetriever:
+    """In-process retriever, or the sharded one when ``shards`` > 1."""
+    kwargs = {"fusion_mode": fusion_mode, "result_cache": result_cache, "reranker": reranker, "cascade": cascade}
+    if shards > 1:
+        return ShardedImprovedRetriever(registry=registry, shards=shards, **kwargs)
+    return ImprovedRetriever(registry=registry, **kwargs)
+
+
+def score_range(scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-query (min, max) of a (queries x docs) score matrix."""
+    return scores.min(axis=1), scores.max(axis=1)
 
-def run_improved(query: str, output_path: Path) -> Dict[str, Any]:
+
+def fuse_scores(
+    bm25_scores: np.ndarray,
+    dense_scores: np.ndarray,
+    bm25_range: Tuple[np.ndarray, np.ndarray],
+    dense_range: Tuple[np.ndarray, np.ndarray],
+) -> np.ndarray:
+    """
+    Weighted sum of min-max normalized BM25 and dense scores. The (min, max)
+    ranges are passed in so shards of a partitioned corpus can normalize
+    with the collection-wide values.
+    """
+
+    def norm(x: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        lo, span = lo[:, None], (hi - lo)[:, None]
+        return np.divide(x - lo, span, out=np.zeros_like(x, dtype=np.float64), where=span > 0)
+
+    return BM25_WEIGHT * norm(bm25_scores, *bm25_range) + VECTOR_WEIGHT * norm(dense_scores, *dense_range)
+
+
+def fuse_lists(
+    bm25_lists: List[RankedList],
+    dense_lists: List[RankedList],
+    mode: str,
+    section_boost: np.ndarray,
+    n_candidates: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse each query's BM25 and dense top lists over their union, apply the
+    section boost and keep the best ``n_candidates``. ``rrf`` adds
+    ``weight / (RRF_K + rank)`` per list; ``weighted`` min-max normalizes each
+    list's scores and adds them with the weights (absent from a list = 0).
+    Returns (corpus indices, fused scores), padded with -1 / -inf.
+    """
+    cand_idx = np.full((len(bm25_lists), n_candidates), -1, dtype=np.int64)
+    cand_scores = np.full((len(bm25_lists), n_candidates), -np.inf)
+    for qi, lists in enumerate(zip(bm25_lists, dense_lists)):
+        ids = np.union1d(lists[0][1], lists[1][1]).astype(np.int64)
+        fused = np.zeros(len(ids))
+        for (scores, docs), weight in zip(lists, (BM25_WEIGHT, VECTOR_WEIGHT)):
+            if not len(docs):
+                continue
+            pos = np.searchsorted(ids, docs)
+            if mode == "rrf":
+                fused[pos] += weight / (RRF_K + np.arange(1, len(docs) + 1))
+            else:
+                lo, span = scores.min(), scores.max() - scores.min()
+                fused[pos] += weight * ((scores - lo) / span if span > 0 else np.zeros(len(docs)))
+        fused *= section_boost[ids]
+        top = top_k_indices(fused, n_candidates)
+        cand_idx[qi, : len(top)] = ids[top]
+        cand_scores[qi, : len(top)] = fused[top]
+    return cand_idx, cand_scores
+
+
+def _pipeline_notes(retriever: ImprovedRetriever) -> str:
+    """One-line description of the pipeline ``retriever`` actually runs."""
+    if retriever.reranker == "late-interaction":
+        rerank = "late-interaction (MaxSim) reranking"
+    elif retriever.cascade is not None:
+        rerank = "adaptive cascade cross-encoder reranking"
+    else:
+        rerank = "cross-encoder reranking"
+    return (
+        f"Hybrid BM25+dense ({retriever.fusion_mode} fusion) with query expansion, "
+        f"section-aware boosting, and {rerank}."
+    )
+
+
+def run_improved(
+    query: str,
+    output_path: Path,
+    registry: Optional[ResourceRegistry] = None,
+    papers: Optional[List[str]] = None,
+    sections: Optional[List[str]] = None,
+    shards: int = SHARDS,
+) -> Dict[str, Any]:
     """
     Run the improved multi-stage retrieval pipeline and persist outputs.
     Returns the payload so downstream steps (evaluation/generation) can reuse it.
     """
-    retriever = ImprovedRetriever()
-    results = retriever.retrieve(query)
+    registry = registry or get_registry()
+    retriever, setup_ms = timed_setup(registry, lambda: create_improved_retriever(registry, shards))
+    timer = StageTimer()
+    try:
+        results = retriever.retrieve(query, papers, sections, timer)
+    finally:
+        if isinstance(retriever, ShardedImprovedRetriever):
+            retriever.close()
     payload = {
         "query": query,
-        "strategy": "improved_hybrid_bm25_dense_rerank",
+        "strategy": STRATEGY,
         "top_k": len(results),
         "results": results,
-        "notes": (
-            "Hybrid BM25+dense with query expansion, section-aware boosting, "
-            "and cross-encoder reranking."
-        ),
+        "notes": _pipeline_notes(retriever),
+        "timings": {**timer.as_dict(), "setup_ms": setup_ms},
     }
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(payload, f, indent=2)
     return payload
+
+
+def run_improved_batch(
+    queries_path: Path,
+    output_path: Path,
+    registry: Optional[ResourceRegistry] = None,
+    papers: Optional[List[str]] = None,
+    sections: Optional[List[str]] = None,
+    histogram: Optional[LatencyHistogram] = None,
+    shards: int = SHARDS,
+    stats: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Run the improved pipeline for every query in a JSONL file, streaming one
+    result line per query to ``output_path``. Returns the number of queries;
+    with a rerank cascade, its statistics are stored in ``stats`` when given.
+    """
+    retriever = create_improved_retriever(registry, shards, result_cache=get_result_cache())
+    try:
+        n_queries = stream_batch_results(
+            lambda queries, timer: retriever.retrieve_batch(queries, papers, sections, timer),
+            queries_path,
+            output_path,
+            STRATEGY,
+            histogram=histogram,
+        )
+        if stats is not None and retriever.cascade is not None:
+            stats["rerank_cascade"] = retriever.cascade.stats()
+        return n_queries
+    finally:
+        if isinstance(retriever, ShardedImprovedRetriever):
+            retriever.close()
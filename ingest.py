@@ -0,0 +1,304 @@
+"""
+Incremental PDF ingestion: data/papers/*.pdf -> data/chunks.jsonl.
+
+PDFs are extracted in a process pool with pypdf, split into sections by
+heading detection (the ``section`` field the improved retriever boosts on),
+chunked into overlapping word windows and streamed to a JSONL chunk store.
+A manifest records the content hash of every ingested PDF, so re-running only
+re-extracts new or changed files; chunks of unchanged papers are copied over
+from the previous store line by line, and new papers are spooled to disk as
+each worker finishes rather than held in memory.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from config import (
+    CHUNK_OVERLAP_WORDS,
+    CHUNK_SIZE_WORDS,
+    CHUNK_STORE_PATH,
+    INGEST_MANIFEST_PATH,
+    INGEST_WORKERS,
+    PAPERS_DIR,
+    RAW_TEXT_DIR,
+)
+from retrieval.chunk_store import iter_chunks
+
+SECTION_NAMES = (
+    "abstract",
+    "introduction",
+    "background",
+    "related work",
+    "preliminaries",
+    "method",
+    "methods",
+    "methodology",
+    "approach",
+    "model",
+    "model architecture",
+    "architecture",
+    "experiments",
+    "experimental setup",
+    "experimental results",
+    "results",
+    "evaluation",
+    "analysis",
+    "discussion",
+    "limitations",
+    "conclusion",
+    "conclusions",
+    "references",
+    "acknowledgments",
+    "acknowledgements",
+    "appendix",
+)
+SKIP_SECTIONS = {"references", "acknowledgments", "acknowledgements"}
+
+_NUMBERED_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*|[IVX]+)\.?\s+([A-Z][A-Za-z][\w \-:&,]{1,60})$")
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def paper_id_for(path: Path) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", path.stem).strip("_").lower() or "paper"
+
+
+def _heading(line: str) -> str | None:
+    """Return the section title if ``line`` looks like a section heading."""
+    line = line.strip()
+    if not line or len(line) > 70:
+        return None
+    bare = re.sub(r"^(?:\d+(?:\.\d+)*|[IVX]+)\.?\s+", "", line).strip().rstrip(":")
+    if bare.lower() in SECTION_NAMES:
+        return bare.title()
+    match = _NUMBERED_HEADING.match(line)
+    # Only top-level numbered headings ("3 Training"), not "3.1 ..." subsections.
+    if (
+        match
+        and "." not in line.split(None, 1)[0].rstrip(".")
+        and not line.endswith(".")
+        and len(match.group(1).split()) <= 6
+    ):
+        return match.group(1).strip()
+    return None
+
+
+def split_sections(text: str) -> List[Tuple[str, str]]:
+    """Split extracted paper text into (section, body) pairs."""
+    sections: List[Tuple[str, List[str]]] = [("Preamble", [])]
+    for line in text.splitlines():
+        title = _heading(line)
+        if title:
+            sections.append((title, []))
+        else:
+            sections[-1][1].append(line)
+    out = []
+    for title, lines in sections:
+        body = " ".join(" ".join(lines).split())
+        if body:
+            out.append((title, body))
+    return out
+
+
+def chunk_words(body: str, size: int = CHUNK_SIZE_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    words = body.split()
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start : start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+def process_pdf(path: str, paper_id: str) -> Dict[str, Any]:
+    """Extract, section and chunk one PDF. Runs in a worker process."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    title = (reader.metadata.title if reader.metadata else None) or Path(path).stem
+
+    RAW_TEXT_DIR.mkdir(parents=True, exist_ok=True)
+    (RAW_TEXT_DIR / f"{paper_id}.txt").write_text(text, encoding="utf-8")
+
+    chunks = []
+    for section, body in split_sections(text):
+        if section.lower() in SKIP_SECTIONS:
+            continue
+        for piece in chunk_words(body):
+            chunks.append(
+                {
+                    "id": f"{paper_id}_chunk_{len(chunks)}",
+                    "paper_id": paper_id,
+                    "source": title,
+                    "section": section,
+                    "text": piece,
+                }
+            )
+    return {"paper_id": paper_id, "chunks": chunks}
+
+
+def _load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def assign_paper_ids(pdfs: List[Path], manifest: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Unique paper id per PDF name. Files already in ``manifest`` keep their
+    recorded id; a new file whose ``paper_id_for`` id is taken (``a-b.pdf``
+    vs ``a_b.pdf``) gets a suffix from a hash of its file name.
+    """
+    ids: Dict[str, str] = {}
+    for pdf in pdfs:
+        paper_id = manifest.get(pdf.name, {}).get("paper_id")
+        if paper_id and paper_id not in ids.values():
+            ids[pdf.name] = paper_id
+    taken = set(ids.values())
+    for pdf in pdfs:
+        if pdf.name in ids:
+            continue
+        paper_id = paper_id_for(pdf)
+        if paper_id in taken:
+            paper_id = f"{paper_id}_{hashlib.sha1(pdf.name.encode('utf-8')).hexdigest()[:8]}"
+            print(f"{pdf.name}: paper id collides with another file, using {paper_id}")
+        ids[pdf.name] = paper_id
+        taken.add(paper_id)
+    return ids
+
+
+def ingest(
+    papers_dir: Path = PAPERS_DIR,
+    store_path: Path = CHUNK_STORE_PATH,
+    manifest_path: Path = INGEST_MANIFEST_PATH,
+    workers: int = INGEST_WORKERS,
+    force: bool = False,
+) -> Dict[str, int]:
+    """
+    Bring ``store_path`` in line with the PDFs in ``papers_dir``. Returns
+    counts of processed, unchanged, failed and removed papers and total
+    chunks. Each extracted paper is spooled to its own file as soon as its
+    worker finishes, and the store is then merged in PDF name order from the
+    spool files and the previous store, so memory holds one paper at a time.
+    A PDF that fails to extract is reported and keeps its previously
+    ingested chunks and manifest entry, so the next run retries it.
+    """
+    store = str(store_path.resolve())
+    previous = _load_manifest(manifest_path)
+    manifest = {} if force else previous
+    pdfs = sorted(papers_dir.glob("*.pdf"))
+    paper_ids = assign_paper_ids(pdfs, previous)
+    current = {p.name: {"hash": file_hash(p), "paper_id": paper_ids[p.name], "store": store} for p in pdfs}
+    rank = {paper_ids[p.name]: i for i, p in enumerate(pdfs)}
+
+    # Chunks can only be copied over from the store this manifest describes.
+    def reusable(name: str, entries: Dict[str, Dict[str, Any]]) -> bool:
+        entry = entries.get(name, {})
+        return (
+            store_path.exists()
+            and entry.get("store") == store
+            and entry.get("paper_id") == current[name]["paper_id"]
+        )
+
+    unchanged = {
+        name for name in current if reusable(name, manifest) and manifest[name]["hash"] == current[name]["hash"]
+    }
+    todo = [p for p in pdfs if p.name not in unchanged]
+    new_manifest = {name: manifest[name] for name in unchanged}
+
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    spool_dir = Path(tempfile.mkdtemp(prefix=".ingest_", dir=store_path.parent))
+    spooled: Dict[str, Path] = {}
+    failed = 0
+    try:
+        if todo:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+                futures = {pool.submit(process_pdf, str(p), current[p.name]["paper_id"]): p for p in todo}
+                for future in as_completed(futures):
+                    pdf = futures.pop(future)
+                    try:
+                        chunks = future.result()["chunks"]
+                    except Exception as e:
+                        failed += 1
+                        kept = " (keeping its previous chunks)" if reusable(pdf.name, previous) else ""
+                        print(f"Failed to ingest {pdf.name}{kept}: {type(e).__name__}: {e}")
+                        if kept:
+                            new_manifest[pdf.name] = previous[pdf.name]
+                        continue
+                    path = spool_dir / f"{current[pdf.name]['paper_id']}.jsonl"
+                    with open(path, "w", encoding="utf-8") as f:
+                        for chunk in chunks:
+                            f.write(json.dumps(chunk) + "\n")
+                    spooled[current[pdf.name]["paper_id"]] = path
+                    new_manifest[pdf.name] = {**current[pdf.name], "num_chunks": len(chunks)}
+                    print(f"Ingested {pdf.name}: {len(chunks)} chunks")
+
+        # Merge kept and new papers in PDF name order; both sides stream from disk.
+        keep_papers = {new_manifest[name]["paper_id"] for name in new_manifest} - set(spooled)
+        pending = sorted(spooled, key=rank.__getitem__, reverse=True)
+        tmp_path = store_path.with_suffix(".tmp.jsonl")
+        total = 0
+        with open(tmp_path, "w", encoding="utf-8") as out:
+
+            def write_new_before(limit: float) -> None:
+                nonlocal total
+                while pending and rank[pending[-1]] < limit:
+                    with open(spooled[pending.pop()], "r", encoding="utf-8") as f:
+                        for line in f:
+                            out.write(line)
+                            total += 1
+
+            if keep_papers:
+                for chunk in iter_chunks(store_path):
+                    if chunk.get("paper_id") in keep_papers:
+                        write_new_before(rank[chunk["paper_id"]])
+                        out.write(json.dumps(chunk) + "\n")
+                        total += 1
+            write_new_before(float("inf"))
+        os.replace(tmp_path, store_path)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+    manifest_path.write_text(json.dumps(new_manifest, indent=2), encoding="utf-8")
+
+    return {
+        "processed": len(spooled),
+        "unchanged": len(unchanged),
+        "failed": failed,
+        "removed": len(set(manifest) - set(current)),
+        "chunks": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest data/papers/*.pdf into a JSONL chunk store.")
+    parser.add_argument("--papers-dir", type=Path, default=PAPERS_DIR)
+    parser.add_argument("--output", type=Path, default=CHUNK_STORE_PATH)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="0 = one per CPU core.")
+    parser.add_argument("--force", action="store_true", help="Re-extract every PDF.")
+    args = parser.parse_args()
+
+    stats = ingest(args.papers_dir, args.output, INGEST_MANIFEST_PATH, args.workers, args.force)
+    print(
+        f"{stats['processed']} processed, {stats['unchanged']} unchanged, {stats['failed']} failed, "
+        f"{stats['removed']} removed; {stats['chunks']} chunks in {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,49 @@
 from pathlib import Path
+from typing import Any, Callable, Dict, List
 import argparse
+import json
 
-from baseline.baseline_retrieval import run_baseline
-from improved.improved_retrieval import run_improved
-from evaluation.evaluator import evaluate_and_report
-from generation import write_generation_report
-from config import ROOT_DIR
+import config
+from config import EVAL_CUTOFFS, PIPELINE_WORKERS, QRELS_PATH, ROOT_DIR, SHARDS
+
+# Pipeline stages. pipeline.py runs them as a DAG: baseline and improved in
+# parallel, then evaluate and generate. Retrieval modules (numpy, models) are
+# imported only by the stages that need them, so --help and report-only runs
+# start without touching torch.
+STAGES = ("baseline", "improved", "evaluate", "generate")
+
+# config.py values each stage's cached output depends on (besides the
+# query, filters, corpus version and its source files). The improved and
+# evaluation stages also use the evaluator's RUN_SETTINGS.
+_MODEL_SETTINGS = (
+    "EMBEDDING_MODEL_NAME",
+    "CROSS_ENCODER_MODEL_NAME",
+    "ENCODER_BACKEND",
+    "HASHING_DIM",
+    "INFERENCE_BACKEND",
+)
+_DENSE_SETTINGS = (
+    "DENSE_INDEX_BACKEND",
+    "IVF_NLIST",
+    "IVF_NPROBE",
+    "IVF_TRAIN_ITERS",
+    "IVF_TRAIN_SAMPLE",
+    "EMBEDDING_STORAGE",
+    "RESCORE_CANDIDATES",
+    "RANDOM_SEED",
+)
+BASELINE_SETTINGS = _MODEL_SETTINGS + _DENSE_SETTINGS + ("TOP_K_BASELINE", "RESULT_TEXT_CHARS")
+IMPROVED_SETTINGS = _MODEL_SETTINGS + _DENSE_SETTINGS + ("TOP_K_IMPROVED_FINAL", "RESULT_TEXT_CHARS")
+EVALUATE_SETTINGS = ("EVAL_RUN_DEPTH",)
+GENERATE_SETTINGS = ("CONTEXT_TOKEN_BUDGET", "SIMHASH_MAX_DISTANCE", "CONTEXT_MIN_PASSAGE_TOKENS")
+
+
+def _load_payload(path: Path, stage: str) -> Dict[str, Any]:
+    """Result payload saved by an earlier run of ``stage``."""
+    if not path.exists():
+        raise SystemExit(f"{path} not found; include '{stage}' in --stages to produce it.")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
 
 def main():
@@ -15,25 +53,306 @@ def main():
         type=str,
         default="How does retrieval-augmented generation reduce hallucinations in LLMs?",
     )
+    parser.add_argument(
+        "--queries-file",
+        type=Path,
+        default=None,
+        help="JSONL file of queries to run in batch mode (one {\"query\": ...} per line).",
+    )
+    parser.add_argument(
+        "--paper",
+        action="append",
+        dest="papers",
+        help="Restrict retrieval to this paper_id (repeatable).",
+    )
+    parser.add_argument(
+        "--section",
+        action="append",
+        dest="sections",
+        help="Restrict retrieval to this section name, case-insensitive (repeatable).",
+    )
+    parser.add_argument(
+        "--qrels",
+        type=Path,
+        default=QRELS_PATH,
+        help="JSONL relevance judgments; when present both retrievers are scored over its queries.",
+    )
+    parser.add_argument(
+        "--cutoffs",
+        type=int,
+        nargs="+",
+        default=list(EVAL_CUTOFFS),
+        help="Rank cutoffs for Precision/Recall/NDCG@k.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=list(STAGES),
+        help=(
+            "Stages to run. Independent stages run concurrently, and a stage whose inputs are "
+            "unchanged is restored from the stage cache. Skipped retrieval stages reuse "
+            "their saved results, e.g. '--stages evaluate generate' re-renders reports only."
+        ),
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=SHARDS,
+        help="Split improved-retriever scoring across this many worker processes (>1 = sharded).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PIPELINE_WORKERS,
+        help="Threads for independent pipeline stages (the two retrieval arms, evaluation and generation).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Rerun every selected stage even if its cached output is current (the cache is still refreshed).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a per-stage latency breakdown (model load, encode, BM25, rerank, ...).",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help=(
+            "Also track peak traced memory per stage (implies --profile). The peak is process-wide, "
+            "so pipeline stages run one at a time (--workers 1)."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-out",
+        type=Path,
+        default=None,
+        help="Write aggregated stage latency histograms in Prometheus text format.",
+    )
     args = parser.parse_args()
+    stages = set(args.stages)
+    filters = {"papers": args.papers, "sections": args.sections}
+
+    from retrieval.profiling import LatencyHistogram, format_breakdown, format_setup, set_memory_tracking
+
+    if args.profile_memory:
+        set_memory_tracking(True)
+        args.profile = True
+    if args.profile_memory or config.PROFILE_MEMORY:
+        # tracemalloc peaks are process-wide: concurrent stages would count each other's allocations
+        args.workers = 1
+    histogram = LatencyHistogram()
+
+    evaluation_dir = ROOT_DIR / "evaluation"
+
+    if args.queries_file:
+        from baseline.baseline_retrieval import run_baseline_batch
+        from improved.improved_retrieval import run_improved_batch
+        from retrieval.registry import get_registry
+
+        # One registry for both arms: models, chunks, embeddings and BM25 load once.
+        registry = get_registry()
+        if "baseline" in stages:
+            baseline_out = ROOT_DIR / "baseline" / "baseline_results.jsonl"
+            n_baseline = run_baseline_batch(
+                args.queries_file, baseline_out, registry, **filters, histogram=histogram
+            )
+            print(f"Baseline results for {n_baseline} queries written to {baseline_out}")
+        if "improved" in stages:
+            improved_out = ROOT_DIR / "improved" / "improved_results.jsonl"
+            improved_stats: Dict[str, Any] = {}
+            n_improved = run_improved_batch(
+                args.queries_file,
+                improved_out,
+                registry,
+                **filters,
+                histogram=histogram,
+                shards=args.shards,
+                stats=improved_stats,
+            )
+            print(f"Improved results for {n_improved} queries written to {improved_out}")
+            if "rerank_cascade" in improved_stats:
+                print(f"Rerank cascade: {json.dumps(improved_stats['rerank_cascade'])}")
+            from retrieval.result_cache import get_result_cache
+
+            result_cache = get_result_cache()
+            if result_cache is not None:
+                print(f"Result cache: {json.dumps(result_cache.stats())}")
+        if args.profile:
+            print(json.dumps(histogram.summary(), indent=2))
+        if args.metrics_out:
+            histogram.write_prometheus(args.metrics_out)
+            print(f"Stage latency histograms written to {args.metrics_out}")
+        return
+
+    from pipeline import StageCache, format_report, run_stages
+
+    stage_list = _build_stages(args, stages, evaluation_dir)
+    results, report = run_stages(stage_list, StageCache(), workers=args.workers, force=args.no_cache)
+    print("Pipeline stages:")
+    print("\n".join(format_report({name: info for name, info in report.items() if name in stages})))
+    for name, message in (
+        ("baseline", f"Baseline results written to {ROOT_DIR / 'baseline' / 'baseline_results.json'}"),
+        ("improved", f"Improved results written to {ROOT_DIR / 'improved' / 'improved_results.json'}"),
+        ("evaluate", f"Evaluation artifacts written to {evaluation_dir}"),
+        ("generate", f"Generation report written to {evaluation_dir / 'generation_report.md'}"),
+    ):
+        if name in stages:
+            print(message)
+
+    # Timings only describe retrieval that ran in this process (not cache hits).
+    ran = {
+        label: results[stage]
+        for label, stage in (("Baseline", "baseline"), ("Improved", "improved"))
+        if stage in stages and report[stage]["status"] == "ran"
+    }
+    if args.profile and ran:
+        from retrieval.registry import get_registry
+
+        # Both arms share one registry and may load it concurrently, so its load times are not per arm
+        print(format_setup("Registry setup (shared)", get_registry().load_times_ms))
+        for label, payload in ran.items():
+            print(format_breakdown(label, payload["timings"]))
+    if args.metrics_out and ran:
+        for payload in ran.values():
+            for stage, ms in payload["timings"]["stages_ms"].items():
+                histogram.observe(payload["strategy"], stage, ms)
+        histogram.write_prometheus(args.metrics_out)
+        print(f"Stage latency histograms written to {args.metrics_out}")
 
+
+def _build_stages(args: argparse.Namespace, stages: set, evaluation_dir: Path) -> List[Any]:
+    """
+    The single-query pipeline as a DAG: both retrieval arms, then evaluation
+    and generation, each keyed on the inputs it reads. Retrieval stages left
+    out of ``--stages`` load their saved results instead (never cached).
+    """
+    from evaluation.evaluator import RUN_SETTINGS
+    from pipeline import Stage, corpus_version, file_digest, settings, source_digest
+
+    filters = {"papers": args.papers, "sections": args.sections}
+    version = corpus_version()
+    retrieval_sources = list((ROOT_DIR / "retrieval").glob("*.py"))
     baseline_out = ROOT_DIR / "baseline" / "baseline_results.json"
     improved_out = ROOT_DIR / "improved" / "improved_results.json"
-    evaluation_dir = ROOT_DIR / "evaluation"
 
-    baseline_payload = run_baseline(args.query, baseline_out)
-    improved_payload = run_improved(args.query, improved_out)
+    def run_baseline_stage(_: Dict[str, Any]) -> Dict[str, Any]:
+        from baseline.baseline_retrieval import run_baseline
+        from retrieval.registry import get_registry
 
-    evaluate_and_report(args.query, baseline_payload, improved_payload, evaluation_dir)
-    write_generation_report(
-        baseline_payload,
-        improved_payload,
-        evaluation_dir / "generation_report.md",
-    )
+        return run_baseline(args.query, baseline_out, get_registry(), **filters)
+
+    def run_improved_stage(_: Dict[str, Any]) -> Dict[str, Any]:
+        from improved.improved_retrieval import run_improved
+        from retrieval.registry import get_registry
+
+        return run_improved(args.query, improved_out, get_registry(), **filters, shards=args.shards)
+
+    def run_evaluate_stage(upstream: Dict[str, Any]) -> Dict[str, Any]:
+        from evaluation.evaluator import evaluate_and_report, evaluate_retrievers
+
+        evaluation = None
+        if args.qrels.exists():
+            from retrieval.registry import get_registry
+
+            # Cached runs are reused, so models only load if a run is missing.
+            evaluation = evaluate_retrievers(get_registry(), args.qrels, args.cutoffs, **filters)
+        return evaluate_and_report(
+            upstream["improved"]["query"], upstream["baseline"], upstream["improved"], evaluation_dir, evaluation
+        )
+
+    def run_generate_stage(upstream: Dict[str, Any]) -> Dict[str, Any]:
+        from generation import write_generation_report
+        from retrieval.registry import get_registry
+
+        # Full chunk texts and SimHash signatures for context packing.
+        return write_generation_report(
+            upstream["baseline"],
+            upstream["improved"],
+            evaluation_dir / "generation_report.md",
+            get_registry().chunks,
+        )
+
+    def retrieval_inputs(names, module: Path) -> Callable[[], Dict[str, Any]]:
+        return lambda: {
+            "query": args.query,
+            "filters": filters,
+            "corpus": version,
+            "settings": settings(names),
+            "sources": source_digest(retrieval_sources + [module]),
+        }
 
-    print(f"Baseline results written to {baseline_out}")
-    print(f"Improved results written to {improved_out}")
-    print(f"Evaluation artifacts written to {evaluation_dir}")
+    out = []
+    for name, path, run, names, module in (
+        ("baseline", baseline_out, run_baseline_stage, BASELINE_SETTINGS, ROOT_DIR / "baseline" / "baseline_retrieval.py"),
+        ("improved", improved_out, run_improved_stage, IMPROVED_SETTINGS + RUN_SETTINGS, ROOT_DIR / "improved" / "improved_retrieval.py"),
+    ):
+        if name in stages:
+            # A cascade's latency budget makes the ranking depend on machine load: never reuse it
+            cacheable = not (name == "improved" and config.RERANK_CASCADE and config.RERANK_LATENCY_BUDGET_MS is not None)
+            out.append(
+                Stage(
+                    name,
+                    run,
+                    inputs=retrieval_inputs(names, module),
+                    outputs=[path],
+                    volatile=("timings",),
+                    cacheable=cacheable,
+                )
+            )
+        else:
+            out.append(
+                Stage(
+                    name,
+                    lambda _, path=path, name=name: _load_payload(path, name),
+                    volatile=("timings",),
+                    cacheable=False,
+                )
+            )
+    if "evaluate" in stages:
+        out.append(
+            Stage(
+                "evaluate",
+                run_evaluate_stage,
+                deps=("baseline", "improved"),
+                inputs=lambda: {
+                    "qrels": [str(args.qrels), file_digest(args.qrels)],
+                    "cutoffs": args.cutoffs,
+                    "filters": filters,
+                    "corpus": version,
+                    "settings": settings(BASELINE_SETTINGS + IMPROVED_SETTINGS + RUN_SETTINGS + EVALUATE_SETTINGS),
+                    "sources": source_digest(
+                        retrieval_sources
+                        + [
+                            ROOT_DIR / "evaluation" / "evaluator.py",
+                            ROOT_DIR / "baseline" / "baseline_retrieval.py",
+                            ROOT_DIR / "improved" / "improved_retrieval.py",
+                        ]
+                    ),
+                },
+                outputs=[evaluation_dir / name for name in ("comparison_table.md", "evaluation_summary.md", "metrics.json")],
+            )
+        )
+    if "generate" in stages:
+        out.append(
+            Stage(
+                "generate",
+                run_generate_stage,
+                deps=("baseline", "improved"),
+                inputs=lambda: {
+                    "corpus": version,
+                    "settings": settings(GENERATE_SETTINGS),
+                    "sources": source_digest(
+                        [ROOT_DIR / "generation.py"]
+                        + [ROOT_DIR / "retrieval" / f for f in ("context.py", "text.py", "chunk_table.py")]
+                    ),
+                },
+                outputs=[evaluation_dir / "generation_report.md"],
+            )
+        )
+    return out
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+"""
+Content-addressed stage cache and DAG executor for ``main.py``.
+
+The single-query pipeline is a small DAG: the baseline and improved retrieval
+arms are independent, and evaluation and generation each depend on both.
+Every stage has a cache key: a hash of its declared inputs (query, filters,
+corpus version, model names, the ``config.py`` values it reads and the source
+files that implement it) and of the results of the stages it depends on. A
+stage whose key is found under ``STAGE_CACHE_DIR`` is not run: its result is
+read back and its output files are restored from the cache. Because keys
+cover upstream *results* rather than upstream keys, a retrieval stage that
+reran but returned the same ranking does not invalidate the reports.
+
+Stages run in a thread pool as soon as their dependencies are done, so the
+two retrieval arms (and the two report stages) overlap.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import config
+from config import PIPELINE_WORKERS, ROOT_DIR, STAGE_CACHE_DIR
+from retrieval.chunk_store import default_chunks_path
+from retrieval.snapshots import current_snapshot
+
+RESULT_FILE = "result.json"
+
+
+def _digest(obj: Any) -> str:
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def file_digest(path: Path) -> Optional[str]:
+    """SHA-1 of a file's bytes, or None when it does not exist."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def source_digest(paths: Iterable[Path]) -> Dict[str, Optional[str]]:
+    """Content digest of each source file (relative to the repository root)."""
+    return {str(Path(p).relative_to(ROOT_DIR)): file_digest(p) for p in sorted(paths)}
+
+
+def settings(names: Sequence[str]) -> Dict[str, Any]:
+    """Current ``config.py`` values of ``names``."""
+    return {name: getattr(config, name) for name in names}
+
+
+def corpus_version() -> str:
+    """
+    Cheap identity of the corpus ``get_registry()`` would serve: the published
+    snapshot's name, else the chunk store's path, size and modification time
+    (the same key the chunk table cache uses), so no chunk is read.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return f"snapshot:{snapshot.name}"
+    path = default_chunks_path().resolve()
+    stat = path.stat()
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Stage:
+    """
+    One pipeline step. ``run(upstream)`` gets the results of ``deps`` by
+    name and returns a JSON-serializable result; ``inputs()`` returns
+    everything else the result depends on. ``outputs`` are the files the
+    step writes, cached and restored with its result. Top-level result keys
+    in ``volatile`` (e.g. timings) are left out of the digest downstream
+    stages are keyed on. ``cacheable=False`` stages always run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[Dict[str, Any]], Any],
+        deps: Sequence[str] = (),
+        inputs: Callable[[], Dict[str, Any]] = dict,
+        outputs: Sequence[Path] = (),
+        volatile: Sequence[str] = (),
+        cacheable: bool = True,
+    ):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.inputs = inputs
+        self.outputs = [Path(p) for p in outputs]
+        self.volatile = tuple(volatile)
+        self.cacheable = cacheable
+
+    def result_digest(self, result: Any) -> str:
+        if isinstance(result, dict) and self.volatile:
+            result = {k: v for k, v in result.items() if k not in self.volatile}
+        return _digest(result)
+
+
+class StageCache:
+    """Stage results and output files stored under ``root/<stage>/<key>/``."""
+
+    def __init__(self, root: Path = STAGE_CACHE_DIR):
+        self.root = Path(root)
+
+    def _entry(self, stage: Stage, key: str) -> Path:
+        return self.root / stage.name / key
+
+    def get(self, stage: Stage, key: str) -> Tuple[bool, Any]:
+        """(hit, result); on a hit the stage's output files are restored first."""
+        entry = self._entry(stage, key)
+        result_path = entry / RESULT_FILE
+        if not result_path.exists():
+            return False, None
+        for i, output in enumerate(stage.outputs):
+            cached = entry / f"{i}_{output.name}"
+            if not cached.exists():
+                return False, None
+            if file_digest(output) != file_digest(cached):
+                output.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(cached, output)
+        with open(result_path, "r", encoding="utf-8") as f:
+            return True, json.load(f)
+
+    def put(self, stage: Stage, key: str, result: Any) -> None:
+        """Store ``result`` and copies of the stage's outputs (written under a temporary name, then renamed)."""
+        entry = self._entry(stage, key)
+        tmp = entry.with_name(f".{entry.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for i, output in enumerate(stage.outputs):
+            if output.exists():
+                shutil.copyfile(output, tmp / f"{i}_{output.name}")
+        with open(tmp / RESULT_FILE, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp, entry)
+
+
+def run_stages(
+    stages: Sequence[Stage],
+    cache: Optional[StageCache] = None,
+    workers: int = PIPELINE_WORKERS,
+    force: bool = False,
+) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Execute ``stages`` (any order; dependencies must be among them) and return
+    (results by stage name, {stage: {"status": "cached" | "ran", "ms", "key"}}).
+    With ``force`` every stage runs; results are still written to ``cache``.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown stages {missing}")
+
+    results: Dict[str, Any] = {}
+    digests: Dict[str, str] = {}
+    report: Dict[str, Dict[str, Any]] = {}
+    pending = list(stages)
+    running: Dict[Future, Tuple[Stage, Optional[str], float]] = {}
+
+    def finish(stage: Stage, key: Optional[str], result: Any, status: str, started: float) -> None:
+        results[stage.name] = result
+        digests[stage.name] = stage.result_digest(result)
+        report[stage.name] = {"status": status, "ms": round(1000 * (time.perf_counter() - started), 3), "key": key}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            progressed = False
+            for stage in [s for s in pending if all(dep in results for dep in s.deps)]:
+                pending.remove(stage)
+                progressed = True
+                started = time.perf_counter()
+                key = None
+                if stage.cacheable and cache is not None:
+                    key = _digest(
+                        {
+                            "stage": stage.name,
+                            "inputs": stage.inputs(),
+                            "deps": {dep: digests[dep] for dep in stage.deps},
+                        }
+                    )
+                    if not force:
+                        hit, result = cache.get(stage, key)
+                        if hit:
+                            finish(stage, key, result, "cached", started)
+                            continue
+                upstream = {dep: results[dep] for dep in stage.deps}
+                running[pool.submit(stage.run, upstream)] = (stage, key, started)
+            if progressed:
+                # Cache hits may have unblocked more stages
+                continue
+            if not running:
+                raise ValueError(f"Dependency cycle among stages {[s.name for s in pending]}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key, started = running.pop(future)
+                result = future.result()
+                if key is not None:
+                    cache.put(stage, key, result)
+                finish(stage, key, result, "ran", started)
+    return results, {stage.name: report[stage.name] for stage in stages}
+
+
+def format_report(report: Dict[str, Dict[str, Any]]) -> List[str]:
+    """One line per stage: name, whether it ran or came from the cache, wall time."""
+    return [f"  {name:<10}{info['status']:<8}{info['ms']:>10.1f} ms" for name, info in report.items()]
@@ -0,0 +1,364 @@
+"""
+Inverted-index BM25 (Okapi) engine.
+
+Postings are stored term-major in flat arrays: ``term_offsets`` delimits each
+term's list, document ids are delta-encoded per list and term frequencies are
+kept in the narrowest unsigned dtype that fits. IDF and per-document length
+norms are precomputed at build time, so scoring only touches the postings of
+the query terms. ``top_k`` adds MaxScore-style early termination: once no
+unseen document can reach the current k-th score, the remaining (low-impact)
+terms only update documents that can still make the cut.
+
+Scores match ``rank_bm25.BM25Okapi`` (same IDF floor via ``epsilon``).
+"""
+
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import BM25_B, BM25_EPSILON, BM25_K1, INDEX_DIR
+
+
+def _narrowest_uint(max_value: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class InvertedBM25:
+    """Array-backed BM25 index with compressed postings."""
+
+    def __init__(
+        self,
+        vocab: List[str],
+        term_offsets: np.ndarray,
+        doc_gaps: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+    ):
+        self.vocab = vocab
+        self.term_index: Dict[str, int] = {t: i for i, t in enumerate(vocab)}
+        self.term_offsets = term_offsets
+        self.doc_gaps = doc_gaps
+        self.term_freqs = term_freqs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self._precompute()
+
+    def _precompute(self) -> None:
+        self.corpus_size = len(self.doc_len)
+        self.avgdl = float(self.doc_len.mean()) if self.corpus_size else 0.0
+        self.idf = bm25_idf(self.document_frequencies(), self.corpus_size, self.epsilon)
+        self._precompute_norms()
+
+    def document_frequencies(self) -> np.ndarray:
+        return np.diff(self.term_offsets)
+
+    def set_collection_stats(self, idf: np.ndarray, avgdl: float) -> None:
+        """
+        Score with collection-wide statistics instead of this index's own:
+        ``idf`` aligned with ``vocab`` and the collection's average document
+        length. Used when this index holds one shard of a partitioned corpus.
+        """
+        self.idf = np.asarray(idf, dtype=np.float64)
+        self.avgdl = float(avgdl)
+        self._precompute_norms()
+
+    def _precompute_norms(self) -> None:
+        idf = self.idf
+        avgdl = self.avgdl or 1.0
+        self.doc_norm = self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)
+
+        # Per-term score upper bound, used for MaxScore pruning in top_k.
+        self.max_score = np.zeros(len(self.vocab))
+        if len(self.term_freqs):
+            docs = self._all_doc_ids()
+            tf = self.term_freqs.astype(np.float64)
+            term_of_posting = np.repeat(np.arange(len(self.vocab)), np.diff(self.term_offsets))
+            contrib = idf[term_of_posting] * tf * (self.k1 + 1) / (tf + self.doc_norm[docs])
+            nonempty = np.diff(self.term_offsets) > 0
+            self.max_score[nonempty] = np.maximum.reduceat(contrib, self.term_offsets[:-1][nonempty])
+
+    def _all_doc_ids(self) -> np.ndarray:
+        """Decode every postings list at once (used at build/load time)."""
+        gaps = self.doc_gaps.astype(np.int64)
+        docs = np.cumsum(gaps)
+        starts = self.term_offsets[:-1][np.diff(self.term_offsets) > 0]
+        # Undo the running sum across list boundaries.
+        base = np.zeros(len(gaps), dtype=np.int64)
+        base[starts[1:]] = docs[starts[1:] - 1]
+        return docs - np.maximum.accumulate(base)
+
+    @classmethod
+    def build(cls, tokenized_corpus: List[List[str]], **params) -> "InvertedBM25":
+        vocab: Dict[str, int] = {}
+        term_ids, doc_ids, freqs, doc_len = _count_postings(
+            vocab, range(len(tokenized_corpus)), tokenized_corpus
+        )
+        return cls._from_postings(
+            list(vocab),
+            np.asarray(term_ids, dtype=np.int64),
+            np.asarray(doc_ids, dtype=np.int64),
+            np.asarray(freqs, dtype=np.int64),
+            np.asarray(doc_len, dtype=np.int64),
+            **params,
+        )
+
+    @classmethod
+    def _from_postings(
+        cls,
+        vocab: List[str],
+        term_arr: np.ndarray,
+        doc_arr: np.ndarray,
+        tf_arr: np.ndarray,
+        doc_len: np.ndarray,
+        **params,
+    ) -> "InvertedBM25":
+        """Pack unordered (term, doc, tf) postings into compressed term-major lists."""
+        order = np.lexsort((doc_arr, term_arr))
+        term_arr, doc_arr, tf_arr = term_arr[order], doc_arr[order], tf_arr[order]
+
+        term_offsets = np.concatenate([[0], np.cumsum(np.bincount(term_arr, minlength=len(vocab)))])
+        gaps = np.diff(doc_arr, prepend=0)
+        gaps[term_offsets[:-1][np.diff(term_offsets) > 0]] = doc_arr[
+            term_offsets[:-1][np.diff(term_offsets) > 0]
+        ]
+        doc_gaps = gaps.astype(_narrowest_uint(int(gaps.max()) if len(gaps) else 0))
+        term_freqs = tf_arr.astype(_narrowest_uint(int(tf_arr.max()) if len(tf_arr) else 0))
+        return cls(vocab, term_offsets.astype(np.int64), doc_gaps, term_freqs, doc_len, **params)
+
+    def apply(self, doc_map: np.ndarray, n_docs: int, changed: Dict[int, List[str]]) -> "InvertedBM25":
+        """
+        New index after a corpus edit, without re-tokenizing unchanged documents.
+        ``doc_map[old_id]`` is the document's new id (-1 when deleted or when
+        its text changed); ``changed`` maps new ids to the tokens of inserted
+        or re-written documents. Postings of kept documents are renumbered,
+        the changed ones appended, and document frequencies, IDF and length
+        norms recomputed from the merged lists. Terms left with no postings
+        are dropped, so the result equals a fresh ``build`` of the new corpus.
+        """
+        old_terms = np.repeat(np.arange(len(self.vocab)), np.diff(self.term_offsets))
+        old_docs = doc_map[self._all_doc_ids()] if len(self.term_freqs) else np.zeros(0, dtype=np.int64)
+        keep = old_docs >= 0
+
+        doc_len = np.zeros(n_docs, dtype=np.int64)
+        kept = doc_map >= 0
+        doc_len[doc_map[kept]] = self.doc_len[kept]
+
+        vocab = dict(self.term_index)
+        new_ids = sorted(changed)
+        term_ids, doc_ids, freqs, lengths = _count_postings(vocab, new_ids, [changed[d] for d in new_ids])
+        doc_len[new_ids] = lengths
+
+        term_arr = np.concatenate([old_terms[keep], np.asarray(term_ids, dtype=np.int64)])
+        doc_arr = np.concatenate([old_docs[keep], np.asarray(doc_ids, dtype=np.int64)])
+        tf_arr = np.concatenate([self.term_freqs[keep].astype(np.int64), np.asarray(freqs, dtype=np.int64)])
+
+        # Drop terms that no longer occur and renumber the rest densely.
+        vocab_list = list(vocab)
+        used = np.bincount(term_arr, minlength=len(vocab_list)) > 0
+        remap = np.cumsum(used) - 1
+        vocab_list = [t for t, u in zip(vocab_list, used) if u]
+        return self._from_postings(
+            vocab_list,
+            remap[term_arr],
+            doc_arr,
+            tf_arr,
+            doc_len,
+            k1=self.k1,
+            b=self.b,
+            epsilon=self.epsilon,
+        )
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Decoded (doc ids, BM25 contributions) for one term."""
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        docs = np.cumsum(self.doc_gaps[start:end], dtype=np.int64)
+        tf = self.term_freqs[start:end].astype(np.float64)
+        contrib = self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.doc_norm[docs])
+        return docs, contrib
+
+    def _query_terms(self, tokens: List[str]) -> List[Tuple[int, int]]:
+        counts = Counter(t for t in tokens if t in self.term_index)
+        return [(self.term_index[t], c) for t, c in counts.items()]
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        """Full score vector for one query (same contract as BM25Okapi.get_scores)."""
+        scores = np.zeros(self.corpus_size)
+        for term_id, count in self._query_terms(tokens):
+            docs, contrib = self.postings(term_id)
+            scores[docs] += count * contrib
+        return scores
+
+    def score_batch(
+        self, tokenized_queries: List[List[str]], rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        (queries x docs) score matrix. Each distinct term in the batch is
+        decoded once and added to every query that contains it. With ``rows``
+        (sorted doc ids) the matrix has one column per row and postings of
+        other documents are skipped.
+        """
+        n_cols = self.corpus_size if rows is None else len(rows)
+        scores = np.zeros((len(tokenized_queries), n_cols))
+        users: Dict[int, List[Tuple[int, int]]] = {}
+        for qi, tokens in enumerate(tokenized_queries):
+            for term_id, count in self._query_terms(tokens):
+                users.setdefault(term_id, []).append((qi, count))
+        for term_id, qs in users.items():
+            docs, contrib = self.postings(term_id)
+            if rows is not None:
+                pos = np.minimum(np.searchsorted(rows, docs), max(len(rows) - 1, 0))
+                keep = rows[pos] == docs if len(rows) else np.zeros(len(docs), dtype=bool)
+                docs, contrib = pos[keep], contrib[keep]
+            query_rows = np.array([q for q, _ in qs])
+            counts = np.array([c for _, c in qs], dtype=np.float64)
+            scores[np.ix_(query_rows, docs)] += counts[:, None] * contrib[None, :]
+        return scores
+
+    def top_k(
+        self, tokens: List[str], k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact top-k (scores, doc ids), best first, with MaxScore pruning:
+        terms are processed by decreasing upper bound, and once the bounds of
+        the remaining terms cannot lift an unseen document past the current
+        k-th score, those terms only update surviving candidates. ``mask``
+        restricts results to matching documents.
+        """
+        terms = self._query_terms(tokens)
+        if not terms or k <= 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        bounds = np.array([self.max_score[t] * c for t, c in terms])
+        order = np.argsort(-bounds, kind="stable")
+        remaining = np.concatenate([np.cumsum(bounds[order][::-1])[::-1][1:], [0.0]])
+
+        acc = np.zeros(self.corpus_size)
+        in_cand = np.zeros(self.corpus_size, dtype=bool)
+        cand = np.zeros(0, dtype=np.int64)
+        pruning = False
+        for step, ti in enumerate(order):
+            term_id, count = terms[ti]
+            docs, contrib = self.postings(term_id)
+            if mask is not None:
+                keep = mask[docs]
+                docs, contrib = docs[keep], contrib[keep]
+            if pruning:
+                keep = in_cand[docs]
+                docs, contrib = docs[keep], contrib[keep]
+            else:
+                new = docs[~in_cand[docs]]
+                in_cand[new] = True
+                cand = np.concatenate([cand, new])
+            acc[docs] += count * contrib
+
+            if len(cand) >= k:
+                cand_scores = acc[cand]
+                theta = np.partition(cand_scores, len(cand) - k)[len(cand) - k]
+                if remaining[step] <= theta:
+                    # No unseen doc can reach theta; drop candidates that cannot either.
+                    pruning = True
+                    survive = cand_scores + remaining[step] >= theta
+                    in_cand[cand[~survive]] = False
+                    cand = cand[survive]
+
+        cand.sort()  # equal scores rank by doc id
+        cand_scores = acc[cand]
+        top = np.argsort(-cand_scores, kind="stable")[:k]
+        return cand_scores[top], cand[top]
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            vocab=np.frombuffer("\n".join(self.vocab).encode("utf-8"), dtype=np.uint8),
+            term_offsets=self.term_offsets,
+            doc_gaps=self.doc_gaps,
+            term_freqs=self.term_freqs,
+            doc_len=self.doc_len,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(
+        cls, path: Path, k1: float = BM25_K1, b: float = BM25_B, epsilon: float = BM25_EPSILON
+    ) -> "InvertedBM25":
+        """
+        Load saved postings and score them with ``k1``, ``b`` and ``epsilon``.
+        Only IDF and length norms depend on those, and both are recomputed
+        here, so a changed config takes effect without re-tokenizing.
+        """
+        data = np.load(path)
+        blob = data["vocab"].tobytes().decode("utf-8")
+        vocab = blob.split("\n") if blob else []
+        return cls(
+            vocab,
+            data["term_offsets"],
+            data["doc_gaps"],
+            data["term_freqs"],
+            data["doc_len"],
+            k1=k1,
+            b=b,
+            epsilon=epsilon,
+        )
+
+
+def bm25_idf(df: np.ndarray, corpus_size: int, epsilon: float = BM25_EPSILON) -> np.ndarray:
+    """Okapi IDF; negative values are floored at ``epsilon`` x the mean IDF (as in rank_bm25)."""
+    df = np.asarray(df, dtype=np.float64)
+    idf = np.log(corpus_size - df + 0.5) - np.log(df + 0.5)
+    average_idf = idf.mean() if len(idf) else 0.0
+    idf[idf < 0] = epsilon * average_idf
+    return idf
+
+
+def _count_postings(
+    vocab: Dict[str, int], doc_ids: Iterable[int], tokenized: Iterable[List[str]]
+) -> Tuple[List[int], List[int], List[int], List[int]]:
+    """(term ids, doc ids, term freqs, doc lengths) for ``tokenized``; extends ``vocab``."""
+    term_ids: List[int] = []
+    posting_docs: List[int] = []
+    freqs: List[int] = []
+    lengths: List[int] = []
+    for d, tokens in zip(doc_ids, tokenized):
+        lengths.append(len(tokens))
+        for tok, tf in Counter(tokens).items():
+            term_ids.append(vocab.setdefault(tok, len(vocab)))
+            posting_docs.append(d)
+            freqs.append(tf)
+    return term_ids, posting_docs, freqs, lengths
+
+
+def bm25_path(fingerprint: str, index_dir: Path = INDEX_DIR) -> Path:
+    return index_dir / f"bm25_{fingerprint[:16]}.npz"
+
+
+def load_or_build_bm25(
+    tokenized_corpus_fn,
+    fingerprint: str,
+    index_dir: Path = INDEX_DIR,
+    k1: float = BM25_K1,
+    b: float = BM25_B,
+    epsilon: float = BM25_EPSILON,
+) -> InvertedBM25:
+    """
+    Load the BM25 postings saved for this corpus fingerprint, or build them
+    from ``tokenized_corpus_fn()`` and save them under ``index_dir``. The
+    file holds no scoring parameters: either way the index scores with
+    ``k1``, ``b`` and ``epsilon`` (the current config by default).
+    """
+    path = bm25_path(fingerprint, index_dir)
+    if path.exists():
+        return InvertedBM25.load(path, k1=k1, b=b, epsilon=epsilon)
+    index = InvertedBM25.build(tokenized_corpus_fn(), k1=k1, b=b, epsilon=epsilon)
+    index.save(path)
+    return index
@@ -0,0 +1,171 @@
+"""
+Adaptive cross-encoder cascade.
+
+The plain improved pipeline sends every one of ``TOP_K_IMPROVED_CANDIDATES``
+candidates to the cross-encoder. The cascade spends that cost only where the
+hybrid ranking is uncertain:
+
+1. Confidence of the hybrid ranking, per query, from the min-max normalized
+   candidate scores: the margin between ranks ``final_k`` and ``final_k + 1``
+   (how clearly the top-k is separated from the rest) and the entropy of a
+   softmax over the scores, divided by its maximum ``log(n)`` (0 = one
+   candidate dominates, 1 = all tied).
+2. Decisive queries (high margin and low entropy) skip the cross-encoder and
+   keep their hybrid order. For the others, the entropy sets how deep the
+   cascade may go: ``final_k`` plus that fraction of the remaining candidates.
+3. Candidates are scored in hybrid order, ``RERANK_CASCADE_BATCH`` at a time,
+   with the pairs of every still-running query of the batch sent to the model
+   together. A query stops when a mini-batch leaves its reranked top
+   ``final_k`` unchanged (later candidates rank lower by the hybrid score, so
+   the top-k is taken as settled), or when its own latency budget is spent.
+   The budget is per query and counts rerank time only: each round's model
+   time is charged to the queries in it, in proportion to their pairs.
+
+Candidates that were not reranked rank after the reranked ones, in hybrid
+order. The number of candidates reranked per query is recorded, so depth can
+be tuned against quality (``stats()``).
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    CASCADE_SKIP_ENTROPY,
+    CASCADE_SKIP_MARGIN,
+    CASCADE_TEMPERATURE,
+    RERANK_CASCADE_BATCH,
+    RERANK_LATENCY_BUDGET_MS,
+)
+
+# Why a query's cascade ended
+STOP_REASONS = ("skipped", "stable", "budget", "depth")
+
+# (query positions, corpus indices) -> cross-encoder scores of those pairs
+ScorePairs = Callable[[List[int], np.ndarray], np.ndarray]
+
+
+def ranking_confidence(scores: np.ndarray, final_k: int, temperature: float = CASCADE_TEMPERATURE) -> Tuple[float, float]:
+    """
+    (margin, normalized entropy) of one query's candidate scores, best first.
+    Both are computed on min-max normalized scores, so they do not depend on
+    the fusion mode's score scale.
+    """
+    n = len(scores)
+    if n <= 1:
+        return 1.0, 0.0
+    span = scores[0] - scores[-1]
+    if span <= 0:
+        return 0.0, 1.0
+    norm = (scores - scores[-1]) / span
+    margin = float(norm[final_k - 1] - norm[final_k]) if 0 < final_k < n else 1.0
+    logits = norm / temperature
+    p = np.exp(logits - logits.max())
+    p /= p.sum()
+    entropy = float(-(p * np.log(np.maximum(p, 1e-300))).sum() / math.log(n))
+    return margin, entropy
+
+
+class RerankCascade:
+    """Budgeted, early-exit cross-encoder scoring with reranked-depth statistics."""
+
+    def __init__(
+        self,
+        batch_size: int = RERANK_CASCADE_BATCH,
+        budget_ms: Optional[float] = RERANK_LATENCY_BUDGET_MS,
+        skip_margin: float = CASCADE_SKIP_MARGIN,
+        skip_entropy: float = CASCADE_SKIP_ENTROPY,
+    ):
+        self.batch_size = max(1, batch_size)
+        self.budget_ms = budget_ms
+        self.skip_margin = skip_margin
+        self.skip_entropy = skip_entropy
+        self._lock = threading.Lock()
+        self._depths: "Counter[int]" = Counter()
+        self._reasons: "Counter[str]" = Counter()
+
+    def _max_depth(self, scores: np.ndarray, final_k: int) -> int:
+        margin, entropy = ranking_confidence(scores, final_k)
+        n = len(scores)
+        if margin >= self.skip_margin and entropy <= self.skip_entropy:
+            return 0
+        return min(n, final_k + math.ceil(entropy * max(0, n - final_k)))
+
+    def run(
+        self,
+        score_pairs: ScorePairs,
+        cand_idx: np.ndarray,
+        cand_hybrid: np.ndarray,
+        final_k: int,
+    ) -> np.ndarray:
+        """
+        Cross-encoder scores for the (queries x candidates) matrices, NaN where
+        a candidate was not reranked (and for -1 padding). Candidates of each
+        row must be in hybrid order, best first. Every query that is not
+        skipped gets at least one mini-batch.
+        """
+        scores = np.full(cand_idx.shape, np.nan)
+        n_valid = (cand_idx >= 0).sum(axis=1)
+        limits = [self._max_depth(cand_hybrid[qi, : n_valid[qi]], final_k) for qi in range(len(cand_idx))]
+        depths = [0] * len(cand_idx)
+        spent_ms = [0.0] * len(cand_idx)
+        reasons: List[Optional[str]] = ["skipped" if limit == 0 else None for limit in limits]
+
+        active = [qi for qi, reason in enumerate(reasons) if reason is None]
+        while active:
+            positions, columns = [], []
+            for qi in active:
+                stop = min(depths[qi] + self.batch_size, limits[qi])
+                positions.extend([qi] * (stop - depths[qi]))
+                columns.extend(range(depths[qi], stop))
+            before = {qi: self._top(scores[qi], final_k) for qi in active}
+            start = time.perf_counter()
+            scores[positions, columns] = score_pairs(positions, cand_idx[positions, columns])
+            per_pair_ms = 1000 * (time.perf_counter() - start) / len(positions)
+
+            still_active = []
+            for qi in active:
+                n_pairs = min(depths[qi] + self.batch_size, limits[qi]) - depths[qi]
+                depths[qi] += n_pairs
+                spent_ms[qi] += n_pairs * per_pair_ms
+                if depths[qi] >= limits[qi]:
+                    reasons[qi] = "depth"
+                elif depths[qi] >= final_k and self._top(scores[qi], final_k) == before[qi]:
+                    reasons[qi] = "stable"
+                elif self.budget_ms is not None and spent_ms[qi] >= self.budget_ms:
+                    reasons[qi] = "budget"
+                else:
+                    still_active.append(qi)
+            active = still_active
+
+        with self._lock:
+            self._depths.update(depths)
+            self._reasons.update(reasons)
+        return scores
+
+    @staticmethod
+    def _top(row: np.ndarray, final_k: int) -> frozenset:
+        done = np.flatnonzero(~np.isnan(row))
+        return frozenset(done[np.argsort(-row[done], kind="stable")[:final_k]].tolist())
+
+    def stats(self) -> Dict[str, Any]:
+        """Distribution of candidates reranked per query, and why each query's cascade stopped."""
+        with self._lock:
+            depths, reasons = Counter(self._depths), Counter(self._reasons)
+        queries = sum(depths.values())
+        values = np.repeat(sorted(depths), [depths[d] for d in sorted(depths)])
+        return {
+            "queries": queries,
+            "batch_size": self.batch_size,
+            "budget_ms": self.budget_ms,
+            "reranked_mean": round(float(values.mean()), 3) if queries else 0.0,
+            "reranked_p50": float(np.percentile(values, 50)) if queries else 0.0,
+            "reranked_p90": float(np.percentile(values, 90)) if queries else 0.0,
+            "reranked_max": int(values.max()) if queries else 0,
+            "reranked_histogram": {str(d): depths[d] for d in sorted(depths)},
+            "stop_reasons": {reason: reasons[reason] for reason in STOP_REASONS},
+        }
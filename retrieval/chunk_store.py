@@ -0,0 +1,40 @@
+"""
+Chunk store access.
+
+Two on-disk formats are supported: the hand-made ``data/chunks.json`` list and
+the JSONL store written by ``ingest.py`` (one chunk object per line). JSONL
+stores are read line by line, so loading never parses the corpus as a single
+JSON blob and large stores can be streamed.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import CHUNK_STORE_PATH, CHUNKS_PATH
+
+
+def default_chunks_path() -> Path:
+    """The ingested JSONL store when it exists, otherwise ``chunks.json``."""
+    return CHUNK_STORE_PATH if CHUNK_STORE_PATH.exists() else CHUNKS_PATH
+
+
+def resolve_chunks_path(chunks_path: Optional[Path]) -> Path:
+    return Path(chunks_path) if chunks_path is not None else default_chunks_path()
+
+
+def iter_chunks(path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield chunks one at a time from a JSONL store or a JSON list."""
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from json.load(f)
+
+
+def load_chunks(path: Path) -> List[Dict[str, Any]]:
+    return list(iter_chunks(path))
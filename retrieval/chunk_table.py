@@ -0,0 +1,236 @@
+"""
+Compact, memory-mapped columnar chunk store.
+
+The registry serves the corpus from a ``ChunkTable`` instead of a list of
+chunk dicts. It is built once per chunk store file (keyed by path, size and
+modification time) into a directory of flat arrays:
+
+- ``text.bin`` + ``text_offsets.npy``: every chunk's UTF-8 text back to back
+- ``ids.bin`` + ``id_offsets.npy``: JSON-encoded chunk ids
+- ``paper_id.npy`` / ``section.npy`` / ``source.npy``: int32 codes into the
+  value lists in ``table.json``
+- ``hashes.npy``: content hashes, so startup does not re-hash every text
+- ``simhash.npy``: 64-bit SimHash signatures for near-duplicate detection
+- ``extra.bin`` + ``extra_offsets.npy``: any other chunk fields, as JSON
+- ``table.json``: row count, coded value lists and ``TABLE_FORMAT``; a table
+  of another format is rebuilt rather than read
+
+All arrays are opened with ``mmap_mode="r"``, so a table costs almost no
+resident memory, and processes (e.g. shard workers) opening the same table
+share its pages. Text is decoded only for the rows that are actually read,
+e.g. when a result is serialized.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import INDEX_DIR, RESULT_TEXT_CHARS
+from retrieval.chunk_store import iter_chunks
+from retrieval.text import content_hash, simhash
+
+CODED_FIELDS = ("paper_id", "section", "source")
+TABLE_FILE = "table.json"
+# Bumped whenever the set of columns changes; tables of another format are rebuilt
+TABLE_FORMAT = 2
+
+_BLOBS = ("text", "ids", "extra")
+_KNOWN_FIELDS = ("id", "text") + CODED_FIELDS
+
+
+def _read_meta(path: Path) -> Dict[str, Any]:
+    with open(path / TABLE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _open_blob(path: Path) -> np.ndarray:
+    if path.stat().st_size == 0:  # np.memmap cannot map an empty file
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class TextColumn(Sequence):
+    """Read-only sequence view of the chunk texts; each access decodes one row."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return bytes(self.blob[self.offsets[i] : self.offsets[i + 1]]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ChunkTable:
+    """
+    Columnar chunk store. ``table[i]`` hydrates chunk ``i`` back into the dict
+    it was built from; ``texts`` and ``value`` read single columns.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        meta = _read_meta(self.path)
+        if meta.get("format") != TABLE_FORMAT:
+            raise ValueError(
+                f"Chunk table {self.path} has format {meta.get('format')}, expected {TABLE_FORMAT}; rebuild it"
+            )
+        self.size = meta["size"]
+        self.vocab: Dict[str, List[Any]] = meta["vocab"]
+        self.codes = {name: np.load(self.path / f"{name}.npy", mmap_mode="r") for name in CODED_FIELDS}
+        self._blobs = {
+            name: (_open_blob(self.path / f"{name}.bin"), np.load(self.path / f"{name}_offsets.npy", mmap_mode="r"))
+            for name in _BLOBS
+        }
+        self.texts = TextColumn(*self._blobs["text"])
+        self._hashes = np.load(self.path / "hashes.npy", mmap_mode="r")
+        self.simhashes = np.load(self.path / "simhash.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        """On-disk (mapped) size of all columns."""
+        arrays = [self._hashes, self.simhashes, *self.codes.values()] + [a for pair in self._blobs.values() for a in pair]
+        return int(sum(a.nbytes for a in arrays))
+
+    @property
+    def hashes(self) -> List[str]:
+        return self.hash_range(0, self.size)
+
+    def hash_range(self, start: int, stop: int) -> List[str]:
+        """Content hashes of rows ``[start, stop)``."""
+        return self._hashes[start:stop].astype(str).tolist()
+
+    def _json(self, blob: str, i: int) -> Any:
+        data, offsets = self._blobs[blob]
+        raw = bytes(data[offsets[i] : offsets[i + 1]])
+        return json.loads(raw) if raw else None
+
+    def value(self, field: str, i: int) -> Any:
+        """``paper_id`` / ``section`` / ``source`` of chunk ``i`` (None if absent)."""
+        return self.vocab[field][self.codes[field][i]]
+
+    def column(self, field: str) -> Tuple[np.ndarray, List[Any]]:
+        """(int32 codes, values) of a coded field."""
+        return self.codes[field], self.vocab[field]
+
+    def chunk_id(self, i: int) -> Any:
+        chunk_id = self._json("ids", i)
+        return int(i) if chunk_id is None else chunk_id
+
+    def result_fields(self, i: int, text_chars: Optional[int] = RESULT_TEXT_CHARS) -> Dict[str, Any]:
+        """
+        Result-dict fields for chunk ``i``. Text is included only when
+        ``text_chars`` is not 0: the first ``text_chars`` characters, or all
+        of it when None.
+        """
+        fields = {
+            "chunk_id": self.chunk_id(i),
+            "chunk_index": int(i),
+            "paper_id": self.value("paper_id", i),
+            "section": self.value("section", i),
+        }
+        if text_chars != 0:
+            text = self.texts[i]
+            fields["text"] = text if text_chars is None else text[:text_chars]
+        return fields
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        chunk: Dict[str, Any] = {}
+        chunk_id = self._json("ids", i)
+        if chunk_id is not None:
+            chunk["id"] = chunk_id
+        for field in CODED_FIELDS:
+            value = self.value(field, i)
+            if value is not None:
+                chunk[field] = value
+        chunk["text"] = self.texts[i]
+        chunk.update(self._json("extra", i) or {})
+        return chunk
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self.size):
+            yield self[i]
+
+    @classmethod
+    def build(cls, chunks: Iterable[Dict[str, Any]], path: Path) -> "ChunkTable":
+        """
+        Stream ``chunks`` into a table at ``path``. Written under a temporary
+        name and renamed into place, so readers never see a partial table.
+        """
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+
+        files = {name: open(tmp / f"{name}.bin", "wb") for name in _BLOBS}
+        offsets = {name: array("q", [0]) for name in _BLOBS}
+        lookups: Dict[str, Dict[Any, int]] = {name: {} for name in CODED_FIELDS}
+        codes = {name: array("i") for name in CODED_FIELDS}
+        hashes: List[bytes] = []
+        signatures = array("Q")
+        try:
+            for chunk in chunks:
+                text = chunk["text"]
+                extra = {k: v for k, v in chunk.items() if k not in _KNOWN_FIELDS}
+                encoded = {
+                    "text": text.encode("utf-8"),
+                    "ids": json.dumps(chunk["id"]).encode("utf-8") if "id" in chunk else b"",
+                    "extra": json.dumps(extra, ensure_ascii=False).encode("utf-8") if extra else b"",
+                }
+                for name, data in encoded.items():
+                    files[name].write(data)
+                    offsets[name].append(offsets[name][-1] + len(data))
+                for name in CODED_FIELDS:
+                    lookup = lookups[name]
+                    codes[name].append(lookup.setdefault(chunk.get(name), len(lookup)))
+                hashes.append(content_hash(text).encode("ascii"))
+                signatures.append(simhash(text))
+        finally:
+            for f in files.values():
+                f.close()
+
+        for name in _BLOBS:
+            np.save(tmp / f"{name}_offsets.npy", np.frombuffer(offsets[name], dtype=np.int64))
+        for name in CODED_FIELDS:
+            np.save(tmp / f"{name}.npy", np.frombuffer(codes[name], dtype=np.int32))
+        np.save(tmp / "hashes.npy", np.array(hashes, dtype="S40"))
+        np.save(tmp / "simhash.npy", np.frombuffer(signatures, dtype=np.uint64))
+        with open(tmp / TABLE_FILE, "w", encoding="utf-8") as f:
+            json.dump(
+                {"format": TABLE_FORMAT, "size": len(hashes), "vocab": {k: list(v) for k, v in lookups.items()}}, f
+            )
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        return cls(path)
+
+
+def table_path(chunks_path: Path, index_dir: Path = INDEX_DIR) -> Path:
+    """Table directory for a chunk store file, keyed by its path, size and mtime."""
+    chunks_path = Path(chunks_path).resolve()
+    stat = chunks_path.stat()
+    key = hashlib.sha1(f"{chunks_path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    return index_dir / f"chunks_{key[:16]}"
+
+
+def load_or_build_chunk_table(chunks_path: Path, index_dir: Path = INDEX_DIR) -> ChunkTable:
+    path = table_path(chunks_path, index_dir)
+    if (path / TABLE_FILE).exists() and _read_meta(path).get("format") == TABLE_FORMAT:
+        return ChunkTable(path)
+    return ChunkTable.build(iter_chunks(chunks_path), path)
@@ -0,0 +1,181 @@
+"""
+Context assembly between retrieval and generation.
+
+``pack_context`` turns a ranked result list into the evidence an LLM would be
+given, within ``CONTEXT_TOKEN_BUDGET`` estimated tokens:
+
+1. Near-duplicates are dropped: a chunk whose SimHash signature (precomputed
+   in the chunk table) is within ``SIMHASH_MAX_DISTANCE`` bits of a
+   better-ranked chunk adds nothing new.
+2. Adjacent chunks of the same paper and section (consecutive rows of the
+   chunk table) are merged into one passage, with the word overlap the
+   ingester puts between neighbouring chunks removed.
+3. Passages are packed best rank first, the best passage of every cited paper
+   (truncated to a fair share of the budget if needed) before second passages
+   of any paper. A passage that does not fit is truncated to the remaining
+   budget when at least ``CONTEXT_MIN_PASSAGE_TOKENS`` are left.
+
+Results may come from a saved run; a ``chunk_index`` that no longer points at
+the result's ``chunk_id`` in the current chunk table is ignored.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from config import CONTEXT_MIN_PASSAGE_TOKENS, CONTEXT_TOKEN_BUDGET, SIMHASH_MAX_DISTANCE
+from retrieval.text import estimate_tokens, hamming, simhash
+
+
+def _merge_text(first: str, second: str) -> str:
+    """Concatenate two neighbouring chunks, dropping the words they share at the seam."""
+    a, b = first.split(), second.split()
+    for k in range(min(len(a), len(b)), 0, -1):
+        if a[-k:] == b[:k]:
+            return " ".join(a + b[k:])
+    return " ".join(a + b)
+
+
+def _truncate(text: str, tokens: int) -> str:
+    words, out, used = text.split(), [], 0
+    for word in words:
+        used += estimate_tokens(word + " ")
+        if used > tokens:
+            break
+        out.append(word)
+    return " ".join(out)
+
+
+def chunk_row(result: Dict[str, Any], store) -> Optional[int]:
+    """
+    ``result``'s row in ``store``, or None without a store or a valid
+    ``chunk_index`` (out of range, or a different chunk: results saved
+    against another corpus version).
+    """
+    index = result.get("chunk_index")
+    if store is None or not isinstance(index, int) or not 0 <= index < len(store):
+        return None
+    if "chunk_id" in result and store.chunk_id(index) != result["chunk_id"]:
+        return None
+    return index
+
+
+def chunk_text(result: Dict[str, Any], store=None) -> str:
+    """Full chunk text from ``store`` when the result's row is valid, else the result's own text."""
+    index = chunk_row(result, store)
+    return store.texts[index] if index is not None else result.get("text") or ""
+
+
+def pack_context(
+    results: List[Dict[str, Any]],
+    store=None,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_distance: int = SIMHASH_MAX_DISTANCE,
+) -> Dict[str, Any]:
+    """
+    Pack ranked ``results`` into ``token_budget`` tokens. ``store`` (a
+    ``ChunkTable``) supplies full texts and signatures by ``chunk_index``;
+    without it the results' own (possibly truncated) text is used.
+
+    Returns ``{"passages": [...], "stats": {...}}``. Each passage lists the
+    ``chunk_ids`` it cites; stats count the tokens of every retrieved chunk,
+    the packed tokens and the difference (dropped as duplicates, merged
+    overlap or over budget).
+    """
+    items = []
+    stale = 0
+    for rank, result in enumerate(results):
+        index = chunk_row(result, store)
+        if index is not None:
+            text, signature = store.texts[index], int(store.simhashes[index])
+        else:
+            if store is not None and result.get("chunk_index") is not None:
+                stale += 1
+            text = result.get("text") or ""
+            signature = simhash(text)
+        items.append({"rank": rank, "result": result, "index": index, "text": text, "signature": signature})
+    tokens_in = sum(estimate_tokens(item["text"]) for item in items)
+
+    kept: List[Dict[str, Any]] = []
+    for item in items:
+        if not any(
+            (item["index"] is not None and item["index"] == other["index"])
+            or hamming(item["signature"], other["signature"]) <= max_distance
+            for other in kept
+        ):
+            kept.append(item)
+
+    # Merge runs of consecutive rows from the same paper and section
+    groups: List[List[Dict[str, Any]]] = []
+    for item in sorted(kept, key=lambda it: (it["index"] is None, it["index"] or 0, it["rank"])):
+        last = groups[-1][-1] if groups else None
+        if (
+            last is not None
+            and item["index"] is not None
+            and last["index"] is not None
+            and item["index"] == last["index"] + 1
+            and item["result"].get("paper_id") == last["result"].get("paper_id")
+            and item["result"].get("section") == last["result"].get("section")
+        ):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+
+    passages = []
+    for group in groups:
+        text = group[0]["text"]
+        for item in group[1:]:
+            text = _merge_text(text, item["text"])
+        head = group[0]["result"]
+        passages.append(
+            {
+                "rank": min(item["rank"] for item in group),
+                "chunk_ids": [item["result"].get("chunk_id") for item in group],
+                "paper_id": head.get("paper_id"),
+                "section": head.get("section"),
+                "text": text,
+            }
+        )
+    passages.sort(key=lambda p: p["rank"])
+
+    # Best passage per paper first, then the rest, all in rank order
+    covered = set()
+    firsts, rest = [], []
+    for passage in passages:
+        (rest if passage["paper_id"] in covered else firsts).append(passage)
+        covered.add(passage["paper_id"])
+
+    packed, remaining = [], token_budget
+    for i, passage in enumerate(firsts + rest):
+        # A paper's first passage gets at most a fair share of what is left,
+        # so one long passage cannot crowd out the other cited papers.
+        allowance = remaining
+        if i < len(firsts):
+            allowance = max(CONTEXT_MIN_PASSAGE_TOKENS, remaining // (len(firsts) - i))
+        tokens = estimate_tokens(passage["text"])
+        if tokens > min(allowance, remaining):
+            allowance = min(allowance, remaining)
+            if allowance < CONTEXT_MIN_PASSAGE_TOKENS:
+                continue
+            passage = {**passage, "text": _truncate(passage["text"], allowance), "truncated": True}
+            tokens = estimate_tokens(passage["text"])
+        packed.append({**passage, "tokens": tokens})
+        remaining -= tokens
+    packed.sort(key=lambda p: p["rank"])
+
+    tokens_out = sum(p["tokens"] for p in packed)
+    papers_in = {r.get("paper_id") for r in results}
+    return {
+        "passages": packed,
+        "stats": {
+            "retrieved_chunks": len(results),
+            "stale_chunk_indices": stale,
+            "near_duplicates_dropped": len(items) - len(kept),
+            "chunks_merged": len(kept) - len(groups),
+            "passages": len(packed),
+            "token_budget": token_budget,
+            "tokens_retrieved": tokens_in,
+            "tokens_packed": tokens_out,
+            "tokens_dropped": tokens_in - tokens_out,
+            "papers_retrieved": len(papers_in),
+            "papers_cited": len({p["paper_id"] for p in packed}),
+        },
+    }
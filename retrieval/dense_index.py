@@ -0,0 +1,408 @@
+"""
+Pluggable dense indexes over the (memory-mapped) corpus embedding matrix.
+
+- ``ExactIndex``: brute-force inner product with ``argpartition`` top-k.
+- ``IVFIndex``: inverted-file index built with spherical k-means in NumPy;
+  queries scan only the ``nprobe`` closest lists.
+
+Both score against the matrix selected by ``EMBEDDING_STORAGE`` (float32, or
+a float16/int8 copy from ``retrieval.quantization``). With a quantized matrix
+the top ``RESCORE_CANDIDATES`` hits are re-ranked by exact float32 similarity.
+
+Both return ``(scores, indices)`` arrays of shape (queries, k); rows with fewer
+than ``k`` candidates are padded with ``-inf`` / ``-1``. Run this module to
+report recall@k, latency and memory of a backend/storage against exact search.
+"""
+
+import argparse
+import json
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from config import (
+    DENSE_INDEX_BACKEND,
+    EMBEDDING_STORAGE,
+    INDEX_DIR,
+    IVF_NLIST,
+    IVF_NPROBE,
+    IVF_TRAIN_ITERS,
+    IVF_TRAIN_SAMPLE,
+    RANDOM_SEED,
+    RESCORE_CANDIDATES,
+)
+from retrieval.quantization import QuantizedEmbeddings, load_or_quantize, storage_path
+from retrieval.ranking import top_k_indices
+
+_BLOCK = 65536
+
+
+class DenseIndex(ABC):
+    """
+    Common interface for dense indexes. ``embeddings`` is the matrix scored
+    against (float32 or ``QuantizedEmbeddings``); ``exact`` is the float32
+    matrix used to rescore the top ``rescore`` hits of a quantized search.
+    Persistence is backend-specific: only indexes with structures beyond the
+    matrix (``IVFIndex``) have ``save``/``load``.
+    """
+
+    backend = "base"
+
+    def __init__(
+        self,
+        embeddings: Union[np.ndarray, QuantizedEmbeddings],
+        exact: Optional[np.ndarray] = None,
+        rescore: int = 0,
+    ):
+        self.embeddings = embeddings
+        self.exact = exact
+        self.rescore = rescore
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the scoring matrix and index structures (not ``exact``)."""
+        structures = (
+            v for name, v in vars(self).items()
+            if isinstance(v, np.ndarray) and name not in ("embeddings", "exact")
+        )
+        return int(self.embeddings.nbytes) + sum(v.nbytes for v in structures)
+
+    def score_all(self, query_embs: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        (queries x corpus) similarity matrix, or (queries x rows) when ``rows``
+        restricts scoring to a subset of the corpus. Approximate when the
+        index scores a quantized matrix.
+        """
+        if isinstance(self.embeddings, QuantizedEmbeddings):
+            return self.embeddings.dot(query_embs, rows)
+        matrix = self.embeddings if rows is None else self.embeddings[rows]
+        return np.asarray(query_embs @ matrix.T)
+
+    def search(
+        self, query_embs: np.ndarray, k: int, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, corpus indices) per query, restricted to ``mask`` if given."""
+        query_embs = np.atleast_2d(query_embs)
+        if self.exact is None or self.rescore <= 0:
+            return self._search(query_embs, k, mask)
+        _, idx = self._search(query_embs, max(k, self.rescore), mask)
+        return self._rescore(query_embs, idx, k)
+
+    @abstractmethod
+    def _search(
+        self, query_embs: np.ndarray, k: int, mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (scores, corpus indices) of ``self.embeddings`` per query, before rescoring."""
+
+    def _rescore(self, query_embs: np.ndarray, idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-rank shortlisted corpus rows by exact float32 similarity, keep the top ``k``."""
+        scores = np.full(idx.shape, -np.inf)
+        for qi in range(len(idx)):
+            valid = idx[qi] >= 0
+            scores[qi, valid] = np.asarray(self.exact[idx[qi, valid]]) @ query_embs[qi]
+        top = top_k_indices(scores, k)
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+        top_idx = np.take_along_axis(idx, top, axis=-1)
+        top_idx[np.isneginf(top_scores)] = -1
+        return _pad(top_scores, top_idx, k)
+
+
+class ExactIndex(DenseIndex):
+    """Brute-force search; linear in corpus size, no sort of the full score vector."""
+
+    backend = "exact"
+
+    def _search(
+        self, query_embs: np.ndarray, k: int, mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        rows = None if mask is None else np.flatnonzero(mask)
+        scores = self.score_all(query_embs, rows)
+        idx = top_k_indices(scores, k)
+        top_scores = np.take_along_axis(scores, idx, axis=-1)
+        if rows is not None:
+            idx = rows[idx]
+        return _pad(top_scores, idx, k)
+
+
+class IVFIndex(DenseIndex):
+    """
+    Inverted-file index: corpus rows are assigned to the nearest of ``nlist``
+    centroids and stored as contiguous lists (CSR offsets + row ids).
+    """
+
+    backend = "ivf"
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = IVF_NPROBE,
+        exact: Optional[np.ndarray] = None,
+        rescore: int = 0,
+    ):
+        super().__init__(embeddings, exact, rescore)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        nlist: int = IVF_NLIST,
+        iters: int = IVF_TRAIN_ITERS,
+        train_sample: int = IVF_TRAIN_SAMPLE,
+        seed: int = RANDOM_SEED,
+        **kwargs,
+    ) -> "IVFIndex":
+        n = embeddings.shape[0]
+        if nlist <= 0:
+            nlist = max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(seed)
+
+        sample_idx = np.sort(rng.choice(n, size=min(n, train_sample), replace=False))
+        sample = np.asarray(embeddings[sample_idx], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assign = _assign(embeddings, centroids)
+        list_ids = np.argsort(assign, kind="stable").astype(np.int64)
+        counts = np.bincount(assign, minlength=nlist)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(embeddings, centroids, list_offsets, list_ids, **kwargs)
+
+    def _search(
+        self, query_embs: np.ndarray, k: int, mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        probes = top_k_indices(query_embs @ self.centroids.T, self.nprobe)
+        out_scores = np.full((len(query_embs), k), -np.inf)
+        out_idx = np.full((len(query_embs), k), -1, dtype=np.int64)
+        for qi, lists in enumerate(probes):
+            cand = np.concatenate(
+                [self.list_ids[self.list_offsets[l] : self.list_offsets[l + 1]] for l in lists]
+            )
+            if mask is not None:
+                cand = cand[mask[cand]]
+            if not len(cand):
+                continue
+            cand.sort()
+            scores = np.asarray(self.embeddings[cand] @ query_embs[qi])
+            top = top_k_indices(scores, k)
+            out_scores[qi, : len(top)] = scores[top]
+            out_idx[qi, : len(top)] = cand[top]
+        return out_scores, out_idx
+
+    def apply(
+        self, doc_map: np.ndarray, embeddings: np.ndarray, changed: np.ndarray, **kwargs
+    ) -> "IVFIndex":
+        """
+        Index over the edited corpus ``embeddings`` without retraining: kept
+        rows move to ``doc_map[old_id]`` (-1 = dropped) in their current list,
+        and the ``changed`` rows (new ids) are assigned to the nearest
+        existing centroid.
+        """
+        nlist = len(self.centroids)
+        assign = np.full(embeddings.shape[0], -1, dtype=np.int64)
+        old_lists = np.repeat(np.arange(nlist), np.diff(self.list_offsets))
+        new_ids = doc_map[self.list_ids]
+        kept = new_ids >= 0
+        assign[new_ids[kept]] = old_lists[kept]
+        if len(changed):
+            assign[changed] = _assign(np.asarray(embeddings[changed]), self.centroids)
+        list_ids = np.argsort(assign, kind="stable").astype(np.int64)
+        counts = np.bincount(assign, minlength=nlist)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return IVFIndex(embeddings, self.centroids, list_offsets, list_ids, self.nprobe, **kwargs)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, embeddings: np.ndarray, **kwargs) -> "IVFIndex":
+        data = np.load(path)
+        return cls(embeddings, data["centroids"], data["list_offsets"], data["list_ids"], **kwargs)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) for every row, computed in blocks."""
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], _BLOCK):
+        block = np.asarray(vectors[start : start + _BLOCK], dtype=np.float32)
+        out[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def _pad(scores: np.ndarray, idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if idx.shape[-1] >= k:
+        return scores, idx
+    missing = k - idx.shape[-1]
+    scores = np.pad(scores.astype(np.float64), ((0, 0), (0, missing)), constant_values=-np.inf)
+    idx = np.pad(idx, ((0, 0), (0, missing)), constant_values=-1)
+    return scores, idx
+
+
+def index_path(
+    backend: str,
+    fingerprint: str,
+    index_dir: Path = INDEX_DIR,
+    storage: str = EMBEDDING_STORAGE,
+    nlist: int = IVF_NLIST,
+    iters: int = IVF_TRAIN_ITERS,
+    train_sample: int = IVF_TRAIN_SAMPLE,
+    seed: int = RANDOM_SEED,
+) -> Path:
+    """
+    File of a saved approximate index. Keyed by the corpus fingerprint, the
+    matrix it was trained on (``storage``) and every build parameter, so a
+    config change builds a new index instead of loading a stale one.
+    """
+    params = f"{storage}_nlist{nlist}_iters{iters}_sample{train_sample}_seed{seed}"
+    return index_dir / f"dense_{backend}_{params}_{fingerprint[:16]}.npz"
+
+
+def dense_index_files(
+    fingerprint: str,
+    backend: str = DENSE_INDEX_BACKEND,
+    index_dir: Path = INDEX_DIR,
+    storage: str = EMBEDDING_STORAGE,
+) -> List[Path]:
+    """Files ``load_or_build_dense_index`` reads from ``index_dir`` for this configuration."""
+    files = []
+    if storage != "float32":
+        files.append(storage_path(storage, fingerprint, index_dir))
+    if backend == "ivf":
+        files.append(index_path(backend, fingerprint, index_dir, storage))
+    return files
+
+
+def load_or_build_dense_index(
+    embeddings: np.ndarray,
+    fingerprint: str,
+    backend: str = DENSE_INDEX_BACKEND,
+    index_dir: Path = INDEX_DIR,
+    storage: str = EMBEDDING_STORAGE,
+    rescore: int = RESCORE_CANDIDATES,
+) -> DenseIndex:
+    """
+    Return the configured dense index for ``embeddings``. Approximate indexes
+    and quantized matrices are loaded from ``index_dir`` when they exist for
+    this corpus fingerprint, otherwise built and saved there. ``embeddings``
+    itself is only touched for exact rescoring when ``storage`` quantizes.
+    """
+    if storage == "float32":
+        kwargs = {"exact": None, "rescore": 0}
+        matrix = embeddings
+    else:
+        kwargs = {"exact": embeddings, "rescore": rescore}
+        matrix = load_or_quantize(embeddings, fingerprint, storage, index_dir)
+    if backend == "exact":
+        return ExactIndex(matrix, **kwargs)
+    if backend == "ivf":
+        path = index_path(backend, fingerprint, index_dir, storage)
+        if path.exists():
+            return IVFIndex.load(path, matrix, **kwargs)
+        index = IVFIndex.build(matrix, **kwargs)
+        index.save(path)
+        return index
+    raise ValueError(f"Unknown dense index backend: {backend!r}")
+
+
+def recall_at_k(
+    index: DenseIndex, exact: DenseIndex, query_embs: np.ndarray, k: int
+) -> Dict[str, float]:
+    """
+    Recall@k of ``index`` against exact search (fraction of the exact top-k
+    it returns), plus mean per-query latency for both.
+    """
+    t0 = time.perf_counter()
+    _, approx_idx = index.search(query_embs, k)
+    t1 = time.perf_counter()
+    _, exact_idx = exact.search(query_embs, k)
+    t2 = time.perf_counter()
+
+    hits = 0
+    for a, e in zip(approx_idx, exact_idx):
+        hits += len(np.intersect1d(a[a >= 0], e[e >= 0]))
+    n = len(query_embs)
+    return {
+        "k": k,
+        "queries": n,
+        "recall_at_k": hits / max(1, n * min(k, len(exact))),
+        "approx_ms_per_query": 1000 * (t1 - t0) / max(1, n),
+        "exact_ms_per_query": 1000 * (t2 - t1) / max(1, n),
+    }
+
+
+def main():
+    from retrieval.registry import get_registry
+
+    parser = argparse.ArgumentParser(
+        description="Report recall@k and memory of a dense index/storage vs exact float32 search."
+    )
+    parser.add_argument("--backend", default="ivf")
+    parser.add_argument("--storage", default=EMBEDDING_STORAGE, choices=["float32", "float16", "int8"])
+    parser.add_argument("--rescore", type=int, default=RESCORE_CANDIDATES)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--sample", type=int, default=200, help="Corpus rows used as probe queries.")
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    args = parser.parse_args()
+
+    registry = get_registry()
+    embeddings = registry.corpus_embeddings
+    index = load_or_build_dense_index(
+        embeddings, registry.corpus_fingerprint, args.backend, storage=args.storage, rescore=args.rescore
+    )
+    if isinstance(index, IVFIndex):
+        index.nprobe = args.nprobe
+    exact = ExactIndex(embeddings)
+    rng = np.random.default_rng(RANDOM_SEED)
+    sample = rng.choice(len(embeddings), size=min(args.sample, len(embeddings)), replace=False)
+    queries = np.asarray(embeddings[np.sort(sample)])
+
+    report = recall_at_k(index, exact, queries, args.k)
+    if index.exact is not None:
+        # Same index without the float32 rescoring pass: recall lost to quantization alone
+        rescore, index.rescore = index.rescore, 0
+        report["recall_at_k_without_rescore"] = recall_at_k(index, exact, queries, args.k)["recall_at_k"]
+        index.rescore = rescore
+    report.update(
+        {
+            "backend": args.backend,
+            "storage": args.storage,
+            "rescore_candidates": index.rescore,
+            "index_bytes": index.nbytes,
+            "float32_bytes": exact.nbytes,
+            "memory_saved": 1 - index.nbytes / max(1, exact.nbytes),
+        }
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Persistent, memory-mapped store for corpus embeddings.
+
+Embeddings are kept per model and per corpus version: ``embeddings_<fp>.npy``
+holds the rows of the corpus with fingerprint ``fp`` (hash of the ordered
+chunk content hashes) in corpus order, and ``hashes_<fp>.npy`` the content
+hash of every row. A corpus seen before is loaded by file name alone, with no
+per-row work. For a new version only chunks whose text hash is missing from
+the most recent stored version are encoded; the rest are copied over, and the
+oldest versions beyond ``EMBEDDING_CACHE_KEEP`` are removed. Callers use the
+memory map directly, without copying it into process memory.
+"""
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_KEEP, ENCODE_BATCH_SIZE
+from retrieval.text import content_hash
+
+_COPY_BLOCK = 65536
+
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store keyed by model name and corpus fingerprint, with
+    rows matched across corpus versions by per-chunk content hash. Rows are
+    L2-normalized float32, so cosine similarity is a plain dot product.
+    """
+
+    def __init__(self, model_name: str, cache_dir: Path = EMBEDDING_CACHE_DIR, keep: int = EMBEDDING_CACHE_KEEP):
+        self.model_name = model_name
+        self.cache_dir = cache_dir / _model_slug(model_name)
+        self.keep = max(1, keep)
+        self.last_encoded = 0
+
+    def matrix_path(self, fingerprint: str) -> Path:
+        return self.cache_dir / f"embeddings_{fingerprint[:16]}.npy"
+
+    def hashes_path(self, fingerprint: str) -> Path:
+        return self.cache_dir / f"hashes_{fingerprint[:16]}.npy"
+
+    def _versions(self) -> List[Path]:
+        """Hash files of every stored corpus version."""
+        return [p for p in self.cache_dir.glob("hashes_*.npy") if ".tmp" not in p.suffixes]
+
+    @staticmethod
+    def _open_matrix(path: Path, expected_rows: int) -> Optional[np.ndarray]:
+        if not path.exists():
+            return None
+        try:
+            matrix = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if matrix.ndim != 2 or matrix.shape[0] != expected_rows:
+            return None
+        return matrix
+
+    def _seed(self, exclude: Path) -> Tuple[List[str], Optional[np.ndarray]]:
+        """(row hashes, matrix) of the most recently written version, to copy rows from."""
+        versions = sorted(
+            (p for p in self._versions() if p != exclude),
+            key=lambda p: p.stat().st_mtime_ns,
+            reverse=True,
+        )
+        for hashes_path in versions:
+            matrix_path = self.cache_dir / hashes_path.name.replace("hashes_", "embeddings_", 1)
+            try:
+                hashes = np.load(hashes_path).astype(str).tolist()
+            except (OSError, ValueError):
+                continue
+            matrix = self._open_matrix(matrix_path, len(hashes))
+            if matrix is not None:
+                return hashes, matrix
+        return self._legacy()
+
+    def _legacy(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        """Store of the earlier single-version layout (``embeddings.npy`` + ``index.json``), if any."""
+        index_path = self.cache_dir / "index.json"
+        if not index_path.exists():
+            return [], None
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("model") != self.model_name:
+            return [], None
+        matrix = self._open_matrix(self.cache_dir / "embeddings.npy", len(index["hashes"]))
+        return (index["hashes"], matrix) if matrix is not None else ([], None)
+
+    def _prune(self) -> None:
+        """Drop all but the ``keep`` most recently written versions, and any old-layout store."""
+        for name in ("embeddings.npy", "index.json"):
+            (self.cache_dir / name).unlink(missing_ok=True)
+        versions = sorted(self._versions(), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+        for hashes_path in versions[self.keep :]:
+            matrix_path = self.cache_dir / hashes_path.name.replace("hashes_", "embeddings_", 1)
+            for path in (matrix_path, hashes_path):
+                path.unlink(missing_ok=True)
+
+    def load(self, texts: List[str], encoder, hashes: Optional[List[str]] = None) -> np.ndarray:
+        """
+        Return a read-only memory-mapped (len(texts), dim) matrix aligned with
+        ``texts``. ``encoder`` must expose a SentenceTransformer-style
+        ``encode`` method and is only called for texts missing from the store.
+        ``hashes`` may be passed when the caller already has the content hashes.
+        """
+        if hashes is None:
+            hashes = [content_hash(t) for t in texts]
+        fingerprint = hashlib.sha1("\n".join(hashes).encode("utf-8")).hexdigest()
+        matrix_path = self.matrix_path(fingerprint)
+        current = self._open_matrix(matrix_path, len(hashes))
+        if current is not None and self.hashes_path(fingerprint).exists():
+            self.last_encoded = 0
+            return current
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        stored_hashes, stored = self._seed(self.hashes_path(fingerprint))
+        if stored is not None and stored_hashes == hashes:
+            # Read-only reuse (e.g. a snapshot written in the old layout)
+            self.last_encoded = 0
+            return stored
+        row_of: Dict[str, int] = {h: i for i, h in enumerate(stored_hashes)}
+
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in row_of and h not in missing:
+                missing[h] = t
+
+        new_rows = np.zeros((0, 0), dtype=np.float32)
+        if missing:
+            new_rows = np.asarray(
+                encoder.encode(
+                    list(missing.values()),
+                    batch_size=ENCODE_BATCH_SIZE,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=len(missing) > ENCODE_BATCH_SIZE,
+                ),
+                dtype=np.float32,
+            )
+        self.last_encoded = len(missing)
+        new_row_of = {h: i for i, h in enumerate(missing)}
+
+        if stored is not None:
+            dim = stored.shape[1]
+        elif len(new_rows):
+            dim = new_rows.shape[1]
+        else:
+            dim = 0
+
+        tmp_path = matrix_path.with_suffix(".tmp.npy")
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(len(texts), dim)
+        )
+        # Source row per output row: >= 0 indexes the old store, < 0 the new rows.
+        src = np.array(
+            [row_of[h] if h in row_of else -1 - new_row_of[h] for h in hashes],
+            dtype=np.int64,
+        )
+        for start in range(0, len(src), _COPY_BLOCK):
+            block = src[start : start + _COPY_BLOCK]
+            old = block >= 0
+            rows = np.empty((len(block), dim), dtype=np.float32)
+            if old.any():
+                rows[old] = stored[block[old]]
+            if (~old).any():
+                rows[~old] = new_rows[-1 - block[~old]]
+            out[start : start + len(block)] = rows
+        out.flush()
+        del out
+        if stored is not None:
+            del stored
+
+        # Hashes first: a matrix under this name is only trusted next to them.
+        tmp_hashes = self.hashes_path(fingerprint).with_suffix(".tmp.npy")
+        np.save(tmp_hashes, np.array(hashes, dtype=np.bytes_))
+        os.replace(tmp_hashes, self.hashes_path(fingerprint))
+        os.replace(tmp_path, matrix_path)
+        self._prune()
+
+        return np.load(matrix_path, mmap_mode="r")
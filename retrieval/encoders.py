@@ -0,0 +1,369 @@
+"""
+Model loading, plus deterministic offline stand-ins for the transformer models.
+
+The sentence-transformers models run under ``INFERENCE_BACKEND``: eager
+float32 ``torch`` (the reference), ``torch-int8`` (dynamic int8 quantization
+of every Linear layer) or ``onnx`` (ONNX Runtime). ``INFERENCE_THREADS`` pins
+the intra-op thread pool, and cross-encoder pairs are scored in length order
+(``RERANK_SORT_BY_LENGTH``) so batches pad less; ``SentenceTransformer.encode``
+already length-sorts its inputs. ``python -m retrieval.encoders --inference
+torch-int8`` reports throughput and score drift against the reference.
+
+``ENCODER_BACKEND = "hashing"`` swaps the SentenceTransformer bi-encoder and
+the CrossEncoder for feature-hashing models with the same call signatures.
+They need no network, GPU or model download and produce identical outputs on
+every machine, which makes them suitable for benchmarks and CI smoke runs. The
+rankings they produce are lexical, not semantic: use them to measure the
+pipeline, not retrieval quality.
+"""
+
+import argparse
+import json
+import time
+import warnings
+import zlib
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from config import (
+    CROSS_ENCODER_MODEL_NAME,
+    EMBEDDING_MODEL_NAME,
+    ENCODE_BATCH_SIZE,
+    ENCODER_BACKEND,
+    HASHING_DIM,
+    INFERENCE_BACKEND,
+    INFERENCE_THREADS,
+    RANDOM_SEED,
+    RERANK_BATCH_SIZE,
+    RERANK_SORT_BY_LENGTH,
+)
+from retrieval.text import tokenize
+
+INFERENCE_BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class HashingEncoder:
+    """
+    Bag-of-words feature hashing: each token (and token bigram) adds +/-1 to
+    one of ``dim`` buckets chosen by CRC32. Mirrors ``SentenceTransformer.encode``,
+    including ``output_value="token_embeddings"``.
+    """
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        cached = self._buckets.get(feature)
+        if cached is None:
+            h = zlib.crc32(feature.encode("utf-8"))
+            cached = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+            if len(self._buckets) < 1_000_000:
+                self._buckets[feature] = cached
+        return cached
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def _token_embeddings(self, text: str) -> np.ndarray:
+        """One row per token: its own bucket plus a half-weight bigram with the previous token."""
+        tokens = tokenize(text)
+        out = np.zeros((max(1, len(tokens)), self.dim), dtype=np.float32)
+        if not tokens:
+            return out
+        rows = np.arange(len(tokens))
+        idx, sign = zip(*(self._bucket(t) for t in tokens))
+        np.add.at(out, (rows, np.asarray(idx)), np.asarray(sign, dtype=np.float32))
+        if len(tokens) > 1:
+            idx, sign = zip(*(self._bucket(f"{a} {b}") for a, b in zip(tokens, tokens[1:])))
+            np.add.at(out, (rows[1:], np.asarray(idx)), 0.5 * np.asarray(sign, dtype=np.float32))
+        return out
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if kwargs.get("output_value") == "token_embeddings":
+            tokens = [self._token_embeddings(t) for t in texts]
+            return tokens[0] if single else tokens
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            feats = self._features(text)
+            if not feats:
+                continue
+            idx, sign = zip(*(self._bucket(f) for f in feats))
+            np.add.at(out[i], np.asarray(idx), np.asarray(sign, dtype=np.float32))
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.maximum(norms, 1e-12)
+        return out[0] if single else out
+
+
+class HashingCrossEncoder:
+    """
+    Pairwise scorer with the ``CrossEncoder.predict`` signature: cosine of the
+    hashed query/passage vectors plus a small exact-token-overlap term.
+    """
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.encoder = HashingEncoder(dim)
+
+    def predict(self, sentences: Sequence[Tuple[str, str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        if not len(sentences):
+            return np.zeros(0, dtype=np.float32)
+        queries = self.encoder.encode([q for q, _ in sentences], normalize_embeddings=True)
+        passages = self.encoder.encode([p for _, p in sentences], normalize_embeddings=True)
+        overlap = np.array(
+            [len(set(tokenize(q)) & set(tokenize(p))) for q, p in sentences], dtype=np.float32
+        )
+        return (queries * passages).sum(axis=1) + 0.1 * np.log1p(overlap)
+
+
+class LengthSortedCrossEncoder:
+    """
+    Wraps a ``CrossEncoder`` so ``predict`` scores pairs shortest-first and
+    returns them in input order; each batch then pads to similar lengths.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, sentences: Sequence[Tuple[str, str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        if not len(sentences):
+            return np.zeros(0, dtype=np.float32)
+        order = np.argsort([len(q) + len(p) for q, p in sentences], kind="stable")
+        scores = np.asarray(
+            self.model.predict([sentences[i] for i in order], batch_size=batch_size, **kwargs)
+        )
+        out = np.empty_like(scores)
+        out[order] = scores
+        return out
+
+    def __getattr__(self, name: str):
+        return getattr(self.model, name)
+
+
+def _inference_suffix(inference: str) -> str:
+    if inference not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {inference!r} (expected one of {INFERENCE_BACKENDS})")
+    return "" if inference == "torch" else f"@{inference}"
+
+
+def bi_encoder_name(backend: str = ENCODER_BACKEND, inference: str = INFERENCE_BACKEND) -> str:
+    """Model identifier used for cache keys under the given backend."""
+    if backend == "hashing":
+        return f"hashing-{HASHING_DIM}"
+    return EMBEDDING_MODEL_NAME + _inference_suffix(inference)
+
+
+def cross_encoder_name(backend: str = ENCODER_BACKEND, inference: str = INFERENCE_BACKEND) -> str:
+    if backend == "hashing":
+        return f"hashing-cross-{HASHING_DIM}"
+    return CROSS_ENCODER_MODEL_NAME + _inference_suffix(inference)
+
+
+def _set_torch_threads(threads: int) -> None:
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+def _onnx_model_kwargs(threads: int) -> Dict[str, Any]:
+    if threads <= 0:
+        return {}
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    return {"session_options": options}
+
+
+def _quantize_linear(module) -> None:
+    """
+    Dynamic int8 quantization of every ``nn.Linear`` in ``module``, in place.
+
+    ``torch.ao.quantization`` is deprecated in favour of torchao but still
+    ships with current torch releases; its DeprecationWarning and the
+    quantized-tensor UserWarning are raised while the model is converted,
+    not at inference, and are silenced here so warnings-as-errors runs load
+    the model. Switch to torchao's int8 dynamic quantization once torch
+    drops the module.
+    """
+    import torch
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=DeprecationWarning)
+        warnings.filterwarnings("ignore", message=r"torch\.quantize_per_tensor", category=UserWarning)
+        torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_bi_encoder(
+    backend: str = ENCODER_BACKEND,
+    inference: str = INFERENCE_BACKEND,
+    threads: int = INFERENCE_THREADS,
+):
+    if backend == "hashing":
+        return HashingEncoder()
+    _inference_suffix(inference)
+    from sentence_transformers import SentenceTransformer
+
+    if inference == "onnx":
+        return SentenceTransformer(
+            EMBEDDING_MODEL_NAME, device="cpu", backend="onnx", model_kwargs=_onnx_model_kwargs(threads)
+        )
+    _set_torch_threads(threads)
+    if inference == "torch-int8":
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+        _quantize_linear(model)
+        return model
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def load_cross_encoder(
+    backend: str = ENCODER_BACKEND,
+    inference: str = INFERENCE_BACKEND,
+    threads: int = INFERENCE_THREADS,
+    sort_by_length: bool = RERANK_SORT_BY_LENGTH,
+):
+    if backend == "hashing":
+        return HashingCrossEncoder()
+    _inference_suffix(inference)
+    from sentence_transformers import CrossEncoder
+
+    if inference == "onnx":
+        model = CrossEncoder(
+            CROSS_ENCODER_MODEL_NAME, device="cpu", backend="onnx", model_kwargs=_onnx_model_kwargs(threads)
+        )
+    else:
+        _set_torch_threads(threads)
+        if inference == "torch-int8":
+            model = CrossEncoder(CROSS_ENCODER_MODEL_NAME, device="cpu")
+            _quantize_linear(model.model)
+        else:
+            model = CrossEncoder(CROSS_ENCODER_MODEL_NAME)
+    return LengthSortedCrossEncoder(model) if sort_by_length else model
+
+
+# ---------------------------------------------------------------------------
+# Parity check
+# ---------------------------------------------------------------------------
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    rank_a = np.argsort(np.argsort(a)).astype(np.float64)
+    rank_b = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(rank_a, rank_b)[0, 1]) if len(a) > 1 else 1.0
+
+
+def _timed(fn) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - start
+
+
+def parity_report(
+    texts: List[str],
+    queries: List[str],
+    inference: str,
+    threads: int = INFERENCE_THREADS,
+    batch_size: int = ENCODE_BATCH_SIZE,
+    rerank_batch_size: int = RERANK_BATCH_SIZE,
+    sort_by_length: bool = RERANK_SORT_BY_LENGTH,
+    k: int = 10,
+) -> Dict[str, Any]:
+    """
+    Compare ``inference`` against the eager float32 reference on the same
+    inputs: embedding cosine, dense top-``k`` overlap, cross-encoder score
+    drift and per-query rank agreement, plus throughput of both paths.
+    Every query is paired with every text for reranking.
+    """
+    report: Dict[str, Any] = {"inference": inference, "threads": threads, "texts": len(texts), "queries": len(queries)}
+
+    def encode(model, items):
+        return model.encode(items, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+    reference = load_bi_encoder(inference="torch")
+    candidate = load_bi_encoder(inference=inference, threads=threads)
+    encode(candidate, texts[:batch_size])  # warm-up (graph init, thread pools)
+    ref_emb, ref_s = _timed(lambda: encode(reference, texts))
+    cand_emb, cand_s = _timed(lambda: encode(candidate, texts))
+    ref_top = np.argsort(-(encode(reference, queries) @ ref_emb.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(encode(candidate, queries) @ cand_emb.T), axis=1)[:, :k]
+    cosine = (ref_emb * cand_emb).sum(axis=1)
+    report["bi_encoder"] = {
+        "reference_texts_per_s": round(len(texts) / ref_s, 1),
+        "candidate_texts_per_s": round(len(texts) / cand_s, 1),
+        "speedup": round(ref_s / cand_s, 2),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        f"top{k}_overlap": round(
+            float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(ref_top, cand_top)])), 4
+        ),
+    }
+
+    pairs = [(q, t) for q in queries for t in texts]
+    reference = load_cross_encoder(inference="torch", sort_by_length=False)
+    candidate = load_cross_encoder(inference=inference, threads=threads, sort_by_length=sort_by_length)
+    candidate.predict(pairs[:rerank_batch_size], batch_size=rerank_batch_size)
+    ref_scores, ref_s = _timed(lambda: np.asarray(reference.predict(pairs, batch_size=rerank_batch_size)))
+    cand_scores, cand_s = _timed(lambda: np.asarray(candidate.predict(pairs, batch_size=rerank_batch_size)))
+    drift = np.abs(ref_scores - cand_scores)
+    per_query = zip(ref_scores.reshape(len(queries), -1), cand_scores.reshape(len(queries), -1))
+    spearman, top1 = [], []
+    for ref_q, cand_q in per_query:
+        spearman.append(_spearman(ref_q, cand_q))
+        top1.append(int(np.argmax(ref_q) == np.argmax(cand_q)))
+    report["cross_encoder"] = {
+        "reference_pairs_per_s": round(len(pairs) / ref_s, 1),
+        "candidate_pairs_per_s": round(len(pairs) / cand_s, 1),
+        "speedup": round(ref_s / cand_s, 2),
+        "score_drift_max": round(float(drift.max()), 5),
+        "score_drift_mean": round(float(drift.mean()), 5),
+        "spearman_mean": round(float(np.mean(spearman)), 4),
+        "top1_agreement": round(float(np.mean(top1)), 4),
+    }
+    return report
+
+
+def main():
+    from retrieval.chunk_store import load_chunks, resolve_chunks_path
+
+    parser = argparse.ArgumentParser(description="Throughput and score drift of an inference backend vs eager float32.")
+    parser.add_argument("--inference", choices=INFERENCE_BACKENDS, default=INFERENCE_BACKEND)
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS)
+    parser.add_argument("--texts", type=int, default=256, help="Corpus chunks to encode.")
+    parser.add_argument("--queries", type=int, default=8, help="Pseudo-queries (chunk openings) reranked against every text.")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    parser.add_argument("--rerank-batch-size", type=int, default=RERANK_BATCH_SIZE)
+    parser.add_argument("--no-sort", action="store_true", help="Score cross-encoder pairs in input order.")
+    args = parser.parse_args()
+
+    chunks = load_chunks(resolve_chunks_path(None))
+    rng = np.random.default_rng(RANDOM_SEED)
+    picked = rng.choice(len(chunks), size=min(args.texts, len(chunks)), replace=False)
+    texts = [chunks[i]["text"] for i in picked]
+    queries = [" ".join(t.split()[:12]) for t in texts[: args.queries]]
+    report = parity_report(
+        texts,
+        queries,
+        args.inference,
+        args.threads,
+        args.batch_size,
+        args.rerank_batch_size,
+        sort_by_length=not args.no_sort,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
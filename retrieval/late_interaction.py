@@ -0,0 +1,200 @@
+"""
+Late-interaction (ColBERT-style) reranking from bi-encoder token embeddings.
+
+At index time every chunk is encoded once with
+``encode(..., output_value="token_embeddings")``. The per-token vectors are
+projected to ``LATE_INTERACTION_DIM`` dimensions with a PCA basis fitted on
+the first chunks, L2-normalized and stored as int8 codes (``x ~= code / 127``)
+in one memory-mapped ``.bin`` matrix, with an ``_offsets.npy`` array giving
+each chunk's row range. A chunk costs ``tokens x dim`` bytes.
+
+At query time the query's token embeddings are projected the same way, and a
+candidate's score is MaxSim: for every query token, the best cosine against
+the candidate's tokens, summed over the query tokens. All candidates of a
+query are scored with one matrix product and a segmented max.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from config import ENCODE_BATCH_SIZE, INDEX_DIR, LATE_INTERACTION_DIM
+from retrieval.embedding_cache import _model_slug
+
+RERANKERS = ("cross-encoder", "late-interaction")
+
+_SCALE = 127.0
+# Chunks encoded before the PCA basis is fitted on their tokens
+_PCA_SAMPLE_CHUNKS = 512
+
+
+def _as_float32(embs) -> np.ndarray:
+    if hasattr(embs, "detach"):
+        embs = embs.detach().cpu().numpy()
+    return np.asarray(embs, dtype=np.float32)
+
+
+def encode_tokens(encoder, texts: Sequence[str], batch_size: int = ENCODE_BATCH_SIZE) -> List[np.ndarray]:
+    """Per-text (tokens, model dim) float32 token embeddings; an empty text gets one zero row."""
+    out = encoder.encode(
+        list(texts), batch_size=batch_size, output_value="token_embeddings", convert_to_numpy=False
+    )
+    embs = [_as_float32(e) for e in out]
+    return [e if len(e) else np.zeros((1, e.shape[-1] if e.ndim == 2 else 1), dtype=np.float32) for e in embs]
+
+
+class TokenEmbeddingIndex:
+    """Memory-mapped int8 token embeddings of the corpus, scored by MaxSim."""
+
+    def __init__(
+        self,
+        codes: Optional[np.ndarray],
+        offsets: Optional[np.ndarray],
+        mean: np.ndarray,
+        basis: Optional[np.ndarray],
+    ):
+        self.codes = codes
+        self.offsets = offsets
+        self.mean = mean
+        self.basis = basis
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def dim(self) -> int:
+        return self.basis.shape[1] if self.basis is not None else len(self.mean)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.offsets.nbytes)
+
+    def project(self, token_embs: np.ndarray) -> np.ndarray:
+        """Model-space token embeddings -> normalized index-space vectors."""
+        x = np.asarray(token_embs, dtype=np.float32)
+        if self.basis is not None:
+            x = (x - self.mean) @ self.basis
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+    def maxsim(self, query_tokens: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        """
+        MaxSim scores of one query (projected ``(q_tokens, dim)``) against the
+        chunks ``docs``: sum over query tokens of the best token cosine.
+        """
+        docs = np.asarray(docs, dtype=np.int64)
+        if not len(docs):
+            return np.zeros(0)
+        starts, lengths = self.offsets[docs], self.offsets[docs + 1] - self.offsets[docs]
+        seg_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        rows = np.arange(int(lengths.sum())) + np.repeat(starts - seg_starts, lengths)
+        doc_tokens = np.asarray(self.codes[rows], dtype=np.float32)
+        sims = query_tokens @ doc_tokens.T
+        return np.maximum.reduceat(sims, seg_starts, axis=1).sum(axis=0) / _SCALE
+
+    def _save_meta(self, path: Path) -> None:
+        """Offsets and projection; the codes themselves are streamed to ``path`` by ``build``."""
+        np.save(_offsets_path(path), self.offsets)
+        meta = {
+            "dim": self.dim,
+            "mean": self.mean.tolist(),
+            "basis": None if self.basis is None else self.basis.tolist(),
+        }
+        _meta_path(path).write_text(json.dumps(meta), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "TokenEmbeddingIndex":
+        meta = json.loads(_meta_path(path).read_text(encoding="utf-8"))
+        offsets = np.load(_offsets_path(path))
+        if offsets[-1]:
+            codes = np.memmap(path, dtype=np.int8, mode="r", shape=(int(offsets[-1]), meta["dim"]))
+        else:  # np.memmap cannot map an empty file
+            codes = np.zeros((0, meta["dim"]), dtype=np.int8)
+        basis = None if meta["basis"] is None else np.asarray(meta["basis"], dtype=np.float32)
+        return cls(codes, offsets, np.asarray(meta["mean"], dtype=np.float32), basis)
+
+    @classmethod
+    def build(
+        cls,
+        texts: Sequence[str],
+        encoder,
+        path: Path,
+        dim: int = LATE_INTERACTION_DIM,
+        batch_size: int = ENCODE_BATCH_SIZE,
+    ) -> "TokenEmbeddingIndex":
+        """
+        Encode ``texts`` batch by batch and stream their projected int8 token
+        codes to ``path`` (renamed into place when complete).
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        offsets = [0]
+        index = None
+        pending: List[np.ndarray] = []
+        with open(tmp, "wb") as f:
+            for start in range(0, len(texts), batch_size):
+                pending.extend(encode_tokens(encoder, texts[start : start + batch_size], batch_size))
+                if index is None and len(pending) < _PCA_SAMPLE_CHUNKS and start + batch_size < len(texts):
+                    continue
+                if index is None:
+                    index = cls._fit(np.concatenate(pending), dim)
+                for embs in pending:
+                    codes = np.clip(np.rint(index.project(embs) * _SCALE), -127, 127).astype(np.int8)
+                    f.write(codes.tobytes())
+                    offsets.append(offsets[-1] + len(codes))
+                pending = []
+        if index is None:  # empty corpus
+            index = cls(None, None, np.zeros(0, dtype=np.float32), None)
+        index.offsets = np.asarray(offsets, dtype=np.int64)
+        index._save_meta(path)
+        os.replace(tmp, path)
+        return cls.load(path)
+
+    @classmethod
+    def _fit(cls, sample: np.ndarray, dim: int) -> "TokenEmbeddingIndex":
+        """PCA projection to ``dim`` dimensions fitted on ``sample`` tokens (none when ``dim`` is 0 or too large)."""
+        model_dim = sample.shape[1]
+        if dim <= 0 or dim >= model_dim:
+            return cls(None, None, np.zeros(model_dim, dtype=np.float32), None)
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        # Top eigenvectors of the (model_dim x model_dim) covariance
+        _, vecs = np.linalg.eigh(centered.T @ centered)
+        basis = np.ascontiguousarray(vecs[:, ::-1][:, :dim], dtype=np.float32)
+        return cls(None, None, mean.astype(np.float32), basis)
+
+
+def _offsets_path(path: Path) -> Path:
+    return path.with_name(path.stem + "_offsets.npy")
+
+
+def _meta_path(path: Path) -> Path:
+    return path.with_name(path.stem + ".json")
+
+
+def token_index_path(
+    model_name: str, fingerprint: str, dim: int = LATE_INTERACTION_DIM, index_dir: Path = INDEX_DIR
+) -> Path:
+    return index_dir / f"tokens_{_model_slug(model_name)}_d{dim}_{fingerprint[:16]}.bin"
+
+
+def load_or_build_token_index(
+    texts: Sequence[str],
+    encoder,
+    model_name: str,
+    fingerprint: str,
+    index_dir: Path = INDEX_DIR,
+    dim: int = LATE_INTERACTION_DIM,
+) -> TokenEmbeddingIndex:
+    """Token embedding index for this corpus fingerprint, built and saved on first use."""
+    path = token_index_path(model_name, fingerprint, dim, index_dir)
+    if path.exists() and _meta_path(path).exists() and _offsets_path(path).exists():
+        return TokenEmbeddingIndex.load(path)
+    return TokenEmbeddingIndex.build(texts, encoder, path, dim)
+
+
+def query_tokens(index: TokenEmbeddingIndex, encoder, queries: Sequence[str]) -> List[np.ndarray]:
+    """Projected, normalized token embeddings of each query (one encoder call)."""
+    return [index.project(embs) for embs in encode_tokens(encoder, queries)]
@@ -0,0 +1,153 @@
+"""
+Integer-coded metadata columns for the chunk corpus.
+
+``paper_id`` and ``section`` are interned into int32 code arrays once, when the
+registry builds its indexes. Per-section weights (e.g. the improved retriever's
+section boost) become a lookup into a small per-value table, and query-time
+filters become boolean masks that are built once per interned value and
+cached, so the cache is bounded by the vocabularies. Filter values that do not
+occur in the corpus match nothing and are never cached.
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _intern(values: Iterable[Optional[str]]) -> Tuple[np.ndarray, List[Optional[str]]]:
+    vocab: Dict[Optional[str], int] = {}
+    codes = [vocab.setdefault(v, len(vocab)) for v in values]
+    return np.asarray(codes, dtype=np.int32), list(vocab)
+
+
+class ChunkMetadata:
+    """Columnar paper/section codes plus cached filter masks."""
+
+    def __init__(self, chunks: List[Dict[str, Any]]):
+        paper_codes, paper_vocab = _intern(c.get("paper_id") for c in chunks)
+        section_codes, section_vocab = _intern(c.get("section") for c in chunks)
+        self._set_columns(paper_codes, paper_vocab, section_codes, section_vocab)
+
+    def _set_columns(
+        self,
+        paper_codes: np.ndarray,
+        paper_vocab: List[Optional[str]],
+        section_codes: np.ndarray,
+        section_vocab: List[Optional[str]],
+    ) -> None:
+        self.size = len(paper_codes)
+        self.paper_codes, self.paper_vocab = paper_codes, paper_vocab
+        self.section_codes, self.section_vocab = section_codes, section_vocab
+        self._masks: Dict[Tuple[str, int], np.ndarray] = {}
+        self._paper_lookup = {v: i for i, v in enumerate(paper_vocab)}
+        self._section_lookup: Dict[str, List[int]] = {}
+        for i, v in enumerate(section_vocab):
+            if v:
+                self._section_lookup.setdefault(v.lower(), []).append(i)
+        self._per_section: Dict[Callable, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_columns(
+        cls,
+        paper_codes: np.ndarray,
+        paper_vocab: List[Optional[str]],
+        section_codes: np.ndarray,
+        section_vocab: List[Optional[str]],
+    ) -> "ChunkMetadata":
+        metadata = cls.__new__(cls)
+        metadata._set_columns(paper_codes, paper_vocab, section_codes, section_vocab)
+        return metadata
+
+    def apply(self, doc_map: np.ndarray, n_docs: int, changed: Dict[int, Dict[str, Any]]) -> "ChunkMetadata":
+        """
+        Columns after a corpus edit: kept rows are moved to ``doc_map[old_id]``
+        (-1 = dropped) and only the ``changed`` chunks (keyed by new id) are
+        interned. Vocabularies are extended, never renumbered.
+        """
+        columns = []
+        for field, codes, vocab in (
+            ("paper_id", self.paper_codes, self.paper_vocab),
+            ("section", self.section_codes, self.section_vocab),
+        ):
+            lookup = {v: i for i, v in enumerate(vocab)}
+            new_codes = np.zeros(n_docs, dtype=np.int32)
+            kept = doc_map >= 0
+            new_codes[doc_map[kept]] = codes[kept]
+            for doc_id, chunk in changed.items():
+                new_codes[doc_id] = lookup.setdefault(chunk.get(field), len(lookup))
+            columns += [new_codes, list(lookup)]
+        return ChunkMetadata.from_columns(*columns)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            paper_codes=self.paper_codes,
+            section_codes=self.section_codes,
+            vocab=np.frombuffer(
+                json.dumps([self.paper_vocab, self.section_vocab]).encode("utf-8"), dtype=np.uint8
+            ),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkMetadata":
+        data = np.load(path)
+        paper_vocab, section_vocab = json.loads(data["vocab"].tobytes().decode("utf-8"))
+        return cls.from_columns(data["paper_codes"], paper_vocab, data["section_codes"], section_vocab)
+
+    def per_section(self, weight_fn: Callable[[Optional[str]], float]) -> np.ndarray:
+        """
+        Vector of ``weight_fn(section)`` for every chunk, evaluated once per
+        distinct section value and cached per function.
+        """
+        with self._lock:
+            if weight_fn not in self._per_section:
+                table = np.array([weight_fn(s) for s in self.section_vocab], dtype=np.float64)
+                self._per_section[weight_fn] = table[self.section_codes] if self.size else table[:0]
+            return self._per_section[weight_fn]
+
+    def _value_mask(self, field: str, value: str) -> np.ndarray:
+        if field == "paper_id":
+            code = self._paper_lookup.get(value)
+            codes = [] if code is None else [code]
+            column = self.paper_codes
+        else:
+            codes = self._section_lookup.get(value.lower(), [])
+            column = self.section_codes
+        if not codes:
+            return np.zeros(self.size, dtype=bool)
+        key = (field, codes[0])
+        with self._lock:
+            if key not in self._masks:
+                self._masks[key] = np.isin(column, codes)
+            return self._masks[key]
+
+    def mask(
+        self,
+        papers: Optional[Iterable[str]] = None,
+        sections: Optional[Iterable[str]] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Boolean mask of chunks matching any of ``papers`` and any of
+        ``sections`` (section names match case-insensitively). Returns None
+        when no filter is given.
+        """
+        papers = list(papers or [])
+        sections = list(sections or [])
+        if not papers and not sections:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        for field, values in (("paper_id", papers), ("section", sections)):
+            if values:
+                field_mask = np.zeros(self.size, dtype=bool)
+                for value in values:
+                    field_mask |= self._value_mask(field, value)
+                mask &= field_mask
+        return mask
+
@@ -0,0 +1,207 @@
+"""
+Per-stage timing and memory instrumentation for the retrieval pipelines.
+
+``StageTimer`` records named wall-clock spans (and, optionally, the peak
+traced Python/NumPy allocation inside each span via ``tracemalloc``) for one
+retrieval call. The tracemalloc peak is process-wide: it includes whatever
+other threads allocate during the span, so it is only a per-stage figure when
+the span runs alone (``main.py --profile-memory`` runs stages one at a time;
+the server never tracks memory). ``LatencyHistogram`` aggregates spans across many calls (batch
+runs, the server) into percentiles and Prometheus text exposition format.
+"""
+
+import math
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config import LATENCY_BUCKETS_MS, LATENCY_SAMPLE_LIMIT, PROFILE_MEMORY
+
+
+_track_memory = PROFILE_MEMORY
+
+
+def set_memory_tracking(enabled: bool) -> None:
+    """Turn tracemalloc peak-memory capture on or off for new StageTimers."""
+    global _track_memory
+    _track_memory = enabled
+
+
+class StageTimer:
+    """
+    Ordered timing spans (ms) for one call, with optional process-wide peak
+    traced memory (MB) above the span's starting allocation.
+    """
+
+    def __init__(self, track_memory: Optional[bool] = None):
+        self.track_memory = _track_memory if track_memory is None else track_memory
+        self.stages_ms: Dict[str, float] = {}
+        self.peak_memory_mb: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = 1000 * (time.perf_counter() - start)
+            self.stages_ms[name] = self.stages_ms.get(name, 0.0) + elapsed
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peak_memory_mb[name] = max(
+                    self.peak_memory_mb.get(name, 0.0), (peak - base) / 2**20
+                )
+
+    def total_ms(self) -> float:
+        return sum(self.stages_ms.values())
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "stages_ms": {k: round(v, 3) for k, v in self.stages_ms.items()},
+            "total_ms": round(self.total_ms(), 3),
+        }
+        if self.track_memory:
+            out["peak_memory_mb"] = {k: round(v, 3) for k, v in self.peak_memory_mb.items()}
+        return out
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency aggregation keyed by (arm, stage). Keeps cumulative
+    bucket counts for Prometheus plus a bounded window of recent samples for
+    exact percentiles.
+    """
+
+    def __init__(self, buckets_ms: Tuple[float, ...] = LATENCY_BUCKETS_MS, sample_limit: int = LATENCY_SAMPLE_LIMIT):
+        self.buckets_ms = tuple(sorted(buckets_ms))
+        self.sample_limit = sample_limit
+        self._counts: Dict[Tuple[str, str], List[int]] = {}
+        self._sums: Dict[Tuple[str, str], float] = {}
+        self._totals: Dict[Tuple[str, str], int] = {}
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, arm: str, stage: str, ms: float) -> None:
+        key = (arm, stage)
+        with self._lock:
+            if key not in self._counts:
+                self._counts[key] = [0] * len(self.buckets_ms)
+                self._sums[key] = 0.0
+                self._totals[key] = 0
+                self._samples[key] = deque(maxlen=self.sample_limit)
+            for i, bound in enumerate(self.buckets_ms):
+                if ms <= bound:
+                    self._counts[key][i] += 1
+            self._sums[key] += ms
+            self._totals[key] += 1
+            self._samples[key].append(ms)
+
+    def observe_timer(self, arm: str, timer: StageTimer) -> None:
+        for stage, ms in timer.stages_ms.items():
+            self.observe(arm, stage, ms)
+        self.observe(arm, "total", timer.total_ms())
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """{arm: {stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}}}"""
+        out: Dict[str, Dict[str, Dict[str, float]]] = {}
+        with self._lock:
+            for (arm, stage), samples in self._samples.items():
+                values = sorted(samples)
+                out.setdefault(arm, {})[stage] = {
+                    "count": self._totals[(arm, stage)],
+                    "mean_ms": round(self._sums[(arm, stage)] / self._totals[(arm, stage)], 3),
+                    "p50_ms": round(_percentile(values, 0.50), 3),
+                    "p95_ms": round(_percentile(values, 0.95), 3),
+                    "p99_ms": round(_percentile(values, 0.99), 3),
+                }
+        return out
+
+    def to_prometheus(self, name: str = "retrieval_stage_latency_seconds") -> str:
+        lines = [
+            f"# HELP {name} Retrieval pipeline stage latency.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            keys = sorted(self._counts)
+            for arm, stage in keys:
+                labels = f'arm="{arm}",stage="{stage}"'
+                for bound, count in zip(self.buckets_ms, self._counts[(arm, stage)]):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound / 1000:g}"}} {count}')
+                total = self._totals[(arm, stage)]
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+                lines.append(f"{name}_sum{{{labels}}} {self._sums[(arm, stage)] / 1000:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {total}")
+        summary = self.summary()
+        lines.append(f"# HELP {name}_quantile Recent-window latency percentiles.")
+        lines.append(f"# TYPE {name}_quantile gauge")
+        for arm, stages in sorted(summary.items()):
+            for stage, stats in sorted(stages.items()):
+                for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                    lines.append(
+                        f'{name}_quantile{{arm="{arm}",stage="{stage}",quantile="{q}"}} '
+                        f"{stats[key] / 1000:.6f}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.to_prometheus(), encoding="utf-8")
+
+
+def format_breakdown(label: str, timings: Dict[str, Any]) -> str:
+    """Human-readable per-stage table for ``--profile``."""
+    stages = timings.get("stages_ms", {})
+    memory = timings.get("peak_memory_mb", {})
+    total = sum(stages.values()) or 1.0
+    lines = [f"{label}"]
+    lines.append(f"  {'stage':<22}{'ms':>10}{'share':>8}" + (f"{'proc peak MB':>14}" if memory else ""))
+    for stage, ms in stages.items():
+        row = f"  {stage:<22}{ms:>10.2f}{100 * ms / total:>7.1f}%"
+        if memory:
+            row += f"{memory.get(stage, 0.0):>14.2f}"
+        lines.append(row)
+    lines.append(f"  {'total':<22}{sum(stages.values()):>10.2f}")
+    return "\n".join(lines)
+
+
+def format_setup(label: str, load_times_ms: Dict[str, float]) -> str:
+    """Load time of each registry resource, for ``--profile``."""
+    lines = [label]
+    for resource, ms in load_times_ms.items():
+        lines.append(f"  {'load ' + resource:<26}{ms:>10.2f}")
+    return "\n".join(lines)
+
+
+def timer_or_new(timer: Optional[StageTimer]) -> StageTimer:
+    return timer if timer is not None else StageTimer(track_memory=False)
+
+
+def timed_setup(registry, build: Callable[[], Any]) -> Tuple[Any, Dict[str, float]]:
+    """
+    Call ``build`` (e.g. a retriever constructor) and return it with the load
+    time of every registry resource it caused to be loaded (model loads,
+    corpus encoding, index builds). Already-warm resources are not listed.
+    When several callers share a registry concurrently, a shared resource is
+    listed by whichever caller happened to load it; ``main.py`` therefore
+    reports the registry's load times once instead of per arm.
+    """
+    before = set(registry.load_times_ms)
+    obj = build()
+    return obj, {k: v for k, v in registry.load_times_ms.items() if k not in before}
@@ -0,0 +1,124 @@
+"""
+Compact corpus embedding storage for dense scoring.
+
+``EMBEDDING_STORAGE`` selects how the dense index holds the corpus matrix:
+
+- ``float32``: the memory-mapped embedding cache itself (4 bytes/dim).
+- ``float16``: half precision copy (2 bytes/dim).
+- ``int8``: symmetric scalar quantization with one scale per dimension
+  (1 byte/dim); ``x ~= codes * scale``.
+
+Quantized matrices are built once per corpus fingerprint and saved next to
+the other indexes. Scoring converts fixed-size blocks back to float32, so
+peak memory stays at one block on top of the compact matrix.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from config import INDEX_DIR
+
+STORAGE_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+_BLOCK = 65536
+
+
+class QuantizedEmbeddings:
+    """
+    Read-side view over quantized codes. Indexing returns dequantized float32
+    rows, so it can stand in for the float32 matrix wherever rows are gathered.
+    """
+
+    def __init__(self, codes: np.ndarray, scale: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scale = scale
+        self.storage = "int8" if scale is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + (0 if self.scale is None else self.scale.nbytes))
+
+    def __getitem__(self, rows) -> np.ndarray:
+        out = np.asarray(self.codes[rows], dtype=np.float32)
+        return out if self.scale is None else out * self.scale
+
+    def dot(self, query_embs: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate ``query_embs @ matrix.T`` (optionally over ``rows`` only)."""
+        single = query_embs.ndim == 1
+        q = np.atleast_2d(query_embs).astype(np.float32)
+        if self.scale is not None:
+            # (q * s) . c == q . (c * s): fold the scale into the queries once
+            q = q * self.scale
+        n = len(self) if rows is None else len(rows)
+        out = np.empty((len(q), n), dtype=np.float32)
+        for start in range(0, n, _BLOCK):
+            stop = min(start + _BLOCK, n)
+            block = self.codes[start:stop] if rows is None else self.codes[rows[start:stop]]
+            out[:, start:stop] = q @ np.asarray(block, dtype=np.float32).T
+        return out[0] if single else out
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, storage: str) -> "QuantizedEmbeddings":
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unknown embedding storage: {storage!r}")
+        n, dim = embeddings.shape
+        scale = None
+        if storage == "int8":
+            max_abs = np.zeros(dim, dtype=np.float32)
+            for start in range(0, n, _BLOCK):
+                block = np.abs(np.asarray(embeddings[start : start + _BLOCK], dtype=np.float32))
+                np.maximum(max_abs, block.max(axis=0), out=max_abs)
+            scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+
+        codes = np.empty((n, dim), dtype=STORAGE_DTYPES[storage])
+        for start in range(0, n, _BLOCK):
+            block = np.asarray(embeddings[start : start + _BLOCK], dtype=np.float32)
+            if scale is not None:
+                block = np.clip(np.rint(block / scale), -127, 127)
+            codes[start : start + len(block)] = block
+        return cls(codes, scale)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npy")
+        np.save(tmp, self.codes)
+        if self.scale is not None:
+            np.save(_scale_path(path), self.scale)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "QuantizedEmbeddings":
+        scale_path = _scale_path(path)
+        scale = np.load(scale_path) if scale_path.exists() else None
+        return cls(np.load(path, mmap_mode="r"), scale)
+
+
+def _scale_path(path: Path) -> Path:
+    return path.with_name(path.stem + "_scale.npy")
+
+
+def storage_path(storage: str, fingerprint: str, index_dir: Path = INDEX_DIR) -> Path:
+    return index_dir / f"embeddings_{storage}_{fingerprint[:16]}.npy"
+
+
+def load_or_quantize(
+    embeddings: np.ndarray, fingerprint: str, storage: str, index_dir: Path = INDEX_DIR
+) -> QuantizedEmbeddings:
+    """Quantized copy of ``embeddings``, cached in ``index_dir`` per corpus fingerprint."""
+    path = storage_path(storage, fingerprint, index_dir)
+    if path.exists():
+        stored = QuantizedEmbeddings.load(path)
+        if stored.shape == embeddings.shape and stored.storage == storage:
+            return stored
+    quantized = QuantizedEmbeddings.build(embeddings, storage)
+    quantized.save(path)
+    return QuantizedEmbeddings.load(path)
@@ -0,0 +1,77 @@
+"""
+Query-file reading and streaming batch output for offline runs.
+
+A queries file is JSONL: one object per line with a ``query`` field and an
+optional ``id``/``query_id``. Bare JSON strings are accepted as well.
+"""
+
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from config import QUERY_BATCH_SIZE
+from retrieval.profiling import LatencyHistogram, StageTimer
+
+
+def read_queries(path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield ``{"query_id", "query"}`` records from a JSONL queries file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"query": record}
+            query_id = record.get("query_id", record.get("id", f"q{line_no}"))
+            yield {"query_id": query_id, "query": record["query"]}
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_batch_results(
+    retrieve_batch: Callable[[List[str], StageTimer], List[List[Dict[str, Any]]]],
+    queries_path: Path,
+    output_path: Path,
+    strategy: str,
+    batch_size: int = QUERY_BATCH_SIZE,
+    histogram: Optional[LatencyHistogram] = None,
+) -> int:
+    """
+    Run ``retrieve_batch(queries, timer)`` over a queries file in batches and
+    append one JSON line per query to ``output_path`` as soon as its batch
+    finishes. Per-batch stage timings are attached to every line and, when a
+    histogram is given, aggregated under ``strategy``.
+    Returns the number of queries processed.
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        for batch in batched(read_queries(queries_path), batch_size):
+            timer = StageTimer()
+            all_results = retrieve_batch([q["query"] for q in batch], timer)
+            if histogram is not None:
+                histogram.observe_timer(strategy, timer)
+                histogram.observe(strategy, "per_query", timer.total_ms() / len(batch))
+            timings = {**timer.as_dict(), "batch_size": len(batch)}
+            for q, results in zip(batch, all_results):
+                record = {
+                    "query_id": q["query_id"],
+                    "query": q["query"],
+                    "strategy": strategy,
+                    "top_k": len(results),
+                    "results": results,
+                    "timings": timings,
+                }
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+            count += len(batch)
+    return count
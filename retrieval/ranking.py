@@ -0,0 +1,31 @@
+"""
+Ranking helpers shared by the retrievers.
+"""
+
+import numpy as np
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the ``k`` highest scores along the last axis, best first.
+    Uses ``argpartition`` so the cost is linear in the number of scores.
+    Works on a single score vector or a (queries x docs) matrix. Ties are
+    broken by lower index, including at the k-th place, so merging the
+    top-k of contiguous partitions gives the same result as one top-k.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        kth = np.take_along_axis(scores, np.argpartition(-scores, k - 1, axis=-1)[..., k - 1 : k], axis=-1)
+        above = scores > kth
+        at_kth = scores == kth
+        need = k - above.sum(axis=-1, keepdims=True)
+        selected = above | (at_kth & (np.cumsum(at_kth, axis=-1) <= need))
+        part = np.nonzero(selected)[-1].reshape(scores.shape[:-1] + (k,))
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
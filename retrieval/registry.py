@@ -0,0 +1,246 @@
+"""
+Process-wide registry of the heavy retrieval resources.
+
+The registry owns the bi-encoder, the cross-encoder (and its score cache), the
+columnar chunk table (``retrieval/chunk_table.py``) and its metadata columns, the corpus embeddings and the BM25
+index. Every resource is loaded lazily on first access and then shared, so
+constructing several retrievers (or running both pipelines from ``main.py``)
+loads each model and encodes the corpus once.
+
+When a snapshot has been published under ``data/snapshots/`` (see
+``retrieval/snapshots.py``), ``get_registry()`` serves that version instead of
+the chunk store, reading its prebuilt embeddings and indexes. Published
+snapshots are never written to: an index the snapshot was published without
+is built in the shared ``INDEX_DIR``, keyed by the snapshot's fingerprint.
+"""
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config import CACHE_DIR, EMBEDDING_CACHE_DIR, ENCODER_BACKEND, INDEX_DIR
+from retrieval.bm25 import InvertedBM25, bm25_path, load_or_build_bm25
+from retrieval.chunk_store import resolve_chunks_path
+from retrieval.chunk_table import TABLE_FILE, ChunkTable, TextColumn, load_or_build_chunk_table
+from retrieval.dense_index import DenseIndex, dense_index_files, load_or_build_dense_index
+from retrieval.embedding_cache import EmbeddingCache
+from retrieval.late_interaction import TokenEmbeddingIndex, load_or_build_token_index, token_index_path
+from retrieval.encoders import bi_encoder_name, cross_encoder_name, load_bi_encoder, load_cross_encoder
+from retrieval.metadata import ChunkMetadata
+from retrieval.rerank_cache import DEFAULT_PATH as RERANK_CACHE_PATH, RerankCache
+from retrieval.snapshots import (
+    CHUNK_TABLE_DIR,
+    CHUNKS_FILE,
+    EMBEDDINGS_DIR,
+    METADATA_FILE,
+    current_snapshot,
+    read_manifest,
+)
+from retrieval.text import tokenize
+
+
+class ResourceRegistry:
+    """
+    Lazily loaded, thread-safe holder for models, chunks, embeddings and the
+    BM25 index of one chunk store.
+    """
+
+    def __init__(
+        self,
+        chunks_path: Optional[Path] = None,
+        encoder_backend: str = ENCODER_BACKEND,
+        cache_dir: Path = CACHE_DIR,
+        index_dir: Path = INDEX_DIR,
+    ):
+        self.chunks_path = resolve_chunks_path(chunks_path)
+        self.encoder_backend = encoder_backend
+        self.bi_encoder_name = bi_encoder_name(encoder_backend)
+        self.cross_encoder_name = cross_encoder_name(encoder_backend)
+        self.cache_dir = cache_dir
+        self.index_dir = index_dir
+        self.embedding_dir = cache_dir / EMBEDDING_CACHE_DIR.name
+        self.snapshot: Optional[Path] = None
+        self._resources: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        # Exclusive load time per resource (nested loads are not double counted)
+        self.load_times_ms: Dict[str, float] = {}
+        self._nested_ms: List[float] = []
+
+    @classmethod
+    def from_snapshot(
+        cls, snapshot: Path, cache_dir: Path = CACHE_DIR, index_dir: Path = INDEX_DIR
+    ) -> "ResourceRegistry":
+        """
+        Registry over one published snapshot. Its embeddings and indexes are
+        read in place; indexes it lacks are built under ``index_dir``.
+        """
+        manifest = read_manifest(snapshot)
+        registry = cls(snapshot / CHUNKS_FILE, manifest["encoder_backend"], cache_dir, index_dir=index_dir)
+        registry.embedding_dir = snapshot / EMBEDDINGS_DIR
+        registry.snapshot = snapshot
+        return registry
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if name not in self._resources:
+                self._nested_ms.append(0.0)
+                start = time.perf_counter()
+                try:
+                    self._resources[name] = factory()
+                finally:
+                    elapsed = 1000 * (time.perf_counter() - start)
+                    self.load_times_ms[name] = round(elapsed - self._nested_ms.pop(), 3)
+                    if self._nested_ms:
+                        self._nested_ms[-1] += elapsed
+            return self._resources[name]
+
+    def _index_dir_for(self, files: Callable[[Path], Iterable[Path]]) -> Path:
+        """
+        Directory to load an on-disk index from: the snapshot when it was
+        published with all of ``files(dir)``, else the shared ``index_dir``
+        (where a missing index is built).
+        """
+        if self.snapshot is not None and all(f.exists() for f in files(self.snapshot)):
+            return self.snapshot
+        return self.index_dir
+
+    @property
+    def bi_encoder(self):
+        return self._get("bi_encoder", lambda: load_bi_encoder(self.encoder_backend))
+
+    @property
+    def cross_encoder(self):
+        return self._get("cross_encoder", lambda: load_cross_encoder(self.encoder_backend))
+
+    @property
+    def rerank_cache(self) -> RerankCache:
+        return self._get("rerank_cache", self._load_rerank_cache)
+
+    def _load_rerank_cache(self) -> RerankCache:
+        path = None
+        if RERANK_CACHE_PATH is not None:
+            path = self.cache_dir / RERANK_CACHE_PATH.name
+        return RerankCache(self.cross_encoder_name, path=path)
+
+    @property
+    def chunks(self) -> ChunkTable:
+        return self._get("chunks", self._load_chunks)
+
+    @property
+    def corpus_texts(self) -> TextColumn:
+        """Lazy view over the chunk table's text column (no second copy)."""
+        return self.chunks.texts
+
+    @property
+    def metadata(self) -> ChunkMetadata:
+        return self._get("metadata", self._load_metadata)
+
+    @property
+    def corpus_hashes(self) -> List[str]:
+        return self._get("corpus_hashes", lambda: self.chunks.hashes)
+
+    @property
+    def corpus_fingerprint(self) -> str:
+        """Hash of the ordered chunk contents; keys on-disk indexes to this corpus."""
+        return self._get(
+            "corpus_fingerprint",
+            lambda: hashlib.sha1("\n".join(self.corpus_hashes).encode("utf-8")).hexdigest(),
+        )
+
+    @property
+    def corpus_embeddings(self) -> np.ndarray:
+        return self._get(
+            "corpus_embeddings",
+            lambda: EmbeddingCache(self.bi_encoder_name, self.embedding_dir).load(
+                self.corpus_texts, self.bi_encoder, self.corpus_hashes
+            ),
+        )
+
+    @property
+    def version(self) -> str:
+        """Served corpus version: the snapshot name, else the corpus fingerprint."""
+        return self.snapshot.name if self.snapshot is not None else self.corpus_fingerprint
+
+    @property
+    def embeddings_path(self) -> Path:
+        """The ``.npy`` file behind ``corpus_embeddings`` (for processes that memory-map it)."""
+        return Path(self.corpus_embeddings.filename)
+
+    @property
+    def dense_index(self) -> DenseIndex:
+        return self._get(
+            "dense_index",
+            lambda: load_or_build_dense_index(
+                self.corpus_embeddings,
+                self.corpus_fingerprint,
+                index_dir=self._index_dir_for(lambda d: dense_index_files(self.corpus_fingerprint, index_dir=d)),
+            ),
+        )
+
+    @property
+    def bm25(self) -> InvertedBM25:
+        return self._get(
+            "bm25",
+            lambda: load_or_build_bm25(
+                lambda: [tokenize(t) for t in self.corpus_texts],
+                self.corpus_fingerprint,
+                self._index_dir_for(lambda d: [bm25_path(self.corpus_fingerprint, d)]),
+            ),
+        )
+
+    @property
+    def token_index(self) -> TokenEmbeddingIndex:
+        """Bi-encoder token embeddings for late-interaction reranking (built on first use)."""
+        return self._get(
+            "token_index",
+            lambda: load_or_build_token_index(
+                self.corpus_texts,
+                self.bi_encoder,
+                self.bi_encoder_name,
+                self.corpus_fingerprint,
+                self._index_dir_for(
+                    lambda d: [token_index_path(self.bi_encoder_name, self.corpus_fingerprint, index_dir=d)]
+                ),
+            ),
+        )
+
+    def _load_chunks(self) -> ChunkTable:
+        if self.snapshot is not None and (self.snapshot / CHUNK_TABLE_DIR / TABLE_FILE).exists():
+            return ChunkTable(self.snapshot / CHUNK_TABLE_DIR)
+        return load_or_build_chunk_table(self.chunks_path, self.index_dir)
+
+    def _load_metadata(self) -> ChunkMetadata:
+        if self.snapshot is not None:
+            return ChunkMetadata.load(self.snapshot / METADATA_FILE)
+        return ChunkMetadata.from_columns(*self.chunks.column("paper_id"), *self.chunks.column("section"))
+
+
+_REGISTRIES: Dict[Path, ResourceRegistry] = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(chunks_path: Optional[Path] = None) -> ResourceRegistry:
+    """
+    Return the process-wide registry for ``chunks_path``, creating it once.
+    Without a path this is the current published snapshot if there is one,
+    else the ingested JSONL store if present, else chunks.json. Registries
+    of superseded snapshots are dropped here; callers holding one keep it.
+    """
+    snapshot = current_snapshot() if chunks_path is None else None
+    with _REGISTRIES_LOCK:
+        if snapshot is not None:
+            key = snapshot.resolve()
+            for stale in [k for k, r in _REGISTRIES.items() if r.snapshot is not None and k != key]:
+                del _REGISTRIES[stale]
+            if key not in _REGISTRIES:
+                _REGISTRIES[key] = ResourceRegistry.from_snapshot(snapshot)
+            return _REGISTRIES[key]
+        chunks_path = resolve_chunks_path(chunks_path)
+        key = chunks_path.resolve()
+        if key not in _REGISTRIES:
+            _REGISTRIES[key] = ResourceRegistry(chunks_path)
+        return _REGISTRIES[key]
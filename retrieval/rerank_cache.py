@@ -0,0 +1,136 @@
+"""
+Cross-encoder score cache.
+
+Scores are keyed by (model name, normalized query text, chunk content hash).
+An in-memory LRU tier answers repeated pairs without touching the model; an
+optional SQLite tier persists scores across processes and restarts. Only the
+pairs missing from both tiers are sent to ``CrossEncoder.predict``.
+"""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import CACHE_DIR, RERANK_BATCH_SIZE, RERANK_CACHE_PERSIST, RERANK_CACHE_SIZE
+
+DEFAULT_PATH = CACHE_DIR / "rerank_scores.sqlite" if RERANK_CACHE_PERSIST else None
+
+Key = Tuple[str, str]
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query used in cache keys."""
+    return " ".join(query.lower().split())
+
+
+class RerankCache:
+    """Bounded LRU cache of cross-encoder scores with an optional on-disk tier."""
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = RERANK_CACHE_SIZE,
+        path: Optional[Path] = DEFAULT_PATH,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[Key, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "model TEXT, query TEXT, chunk TEXT, score REAL, "
+                "PRIMARY KEY (model, query, chunk))"
+            )
+            self._db.commit()
+
+    def _remember(self, key: Key, score: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self._lru[key] = score
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _lookup_disk(self, keys: List[Key]) -> Dict[Key, float]:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        for query in {q for q, _ in keys}:
+            chunks = [c for q, c in keys if q == query]
+            for start in range(0, len(chunks), 500):
+                part = chunks[start : start + 500]
+                rows = self._db.execute(
+                    "SELECT chunk, score FROM scores WHERE model = ? AND query = ? "
+                    f"AND chunk IN ({','.join('?' * len(part))})",
+                    [self.model_name, query, *part],
+                ).fetchall()
+                found.update({(query, chunk): score for chunk, score in rows})
+        return found
+
+    def predict(
+        self,
+        cross_encoder,
+        queries: List[str],
+        texts: List[str],
+        hashes: List[str],
+        batch_size: int = RERANK_BATCH_SIZE,
+    ) -> np.ndarray:
+        """
+        Scores for the flat list of (queries[i], texts[i]) pairs, where
+        ``hashes[i]`` is the content hash of ``texts[i]``. A pair repeated
+        within the call is looked up, and counted in ``stats``, once.
+        """
+        scores = np.empty(len(queries), dtype=np.float64)
+        pending: Dict[Key, List[int]] = {}
+        for i, (q, h) in enumerate(zip(queries, hashes)):
+            pending.setdefault((normalize_query(q), h), []).append(i)
+        # hits, disk_hits and misses all count distinct keys of a call
+        with self._lock:
+            for key in [k for k in pending if k in self._lru]:
+                self._lru.move_to_end(key)
+                scores[pending.pop(key)] = self._lru[key]
+                self.hits += 1
+
+            from_disk = self._lookup_disk(list(pending))
+            for key, score in from_disk.items():
+                scores[pending.pop(key)] = score
+                self._remember(key, score)
+                self.disk_hits += 1
+
+        if pending:
+            first = [positions[0] for positions in pending.values()]
+            pairs = [(queries[i], texts[i]) for i in first]
+            predicted = np.asarray(cross_encoder.predict(pairs, batch_size=batch_size), dtype=np.float64)
+            with self._lock:
+                self.misses += len(pending)
+                for (key, positions), score in zip(pending.items(), predicted):
+                    scores[positions] = score
+                    self._remember(key, float(score))
+                if self._db is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                        [(self.model_name, q, c, float(s)) for (q, c), s in zip(pending, predicted)],
+                    )
+                    self._db.commit()
+        return scores
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._lru),
+        }
@@ -0,0 +1,168 @@
+"""
+Semantic cache of final ranked results.
+
+Near-paraphrases of a query usually retrieve the same chunks, so the improved
+pipeline can answer them from an earlier result instead of running BM25, dense
+scoring and the cross-encoder again. Entries are keyed by the normalized
+embedding of the original query (the reranker scores it, and the shared
+expansion phrases would pull unrelated queries together); a lookup is a single matrix product against
+every cached embedding, and the best entry at or above ``RESULT_CACHE_THRESHOLD``
+cosine similarity is a hit.
+
+Entries only match requests with the same scope (filters, result depth, text
+length, fusion mode). They are evicted least-recently-used beyond
+``RESULT_CACHE_SIZE`` and expire after ``RESULT_CACHE_TTL_S`` seconds; the
+whole cache is dropped when the corpus version (snapshot) it was filled from
+changes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from config import RESULT_CACHE_SIZE, RESULT_CACHE_THRESHOLD, RESULT_CACHE_TTL_S
+
+Results = List[Dict[str, Any]]
+
+
+class SemanticResultCache:
+    """Bounded LRU / TTL cache of ranked results with cosine-similarity lookup."""
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        threshold: float = RESULT_CACHE_THRESHOLD,
+        ttl_s: Optional[float] = RESULT_CACHE_TTL_S,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._embs: Optional[np.ndarray] = None
+        self._scopes = np.full(max_entries, -1, dtype=np.int64)
+        self._created = np.zeros(max_entries)
+        self._scope_ids: Dict[Hashable, int] = {}
+        # slot -> (results, miss latency in ms); order is least recently used first
+        self._entries: "OrderedDict[int, Tuple[Results, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: Optional[str]) -> None:
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._scopes[:] = -1
+        self._scope_ids.clear()
+
+    def _drop(self, slot: int) -> None:
+        del self._entries[slot]
+        self._scopes[slot] = -1
+
+    def lookup(self, query_embs: np.ndarray, scope: Hashable, version: Optional[str] = None) -> List[Optional[Results]]:
+        """
+        Cached results per query (None on a miss). ``query_embs`` are the
+        L2-normalized query embeddings, one row per query.
+        """
+        out: List[Optional[Results]] = [None] * len(query_embs)
+        with self._lock:
+            self._check_version(version)
+            scope_id = self._scope_ids.get(scope)
+            if self._embs is not None and scope_id is not None:
+                live = self._scopes == scope_id
+                if self.ttl_s is not None:
+                    expired = np.flatnonzero(live & (self._created < time.time() - self.ttl_s))
+                    for slot in expired:
+                        self._drop(int(slot))
+                    live[expired] = False
+                if live.any():
+                    slots = np.flatnonzero(live)
+                    sims = np.asarray(query_embs, dtype=np.float32) @ self._embs[slots].T
+                    best = sims.argmax(axis=1)
+                    for qi, bi in enumerate(best):
+                        if sims[qi, bi] >= self.threshold:
+                            slot = int(slots[bi])
+                            self._entries.move_to_end(slot)
+                            results, cost_ms = self._entries[slot]
+                            out[qi] = [dict(r) for r in results]
+                            self.saved_ms += cost_ms
+            n_hits = sum(r is not None for r in out)
+            self.hits += n_hits
+            self.misses += len(out) - n_hits
+        return out
+
+    def store(
+        self,
+        query_embs: np.ndarray,
+        scope: Hashable,
+        results: List[Results],
+        cost_ms: float,
+        version: Optional[str] = None,
+    ) -> None:
+        """Cache ``results[i]`` under ``query_embs[i]``; ``cost_ms`` is the per-query pipeline latency."""
+        if self.max_entries <= 0 or not len(query_embs):
+            return
+        with self._lock:
+            self._check_version(version)
+            if self._embs is None:
+                self._embs = np.zeros((self.max_entries, query_embs.shape[1]), dtype=np.float32)
+            scope_id = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            for emb, ranked in zip(query_embs, results):
+                if len(self._entries) < self.max_entries:
+                    slot = int(np.flatnonzero(self._scopes < 0)[0])
+                else:
+                    slot = next(iter(self._entries))
+                    self._drop(slot)
+                    self.evictions += 1
+                self._embs[slot] = emb
+                self._scopes[slot] = scope_id
+                self._created[slot] = time.time()
+                self._entries[slot] = ([dict(r) for r in ranked], cost_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_ms": round(self.saved_ms, 3),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_CACHE: Optional[SemanticResultCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache() -> Optional[SemanticResultCache]:
+    """
+    The process-wide result cache, or None when ``RESULT_CACHE_SIZE`` is 0.
+    It outlives retriever swaps; a new snapshot version clears it.
+    """
+    global _CACHE
+    if RESULT_CACHE_SIZE <= 0:
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = SemanticResultCache()
+        return _CACHE
@@ -0,0 +1,319 @@
+"""
+Scatter-gather hybrid retrieval over corpus shards in worker processes.
+
+The corpus is split into ``SHARDS`` contiguous row ranges. Each worker process
+owns one ``CorpusShard``: BM25 postings for its rows, its slice of the corpus
+embedding matrix and of the chunk table's columns (both memory-mapped, so
+neither is copied per process), its metadata columns and section boosts.
+
+Scores keep the monolithic semantics:
+
+- BM25 uses collection-wide statistics. At startup every shard reports its
+  vocabulary, document frequencies and document lengths; the coordinator
+  sums them into global IDF / average length and sends each shard its IDF.
+- Min-max fusion uses the global per-query ranges. Phase one returns each
+  shard's (min, max) per signal; phase two sends back the global ranges and
+  every shard returns its local top candidates by boosted hybrid score.
+
+The coordinator merges those lists into the global top candidates, and only
+those go to the cross-encoder. For the list fusion modes (``FUSION_MODE``
+"rrf" / "weighted") each shard instead returns its BM25 and dense top lists,
+which are merged into global top lists and fused by the coordinator. Shards talk to the coordinator through plain
+picklable messages, so the same protocol can later run over a network.
+"""
+
+import hashlib
+import multiprocessing as mp
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import BM25_EPSILON, INDEX_DIR
+from retrieval.bm25 import bm25_idf, load_or_build_bm25
+from retrieval.chunk_table import ChunkTable
+from retrieval.dense_index import load_or_build_dense_index
+from retrieval.metadata import ChunkMetadata
+from retrieval.ranking import top_k_indices
+from retrieval.text import tokenize
+
+Range = Tuple[np.ndarray, np.ndarray]
+
+
+class CorpusShard:
+    """Rows ``[start, stop)`` of the corpus with their own BM25, dense and metadata structures."""
+
+    def __init__(
+        self,
+        table_path: Path,
+        start: int,
+        stop: int,
+        embeddings_path: Path,
+        section_boost: Callable[[Optional[str]], float],
+        index_dir: Path = INDEX_DIR,
+    ):
+        self.start = start
+        table = ChunkTable(table_path)
+        texts = table.texts[start:stop]
+        fingerprint = hashlib.sha1("\n".join(table.hash_range(start, stop)).encode("utf-8")).hexdigest()
+        paper_codes, paper_vocab = table.column("paper_id")
+        section_codes, section_vocab = table.column("section")
+        self.metadata = ChunkMetadata.from_columns(
+            paper_codes[start:stop], paper_vocab, section_codes[start:stop], section_vocab
+        )
+        self.section_boost = self.metadata.per_section(section_boost)
+        self.bm25 = load_or_build_bm25(lambda: [tokenize(t) for t in texts], fingerprint, index_dir)
+        embeddings = np.load(embeddings_path, mmap_mode="r")[start:stop]
+        self.dense_index = load_or_build_dense_index(embeddings, fingerprint, index_dir=index_dir)
+        self._pending: Dict[int, Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]] = {}
+
+    def stats(self) -> Dict[str, Any]:
+        """Local collection statistics the coordinator merges into global BM25 stats."""
+        return {
+            "vocab": self.bm25.vocab,
+            "df": self.bm25.document_frequencies(),
+            "n_docs": self.bm25.corpus_size,
+            "total_len": int(self.bm25.doc_len.sum()),
+        }
+
+    def set_collection_stats(self, idf: np.ndarray, avgdl: float) -> None:
+        self.bm25.set_collection_stats(idf, avgdl)
+
+    def score(
+        self,
+        request_id: int,
+        tokenized_queries: List[List[str]],
+        query_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+    ) -> Optional[Tuple[Range, Range]]:
+        """
+        Phase one: BM25 and dense scores for this shard's (filtered) rows,
+        kept until ``select``. Returns per-query (min, max) of each signal,
+        or None when no row of this shard matches the filters.
+        """
+        mask = self.metadata.mask(papers, sections)
+        rows = None if mask is None else np.flatnonzero(mask)
+        if (rows is not None and not len(rows)) or not self.bm25.corpus_size:
+            return None
+        bm25_scores = self.bm25.score_batch(tokenized_queries, rows)
+        dense_scores = self.dense_index.score_all(query_embs, rows)
+        self._pending[request_id] = (rows, bm25_scores, dense_scores)
+        return (
+            (bm25_scores.min(axis=1), bm25_scores.max(axis=1)),
+            (dense_scores.min(axis=1), dense_scores.max(axis=1)),
+        )
+
+    def select(
+        self, request_id: int, bm25_range: Range, dense_range: Range, k: int, fuse
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Phase two: fuse with the global ranges, apply section boosts and
+        return this shard's top ``k`` (global corpus indices, hybrid scores).
+        """
+        rows, bm25_scores, dense_scores = self._pending.pop(request_id)
+        hybrid = fuse(bm25_scores, dense_scores, bm25_range, dense_range)
+        hybrid *= self.section_boost if rows is None else self.section_boost[rows]
+        local_idx = top_k_indices(hybrid, k)
+        scores = np.take_along_axis(hybrid, local_idx, axis=-1)
+        idx = local_idx if rows is None else rows[local_idx]
+        return idx + self.start, scores
+
+    def discard(self, request_id: int) -> None:
+        """Drop phase-one scores of a request that will not reach ``select``."""
+        self._pending.pop(request_id, None)
+
+    def top_lists(
+        self,
+        tokenized_queries: List[List[str]],
+        query_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        depth: int,
+    ) -> List[Tuple[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]]:
+        """Per query: this shard's BM25 and dense top ``depth`` (scores, global corpus indices)."""
+        mask = self.metadata.mask(papers, sections)
+        empty = (np.zeros(0), np.zeros(0, dtype=np.int64))
+        if (mask is not None and not mask.any()) or not self.bm25.corpus_size:
+            return [(empty, empty) for _ in tokenized_queries]
+        dense_scores, dense_idx = self.dense_index.search(query_embs, depth, mask)
+        out = []
+        for tokens, scores, idx in zip(tokenized_queries, dense_scores, dense_idx):
+            bm25_scores, bm25_idx = self.bm25.top_k(tokens, depth, mask)
+            valid = idx >= 0
+            out.append(((bm25_scores, bm25_idx + self.start), (scores[valid], idx[valid] + self.start)))
+        return out
+
+
+def _serve_shard(conn, kwargs: Dict[str, Any]) -> None:
+    """Worker process loop: build the shard, then answer ``(method, args)`` messages."""
+    try:
+        shard = CorpusShard(**kwargs)
+    except Exception as exc:
+        conn.send(("error", exc))
+        return
+    conn.send(("ok", shard.stats()))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, args = message
+        try:
+            conn.send(("ok", getattr(shard, method)(*args)))
+        except Exception as exc:
+            conn.send(("error", exc))
+
+
+class ShardPool:
+    """Worker processes holding one ``CorpusShard`` each, queried in parallel."""
+
+    def __init__(
+        self,
+        n_shards: int,
+        table_path: Path,
+        n_docs: int,
+        embeddings_path: Path,
+        section_boost: Callable[[Optional[str]], float],
+        index_dir: Path = INDEX_DIR,
+    ):
+        n_shards = max(1, min(n_shards, n_docs))
+        bounds = np.linspace(0, n_docs, n_shards + 1).astype(np.int64)
+        self.bounds = bounds
+        ctx = mp.get_context("spawn")
+        self._conns = []
+        self._procs = []
+        self._lock = threading.Lock()
+        self._next_request = 0
+        for i in range(n_shards):
+            parent, child = ctx.Pipe()
+            kwargs = {
+                "table_path": table_path,
+                "start": int(bounds[i]),
+                "stop": int(bounds[i + 1]),
+                "embeddings_path": embeddings_path,
+                "section_boost": section_boost,
+                "index_dir": index_dir,
+            }
+            proc = ctx.Process(target=_serve_shard, args=(child, kwargs), daemon=True)
+            proc.start()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        try:
+            self._set_global_stats(self._gather(self._conns))
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    @staticmethod
+    def _gather(conns: List[Any]) -> List[Any]:
+        """
+        One reply from each connection. Every reply is read before the first
+        shard error is raised, so no stale reply is left for the next call.
+        """
+        replies = [conn.recv() for conn in conns]
+        for status, value in replies:
+            if status == "error":
+                raise value
+        return [value for _, value in replies]
+
+    def scatter(self, method: str, args_per_shard: List[Tuple]) -> List[Any]:
+        """Send one call to every shard, then gather the replies (shards run concurrently)."""
+        for conn, args in zip(self._conns, args_per_shard):
+            conn.send((method, args))
+        return self._gather(self._conns)
+
+    def _set_global_stats(self, stats: List[Dict[str, Any]]) -> None:
+        n_docs = sum(s["n_docs"] for s in stats)
+        avgdl = sum(s["total_len"] for s in stats) / n_docs if n_docs else 0.0
+        vocab = np.array([t for s in stats for t in s["vocab"]], dtype=object)
+        if len(vocab):
+            terms, inverse = np.unique(vocab, return_inverse=True)
+        else:
+            terms, inverse = vocab, np.zeros(0, dtype=np.int64)
+        df = np.bincount(inverse, weights=np.concatenate([s["df"] for s in stats]), minlength=len(terms))
+        idf = bm25_idf(df, n_docs, BM25_EPSILON)
+        offsets = np.cumsum([0] + [len(s["vocab"]) for s in stats])
+        self.scatter(
+            "set_collection_stats",
+            [(idf[inverse[offsets[i] : offsets[i + 1]]], avgdl) for i in range(len(stats))],
+        )
+
+    def candidates(
+        self,
+        tokenized_queries: List[List[str]],
+        query_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        k: int,
+        fuse,
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Global top ``k`` (corpus indices, hybrid scores) per query across all
+        shards; None when no shard has rows matching the filters.
+        """
+        with self._lock:
+            request_id = self._next_request
+            self._next_request += 1
+            args = (request_id, tokenized_queries, query_embs, papers, sections)
+            try:
+                ranges = self.scatter("score", [args] * len(self))
+            except Exception:
+                # Shards that did score would otherwise keep this request's matrices.
+                self.scatter("discard", [(request_id,)] * len(self))
+                raise
+            active = [i for i, r in enumerate(ranges) if r is not None]
+            if not active:
+                return None
+            bm25_range = (
+                np.min([ranges[i][0][0] for i in active], axis=0),
+                np.max([ranges[i][0][1] for i in active], axis=0),
+            )
+            dense_range = (
+                np.min([ranges[i][1][0] for i in active], axis=0),
+                np.max([ranges[i][1][1] for i in active], axis=0),
+            )
+            for i in active:
+                self._conns[i].send(("select", (request_id, bm25_range, dense_range, k, fuse)))
+            parts = self._gather([self._conns[i] for i in active])
+
+        # Shards are in corpus order, so a stable top-k keeps the monolithic tie order.
+        idx = np.concatenate([p[0] for p in parts], axis=1)
+        scores = np.concatenate([p[1] for p in parts], axis=1)
+        top = top_k_indices(scores, k)
+        return np.take_along_axis(idx, top, axis=-1), np.take_along_axis(scores, top, axis=-1)
+
+    def top_lists(
+        self,
+        tokenized_queries: List[List[str]],
+        query_embs: np.ndarray,
+        papers: Optional[List[str]],
+        sections: Optional[List[str]],
+        depth: int,
+    ) -> Tuple[List[Range], List[Range]]:
+        """Global BM25 and dense top ``depth`` lists per query, merged from every shard."""
+        with self._lock:
+            args = (tokenized_queries, query_embs, papers, sections, depth)
+            parts = self.scatter("top_lists", [args] * len(self))
+        merged: Tuple[List[Range], List[Range]] = ([], [])
+        for qi in range(len(tokenized_queries)):
+            for signal, lists in enumerate(merged):
+                # Shards are in corpus order, so a stable top-k keeps the monolithic tie order.
+                scores = np.concatenate([p[qi][signal][0] for p in parts])
+                idx = np.concatenate([p[qi][signal][1] for p in parts])
+                top = top_k_indices(scores, depth)
+                lists.append((scores[top], idx[top]))
+        return merged
+
+    def close(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._conns, self._procs = [], []
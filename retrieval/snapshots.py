@@ -0,0 +1,303 @@
+"""
+Versioned, atomically published index snapshots.
+
+A snapshot is an immutable directory (``data/snapshots/v000042/``) holding
+everything a registry needs to serve one version of the corpus:
+
+- ``chunks.jsonl``: the chunk store
+- ``chunk_table/``: the same chunks as a memory-mapped ``ChunkTable``
+- ``embeddings/<model>/``: corpus embeddings in the ``EmbeddingCache`` layout
+- ``bm25_<fingerprint>.npz`` and ``metadata.npz``
+- ``dense_ivf_<fingerprint>.npz`` / quantized matrices, when configured
+- ``manifest.json``: version, parent, fingerprint, encoder backend, changes
+
+``apply_changes`` derives the next version from the current one. Unchanged
+chunks keep their embedding rows, BM25 postings, metadata codes and IVF list;
+only inserted or rewritten chunks are encoded and tokenized, and document
+frequencies, IDF and length norms are recomputed from the merged postings.
+The new directory is written under a temporary name and renamed into place,
+then the ``CURRENT`` pointer file is replaced atomically, so a reader sees
+either the old version or the new one, never a partial write. Writers
+(``apply_changes``, ``prune``, rollbacks) hold an exclusive lock on
+``<root>/.lock`` while they read the current version and publish, so
+concurrent updates are applied one after the other.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    DENSE_INDEX_BACKEND,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_STORAGE,
+    ENCODER_BACKEND,
+    SNAPSHOT_DIR,
+)
+from retrieval.bm25 import InvertedBM25, bm25_path
+from retrieval.chunk_store import load_chunks
+from retrieval.chunk_table import ChunkTable
+from retrieval.dense_index import IVFIndex, index_path
+from retrieval.embedding_cache import EmbeddingCache, _model_slug
+from retrieval.encoders import bi_encoder_name, load_bi_encoder
+from retrieval.metadata import ChunkMetadata
+from retrieval.quantization import load_or_quantize
+from retrieval.text import content_hash, tokenize
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+CHUNK_TABLE_DIR = "chunk_table"
+METADATA_FILE = "metadata.npz"
+EMBEDDINGS_DIR = "embeddings"
+
+
+def corpus_fingerprint(hashes: List[str]) -> str:
+    """Same fingerprint the registry computes for a corpus."""
+    return hashlib.sha1("\n".join(hashes).encode("utf-8")).hexdigest()
+
+
+def current_snapshot(root: Path = SNAPSHOT_DIR) -> Optional[Path]:
+    """Directory of the published snapshot, or None when there is none."""
+    pointer = root / CURRENT_FILE
+    if not pointer.exists():
+        return None
+    return root / pointer.read_text(encoding="utf-8").strip()
+
+
+def read_manifest(snapshot: Path) -> Dict[str, Any]:
+    with open(snapshot / MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_snapshots(root: Path = SNAPSHOT_DIR) -> List[Path]:
+    if not root.exists():
+        return []
+    return sorted(p for p in root.iterdir() if p.is_dir() and (p / MANIFEST_FILE).exists())
+
+
+@contextmanager
+def snapshot_lock(root: Path = SNAPSHOT_DIR) -> Iterator[None]:
+    """Exclusive lock over choosing, writing and publishing versions under ``root`` (blocks)."""
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def publish(snapshot: Path, root: Path = SNAPSHOT_DIR) -> None:
+    """Point ``CURRENT`` at ``snapshot`` (an atomic rename). Call under ``snapshot_lock``."""
+    tmp = root / (CURRENT_FILE + ".tmp")
+    tmp.write_text(snapshot.name, encoding="utf-8")
+    os.replace(tmp, root / CURRENT_FILE)
+
+
+def prune(root: Path = SNAPSHOT_DIR, keep: int = 3) -> List[Path]:
+    """
+    Delete all but the newest ``keep`` snapshots (never the current one).
+    Processes still serving a deleted version keep their open memory maps.
+    """
+    removed = []
+    with snapshot_lock(root):
+        current = current_snapshot(root)
+        for snapshot in list_snapshots(root)[:-keep] if keep > 0 else list_snapshots(root):
+            if current is not None and snapshot.resolve() == current.resolve():
+                continue
+            shutil.rmtree(snapshot)
+            removed.append(snapshot)
+    return removed
+
+
+class _LazyEncoder:
+    """Loads the bi-encoder only if the embedding store actually has rows to encode."""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._model = None
+
+    def encode(self, *args, **kwargs):
+        if self._model is None:
+            self._model = load_bi_encoder(self.backend)
+        return self._model.encode(*args, **kwargs)
+
+
+def _link_tree(src: Path, dst: Path) -> None:
+    """Hard-link (or copy) ``src`` into ``dst``; later atomic replaces never touch ``src``."""
+    for path in src.rglob("*"):
+        if not path.is_file() or ".tmp" in path.suffixes:
+            continue
+        target = dst / path.relative_to(src)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+
+def _write_chunks(path: Path, chunks: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+
+def diff_chunks(
+    old: List[Dict[str, Any]], new: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """(upserts, deletes) that turn the ``old`` chunk list into ``new``, matched by ``id``."""
+    old_by_id = {str(c.get("id", i)): c for i, c in enumerate(old)}
+    new_ids = set()
+    upserts = []
+    for i, chunk in enumerate(new):
+        chunk_id = str(chunk.get("id", i))
+        new_ids.add(chunk_id)
+        if old_by_id.get(chunk_id) != chunk:
+            upserts.append({**chunk, "id": chunk.get("id", chunk_id)})
+    deletes = [chunk_id for chunk_id in old_by_id if chunk_id not in new_ids]
+    return upserts, deletes
+
+
+def apply_changes(
+    upserts: Iterable[Dict[str, Any]] = (),
+    deletes: Iterable[str] = (),
+    root: Path = SNAPSHOT_DIR,
+    encoder_backend: Optional[str] = None,
+    publish_snapshot: bool = True,
+) -> Path:
+    """
+    Build the next snapshot from the current one (or from an empty corpus)
+    by deleting the chunks whose ``id`` is in ``deletes`` and inserting or
+    replacing ``upserts`` (chunk dicts with an ``id``). Replaced chunks keep
+    their position; new chunks are appended; a delete wins over an upsert of
+    the same id. Returns the new snapshot directory. Holds ``snapshot_lock``
+    throughout, so a concurrent update waits and then builds on this one.
+    """
+    with snapshot_lock(root):
+        return _apply_changes(upserts, deletes, root, encoder_backend, publish_snapshot)
+
+
+def _apply_changes(
+    upserts: Iterable[Dict[str, Any]],
+    deletes: Iterable[str],
+    root: Path,
+    encoder_backend: Optional[str],
+    publish_snapshot: bool,
+) -> Path:
+    parent = current_snapshot(root)
+    manifest = read_manifest(parent) if parent else {}
+    backend = encoder_backend or manifest.get("encoder_backend", ENCODER_BACKEND)
+    if parent is not None and backend != manifest["encoder_backend"]:
+        raise ValueError(
+            f"Snapshot {parent.name} was encoded with {manifest['encoder_backend']!r}; "
+            f"start a new snapshot directory to switch to {backend!r}"
+        )
+    model_name = bi_encoder_name(backend)
+
+    if parent is not None:
+        old_chunks = load_chunks(parent / CHUNKS_FILE)
+        old_bm25 = InvertedBM25.load(bm25_path(manifest["fingerprint"], parent))
+        old_metadata = ChunkMetadata.load(parent / METADATA_FILE)
+        old_ivf_path = index_path("ivf", manifest["fingerprint"], parent)
+        embedding_seed = parent / EMBEDDINGS_DIR
+    else:
+        old_chunks = []
+        old_bm25 = InvertedBM25.build([])
+        old_metadata = ChunkMetadata([])
+        old_ivf_path = None
+        # Reuse whatever the main embedding cache already holds.
+        embedding_seed = EMBEDDING_CACHE_DIR
+
+    pending: Dict[str, Dict[str, Any]] = {}
+    for chunk in upserts:
+        if "id" not in chunk or "text" not in chunk:
+            raise ValueError(f"Upserted chunks need an 'id' and 'text': {chunk!r}")
+        pending[str(chunk["id"])] = chunk
+    to_delete = {str(d) for d in deletes}
+
+    # doc_map[old] = new position of an unchanged chunk, -1 if deleted/rewritten
+    doc_map = np.full(len(old_chunks), -1, dtype=np.int64)
+    chunks: List[Dict[str, Any]] = []
+    changed: List[int] = []
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    for i, chunk in enumerate(old_chunks):
+        chunk_id = str(chunk.get("id", i))
+        if chunk_id in to_delete:
+            pending.pop(chunk_id, None)
+            counts["deleted"] += 1
+            continue
+        if chunk_id in pending:
+            chunk = pending.pop(chunk_id)
+            changed.append(len(chunks))
+            counts["updated"] += 1
+        else:
+            doc_map[i] = len(chunks)
+        chunks.append(chunk)
+    for chunk in pending.values():
+        changed.append(len(chunks))
+        chunks.append(chunk)
+        counts["inserted"] += 1
+
+    texts = [c["text"] for c in chunks]
+    hashes = [content_hash(t) for t in texts]
+    fingerprint = corpus_fingerprint(hashes)
+    # Numbered past every existing snapshot, including ones newer than a rolled-back CURRENT
+    version = max([read_manifest(p)["version"] for p in list_snapshots(root)], default=0) + 1
+    name = f"v{version:06d}"
+    tmp = root / f".{name}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    _write_chunks(tmp / CHUNKS_FILE, chunks)
+    ChunkTable.build(chunks, tmp / CHUNK_TABLE_DIR)
+
+    seed = embedding_seed / _model_slug(model_name)
+    if seed.exists():
+        _link_tree(seed, tmp / EMBEDDINGS_DIR / _model_slug(model_name))
+    cache = EmbeddingCache(model_name, tmp / EMBEDDINGS_DIR, keep=1)
+    embeddings = cache.load(texts, _LazyEncoder(backend), hashes)
+
+    changed_ids = np.asarray(changed, dtype=np.int64)
+    bm25 = old_bm25.apply(doc_map, len(chunks), {d: tokenize(texts[d]) for d in changed})
+    bm25.save(bm25_path(fingerprint, tmp))
+    old_metadata.apply(doc_map, len(chunks), {d: chunks[d] for d in changed}).save(tmp / METADATA_FILE)
+
+    # The IVF index is trained on the matrix searches score against (see load_or_build_dense_index).
+    matrix = embeddings
+    if EMBEDDING_STORAGE != "float32" and len(chunks):
+        matrix = load_or_quantize(embeddings, fingerprint, EMBEDDING_STORAGE, tmp)
+    if old_ivf_path is not None and old_ivf_path.exists() and len(chunks):
+        ivf = IVFIndex.load(old_ivf_path, matrix).apply(doc_map, matrix, changed_ids)
+        ivf.save(index_path("ivf", fingerprint, tmp))
+    elif DENSE_INDEX_BACKEND == "ivf" and len(chunks):
+        IVFIndex.build(matrix).save(index_path("ivf", fingerprint, tmp))
+    del embeddings, matrix
+
+    new_manifest = {
+        "version": version,
+        "parent": parent.name if parent else None,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "chunks": len(chunks),
+        "fingerprint": fingerprint,
+        "encoder_backend": backend,
+        "model": model_name,
+        "changes": {**counts, "encoded": cache.last_encoded},
+    }
+    with open(tmp / MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, indent=2)
+
+    snapshot = root / name
+    os.rename(tmp, snapshot)
+    if publish_snapshot:
+        publish(snapshot, root)
+    return snapshot
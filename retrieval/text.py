@@ -0,0 +1,48 @@
+"""
+Small text helpers shared by the retrieval stages (hashing, tokenization,
+near-duplicate signatures, token estimates).
+"""
+
+import hashlib
+import zlib
+from typing import List
+
+import numpy as np
+
+SIMHASH_SHINGLE = 3
+
+_BITS = np.arange(64, dtype=np.uint64)
+
+
+def content_hash(text: str) -> str:
+    """Stable content hash for a chunk's text, used as a cache key."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def tokenize(text: str) -> List[str]:
+    """Whitespace tokenizer used for BM25 indexing and query scoring."""
+    return text.lower().split()
+
+
+def simhash(text: str, shingle: int = SIMHASH_SHINGLE) -> int:
+    """
+    64-bit SimHash over word ``shingle``-grams. Near-duplicate texts get
+    signatures a small Hamming distance apart.
+    """
+    words = tokenize(text)
+    if not words:
+        return 0
+    grams = [" ".join(words[i : i + shingle]).encode("utf-8") for i in range(max(1, len(words) - shingle + 1))]
+    # Two CRC32 streams with different seeds make one 64-bit hash per shingle
+    hashes = np.array([zlib.crc32(g) | (zlib.crc32(g, 0x9E3779B9) << 32) for g in grams], dtype=np.uint64)
+    votes = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0) * 2 > len(hashes)
+    return int(np.bitwise_or.reduce(votes.astype(np.uint64) << _BITS))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast LLM token-count estimate (~4 characters per subword token)."""
+    return (len(text) + 3) // 4
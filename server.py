@@ -0,0 +1,402 @@
+"""
+Resident retrieval service.
+
+Keeps the baseline and improved retrievers warm in one process and serves them
+over a minimal asyncio HTTP/1.1 endpoint:
+
+    POST /retrieve   {"query": "...", "mode": "improved" | "baseline",
+                      "papers": [...], "sections": [...]}   (filters optional)
+    GET  /health     batch counters, cache stats (incl. result-cache hit rate and
+                     latency saved), per-stage latency percentiles
+    GET  /metrics    per-stage latency histograms (Prometheus text format)
+
+Concurrent requests are collected into micro-batches (up to
+``SERVER_MAX_BATCH_SIZE`` queries or ``SERVER_MAX_WAIT_MS`` after the first
+one arrives), so query encoding and CrossEncoder.predict run once per batch
+rather than once per request.
+
+Every ``SNAPSHOT_POLL_SECONDS`` the server checks for a newly published index
+snapshot (``update_index.py``); the new version is loaded in the background
+and swapped in between batches, so updates need no restart. A version that
+fails to load is reported under ``failed_snapshot`` in /health and retried
+on the next poll while the current one keeps serving.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from config import (
+    SERVER_HOST,
+    SERVER_MAX_BATCH_SIZE,
+    SERVER_MAX_BODY_BYTES,
+    SERVER_MAX_WAIT_MS,
+    SERVER_PORT,
+    SHARDS,
+    SNAPSHOT_POLL_SECONDS,
+)
+from retrieval.profiling import LatencyHistogram, StageTimer
+from retrieval.result_cache import get_result_cache
+
+Filters = Tuple[Tuple[str, ...], Tuple[str, ...]]
+# One request's ranked results, or the error that failed its retrieval
+Outcome = Union[List[Dict[str, Any]], Exception]
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class MicroBatcher:
+    """
+    Collects submitted queries into batches and runs ``retrieve_batch`` on a
+    dedicated worker thread, one batch at a time (one call per distinct
+    filter set within a batch).
+    """
+
+    def __init__(
+        self,
+        retrieve_batch: Callable[..., List[List[Dict[str, Any]]]],
+        max_batch_size: int = SERVER_MAX_BATCH_SIZE,
+        max_wait_ms: float = SERVER_MAX_WAIT_MS,
+        arm: str = "retrieval",
+        histogram: Optional[LatencyHistogram] = None,
+    ):
+        self.retrieve_batch = retrieve_batch
+        self.arm = arm
+        self.histogram = histogram
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.queries = 0
+
+    async def submit(
+        self,
+        query: str,
+        papers: Optional[List[str]] = None,
+        sections: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        future = asyncio.get_running_loop().create_future()
+        filters = (tuple(papers or ()), tuple(sections or ()))
+        await self.queue.put((query, filters, future))
+        return await future
+
+    def _run_groups(self, batch: List[Tuple[str, Filters, asyncio.Future]]) -> List[Outcome]:
+        """
+        Run one retrieve_batch call per distinct filter set in the batch. A
+        group that fails is retried one request at a time, so an error only
+        fails the requests that cause it.
+        """
+        groups: Dict[Filters, List[int]] = {}
+        for i, (_, filters, _) in enumerate(batch):
+            groups.setdefault(filters, []).append(i)
+        results: List[Outcome] = [[] for _ in batch]
+        # Batches of different modes run concurrently, so a tracemalloc peak would not be this batch's
+        timer = StageTimer(track_memory=False)
+        for (papers, sections), positions in groups.items():
+            kwargs = {"papers": list(papers) or None, "sections": list(sections) or None, "timer": timer}
+            try:
+                group_results = self.retrieve_batch([batch[i][0] for i in positions], **kwargs)
+            except Exception as exc:
+                if len(positions) == 1:
+                    results[positions[0]] = exc
+                    continue
+                group_results = []
+                for i in positions:
+                    try:
+                        group_results.append(self.retrieve_batch([batch[i][0]], **kwargs)[0])
+                    except Exception as single_exc:
+                        group_results.append(single_exc)
+            for i, r in zip(positions, group_results):
+                results[i] = r
+        if self.histogram is not None:
+            self.histogram.observe_timer(self.arm, timer)
+        return results
+
+    async def _collect(self) -> List[Tuple[str, Filters, asyncio.Future]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            try:
+                results = await loop.run_in_executor(self.executor, self._run_groups, batch)
+            except Exception as exc:  # surface model errors to every waiting request
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def _validate_request(request: Any) -> Optional[str]:
+    """Error message for a malformed /retrieve body, checked before it joins a batch."""
+    if not isinstance(request, dict):
+        return "body must be a JSON object"
+    query = request.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return '"query" must be a non-empty string'
+    for field in ("papers", "sections"):
+        value = request.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+            return f'"{field}" must be a list of strings'
+    return None
+
+
+class RetrievalServer:
+    """HTTP front end routing requests to one micro-batcher per retriever."""
+
+    def __init__(
+        self,
+        batchers: Dict[str, MicroBatcher],
+        rerank_cache=None,
+        histogram: Optional[LatencyHistogram] = None,
+    ):
+        self.batchers = batchers
+        self.rerank_cache = rerank_cache
+        self.histogram = histogram or LatencyHistogram()
+        self.result_cache = get_result_cache()
+        self.snapshot: Optional[str] = None
+        # Last version that failed to load, with its error; cleared by a successful swap
+        self.failed_snapshot: Optional[Dict[str, str]] = None
+        # Background tasks (batchers, snapshot watcher) kept referenced while serving
+        self.tasks: List[asyncio.Task] = []
+
+    def swap(self, retrievers: Dict[str, Any], rerank_cache=None, snapshot: Optional[str] = None) -> None:
+        """
+        Route new batches to ``retrievers``; a batch already running finishes
+        on the retriever it started with. Retrievers holding worker processes
+        (sharded) are closed once their in-flight batch is done.
+        """
+        for mode, retriever in retrievers.items():
+            batcher = self.batchers[mode]
+            old = getattr(batcher.retrieve_batch, "__self__", None)
+            batcher.retrieve_batch = retriever.retrieve_batch
+            if hasattr(old, "close"):
+                batcher.executor.submit(old.close)
+        self.rerank_cache = rerank_cache
+        self.snapshot = snapshot
+        self.failed_snapshot = None
+
+    def _cascade_stats(self) -> Dict[str, Any]:
+        """Reranked-depth distribution of each mode whose current retriever runs a rerank cascade."""
+        out = {}
+        for mode, batcher in self.batchers.items():
+            cascade = getattr(getattr(batcher.retrieve_batch, "__self__", None), "cascade", None)
+            if cascade is not None:
+                out[mode] = cascade.stats()
+        return out
+
+    async def handle(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        if path == "/metrics":
+            return 200, self.histogram.to_prometheus()
+        if path == "/health":
+            return 200, {
+                "status": "ok",
+                "snapshot": self.snapshot,
+                "failed_snapshot": self.failed_snapshot,
+                "modes": {
+                    mode: {"batches": b.batches, "queries": b.queries, "queued": b.queue.qsize()}
+                    for mode, b in self.batchers.items()
+                },
+                "rerank_cache": self.rerank_cache.stats() if self.rerank_cache else None,
+                "result_cache": self.result_cache.stats() if self.result_cache else None,
+                "rerank_cascade": self._cascade_stats(),
+                "latency": self.histogram.summary(),
+            }
+        if path != "/retrieve":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            request = json.loads(body or b"{}")
+            query = request["query"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": 'body must be JSON with a "query" field'}
+        error = _validate_request(request)
+        if error:
+            return 400, {"error": error}
+        mode = request.get("mode", "improved")
+        if mode not in self.batchers:
+            return 400, {"error": f"mode must be one of {sorted(self.batchers)}"}
+
+        start = time.perf_counter()
+        results = await self.batchers[mode].submit(
+            query, request.get("papers"), request.get("sections")
+        )
+        latency_ms = 1000 * (time.perf_counter() - start)
+        self.histogram.observe(mode, "request", latency_ms)
+        return 200, {
+            "query": query,
+            "mode": mode,
+            "top_k": len(results),
+            "results": results,
+            "latency_ms": round(latency_ms, 3),
+        }
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            ).encode("latin-1")
+            + data
+        )
+        await writer.drain()
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                length = headers.get("content-length", "0")
+                if not length.isdigit():
+                    # The body cannot be skipped reliably, so the connection is closed
+                    await self._respond(writer, 400, {"error": "invalid Content-Length"}, False)
+                    break
+                if int(length) > SERVER_MAX_BODY_BYTES:
+                    error = f"body exceeds {SERVER_MAX_BODY_BYTES} bytes"
+                    await self._respond(writer, 413, {"error": error}, False)
+                    break
+                body = await reader.readexactly(int(length))
+
+                try:
+                    status, payload = await self.handle(method, path.split("?", 1)[0], body)
+                except Exception as exc:
+                    status, payload = 500, {"error": str(exc)}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _load_retrievers(registry, shards: int = SHARDS) -> Dict[str, Any]:
+    from baseline.baseline_retrieval import BaselineRetriever
+    from improved.improved_retrieval import create_improved_retriever
+
+    return {
+        "baseline": BaselineRetriever(registry=registry),
+        "improved": create_improved_retriever(registry, shards, result_cache=get_result_cache()),
+    }
+
+
+async def watch_snapshots(
+    app: RetrievalServer, interval: float = SNAPSHOT_POLL_SECONDS, shards: int = SHARDS
+) -> None:
+    """
+    Swap in each newly published snapshot once its resources are loaded. A
+    version that fails to load is recorded in ``app.failed_snapshot`` and
+    retried on the next poll; ``app.snapshot`` only changes on a swap.
+    """
+    from retrieval.registry import get_registry
+    from retrieval.snapshots import current_snapshot
+
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        latest = current_snapshot()
+        if latest is None or latest.name == app.snapshot:
+            continue
+        try:
+            registry = await loop.run_in_executor(None, get_registry)
+            retrievers = await loop.run_in_executor(None, _load_retrievers, registry, shards)
+        except Exception as exc:  # keep serving the old version
+            if (app.failed_snapshot or {}).get("version") != latest.name:
+                print(f"Could not load snapshot {latest.name}: {exc}")
+            app.failed_snapshot = {"version": latest.name, "error": f"{type(exc).__name__}: {exc}"}
+            continue
+        app.swap(retrievers, registry.rerank_cache, latest.name)
+        print(f"Now serving snapshot {latest.name}")
+
+
+async def serve(
+    host: str = SERVER_HOST,
+    port: int = SERVER_PORT,
+    max_batch_size: int = SERVER_MAX_BATCH_SIZE,
+    max_wait_ms: float = SERVER_MAX_WAIT_MS,
+    shards: int = SHARDS,
+) -> None:
+    from retrieval.registry import get_registry
+
+    # Warm everything up before accepting traffic.
+    registry = get_registry()
+    retrievers = _load_retrievers(registry, shards)
+    histogram = LatencyHistogram()
+    batchers = {
+        mode: MicroBatcher(r.retrieve_batch, max_batch_size, max_wait_ms, mode, histogram)
+        for mode, r in retrievers.items()
+    }
+    app = RetrievalServer(batchers, registry.rerank_cache, histogram)
+    app.snapshot = registry.snapshot.name if registry.snapshot else None
+    app.tasks = [asyncio.create_task(b.run()) for b in batchers.values()]
+    app.tasks.append(asyncio.create_task(watch_snapshots(app, shards=shards)))
+    server = await asyncio.start_server(app.serve_connection, host, port)
+    print(f"Serving retrieval on http://{host}:{port} (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the resident retrieval service.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=SERVER_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS)
+    parser.add_argument(
+        "--shards", type=int, default=SHARDS, help="Worker processes for improved-retriever scoring (>1 = sharded)."
+    )
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.max_batch_size, args.max_wait_ms, args.shards))
+
+
+if __name__ == "__main__":
+    main()
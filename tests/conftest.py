@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from retrieval.registry import ResourceRegistry  # noqa: E402
+
+SAMPLE_CHUNKS = ROOT / "data" / "chunks.json"
+
+
+@pytest.fixture(scope="session")
+def registry(tmp_path_factory) -> ResourceRegistry:
+    """Registry over the sample chunks with the offline hashing encoders; caches and indexes under a temp dir."""
+    work = tmp_path_factory.mktemp("registry")
+    return ResourceRegistry(SAMPLE_CHUNKS, "hashing", cache_dir=work / "cache", index_dir=work / "index")
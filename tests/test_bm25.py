@@ -0,0 +1,98 @@
+import math
+from collections import Counter
+from typing import List
+
+import numpy as np
+import pytest
+
+from retrieval.bm25 import InvertedBM25, load_or_build_bm25
+
+VOCAB = [f"w{i}" for i in range(40)]
+
+
+def _corpus(n_docs: int = 300, seed: int = 0) -> List[List[str]]:
+    """Zipf-like term distribution, so some terms are common and some rare."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(VOCAB) + 1)
+    weights /= weights.sum()
+    return [list(rng.choice(VOCAB, size=rng.integers(3, 40), p=weights)) for _ in range(n_docs)]
+
+
+def _okapi(corpus: List[List[str]], query: List[str], k1=1.5, b=0.75, epsilon=0.25) -> np.ndarray:
+    """Reference BM25Okapi (rank_bm25's formula, including its IDF floor)."""
+    n = len(corpus)
+    avgdl = sum(len(d) for d in corpus) / n
+    df = Counter(t for d in corpus for t in set(d))
+    idf = {t: math.log(n - c + 0.5) - math.log(c + 0.5) for t, c in df.items()}
+    floor = epsilon * sum(idf.values()) / len(idf)
+    idf = {t: floor if v < 0 else v for t, v in idf.items()}
+    scores = np.zeros(n)
+    for q in query:
+        if q not in idf:
+            continue
+        for i, d in enumerate(corpus):
+            tf = d.count(q)
+            scores[i] += idf[q] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(d) / avgdl))
+    return scores
+
+
+QUERIES = [["w0"], ["w1", "w7"], ["w3", "w3", "w25"], ["w39", "w0", "w12", "w5"], ["missing"], ["w30", "missing"]]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return _corpus()
+
+
+@pytest.fixture(scope="module")
+def index(corpus):
+    return InvertedBM25.build(corpus)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_reference_okapi(corpus, index, query):
+    np.testing.assert_allclose(index.get_scores(query), _okapi(corpus, query))
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_maxscore_top_k_matches_full_scoring(index, query, k):
+    full = index.get_scores(query)
+    matching = np.flatnonzero(full > 0)
+    expected = matching[np.argsort(-full[matching], kind="stable")][:k]
+    scores, idx = index.top_k(query, k)
+    np.testing.assert_array_equal(idx, expected)
+    np.testing.assert_allclose(scores, full[expected])
+
+
+def test_top_k_respects_mask(index):
+    mask = np.zeros(index.corpus_size, dtype=bool)
+    mask[::3] = True
+    query = ["w1", "w7", "w20"]
+    full = np.where(mask, index.get_scores(query), 0)
+    matching = np.flatnonzero(full > 0)
+    expected = matching[np.argsort(-full[matching], kind="stable")][:10]
+    _, idx = index.top_k(query, 10, mask)
+    np.testing.assert_array_equal(idx, expected)
+
+
+def test_saved_index_scores_with_current_parameters(tmp_path, corpus):
+    load_or_build_bm25(lambda: corpus, "fingerprint", tmp_path)
+    reloaded = load_or_build_bm25(lambda: pytest.fail("rebuilt"), "fingerprint", tmp_path, k1=0.9, b=0.4)
+    np.testing.assert_allclose(reloaded.get_scores(["w1", "w7"]), _okapi(corpus, ["w1", "w7"], k1=0.9, b=0.4))
+
+
+def test_apply_equals_fresh_build(corpus, index):
+    keep = [i for i in range(len(corpus)) if i % 7]
+    doc_map = np.full(len(corpus), -1, dtype=np.int64)
+    doc_map[keep] = np.arange(len(keep))
+    added = _corpus(20, seed=1)
+    changed = {len(keep) + i: doc for i, doc in enumerate(added)}
+    updated = index.apply(doc_map, len(keep) + len(added), changed)
+    fresh = InvertedBM25.build([corpus[i] for i in keep] + added)
+    # Term ids may be numbered differently; everything keyed by term must match.
+    assert sorted(updated.vocab) == sorted(fresh.vocab)
+    np.testing.assert_array_equal(updated.doc_len, fresh.doc_len)
+    for term in fresh.vocab:
+        np.testing.assert_allclose(updated.get_scores([term]), fresh.get_scores([term]))
+        assert updated.idf[updated.term_index[term]] == pytest.approx(fresh.idf[fresh.term_index[term]])
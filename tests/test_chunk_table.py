@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+import pytest
+
+from retrieval.chunk_store import load_chunks
+from retrieval.chunk_table import TABLE_FILE, ChunkTable, load_or_build_chunk_table, table_path
+from retrieval.text import simhash
+
+from conftest import SAMPLE_CHUNKS
+
+
+def test_table_round_trips_the_chunk_store(tmp_path):
+    chunks = load_chunks(SAMPLE_CHUNKS)
+    table = load_or_build_chunk_table(SAMPLE_CHUNKS, tmp_path)
+    assert list(table) == chunks
+    assert list(table.texts) == [c["text"] for c in chunks]
+    assert table.simhashes.tolist() == [simhash(c["text"]) for c in chunks]
+
+
+def test_table_of_another_format_is_rebuilt(tmp_path):
+    path = table_path(SAMPLE_CHUNKS, tmp_path)
+    ChunkTable.build(load_chunks(SAMPLE_CHUNKS), path)
+    meta = json.loads((path / TABLE_FILE).read_text(encoding="utf-8"))
+    (path / TABLE_FILE).write_text(json.dumps({**meta, "format": 1}), encoding="utf-8")
+    (path / "simhash.npy").unlink()
+
+    with pytest.raises(ValueError, match="rebuild"):
+        ChunkTable(path)
+    table = load_or_build_chunk_table(SAMPLE_CHUNKS, tmp_path)
+    assert isinstance(table.simhashes, np.memmap)
+    assert len(table.simhashes) == len(table)
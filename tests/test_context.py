@@ -0,0 +1,30 @@
+from config import CONTEXT_TOKEN_BUDGET
+from generation import generate_response
+from improved.improved_retrieval import ImprovedRetriever
+from retrieval.context import pack_context
+
+QUERY = "How does retrieval-augmented generation reduce hallucinations in LLMs?"
+
+
+def test_packed_evidence_is_smaller_than_the_previous_context(registry):
+    results = ImprovedRetriever(registry=registry).retrieve(QUERY)
+    response = generate_response(QUERY, results, "improved retrieval", registry.chunks)
+    stats = response["context_stats"]
+    assert stats["tokens_packed"] <= CONTEXT_TOKEN_BUDGET < stats["tokens_previous_context"]
+    assert stats["tokens_saved"] == stats["tokens_previous_context"] - stats["tokens_packed"]
+    # No paper the previous top-3 context cited is lost
+    cited = {p["paper_id"] for p in response["context_used"]}
+    assert {r["paper_id"] for r in results[:3]} <= cited
+    # The response carries the packed passages, not shorter snippets of them
+    for passage in response["context_used"]:
+        assert passage["text"] in response["response"]
+
+
+def test_duplicates_are_dropped_and_the_budget_holds(registry):
+    table = registry.chunks
+    rows = [table.result_fields(0), table.result_fields(0), table.result_fields(2), table.result_fields(3)]
+    context = pack_context(rows, table, token_budget=64)
+    stats = context["stats"]
+    assert stats["near_duplicates_dropped"] == 1
+    assert stats["tokens_packed"] <= 64
+    assert [p["chunk_ids"] for p in context["passages"]] == [["paper_1_chunk_0"], ["paper_2_chunk_0"]]
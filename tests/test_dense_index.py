@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from retrieval.dense_index import DenseIndex, ExactIndex, IVFIndex, index_path
+
+
+def _normalized(n: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    return _normalized(2000)
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return _normalized(20, seed=1)
+
+
+def test_ivf_probing_every_list_matches_exact(embeddings, queries):
+    ivf = IVFIndex.build(embeddings, nlist=16, nprobe=16)
+    scores, idx = ivf.search(queries, 10)
+    exact_scores, exact_idx = ExactIndex(embeddings).search(queries, 10)
+    np.testing.assert_array_equal(idx, exact_idx)
+    np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+
+def test_ivf_with_mask_returns_only_matching_rows(embeddings, queries):
+    mask = np.zeros(len(embeddings), dtype=bool)
+    mask[::5] = True
+    _, idx = IVFIndex.build(embeddings, nlist=16, nprobe=16).search(queries, 10, mask)
+    _, exact_idx = ExactIndex(embeddings).search(queries, 10, mask)
+    np.testing.assert_array_equal(idx, exact_idx)
+
+
+def test_saved_ivf_index_loads_identically(tmp_path, embeddings, queries):
+    ivf = IVFIndex.build(embeddings, nlist=16, nprobe=4)
+    ivf.save(tmp_path / "ivf.npz")
+    loaded = IVFIndex.load(tmp_path / "ivf.npz", embeddings, nprobe=4)
+    np.testing.assert_array_equal(loaded.search(queries, 10)[1], ivf.search(queries, 10)[1])
+
+
+def test_ivf_file_is_keyed_by_build_settings(tmp_path):
+    base = index_path("ivf", "f" * 40, tmp_path, storage="float32", nlist=16)
+    assert index_path("ivf", "f" * 40, tmp_path, storage="int8", nlist=16) != base
+    assert index_path("ivf", "f" * 40, tmp_path, storage="float32", nlist=32) != base
+    assert index_path("ivf", "f" * 40, tmp_path, storage="float32", nlist=16, seed=7) != base
+    assert index_path("ivf", "f" * 40, tmp_path, storage="float32", nlist=16) == base
+
+
+def test_dense_index_is_abstract(embeddings):
+    with pytest.raises(TypeError):
+        DenseIndex(embeddings)
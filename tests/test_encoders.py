@@ -0,0 +1,25 @@
+import warnings
+
+import pytest
+
+from retrieval.encoders import HashingCrossEncoder, HashingEncoder, _quantize_linear
+
+
+def test_int8_quantization_does_not_warn():
+    torch = pytest.importorskip("torch")
+    model = torch.nn.Sequential(torch.nn.Linear(8, 8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+    reference = model(torch.ones(1, 8))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        _quantize_linear(model)
+        quantized = model(torch.ones(1, 8))
+    assert not isinstance(model[0], torch.nn.Linear)
+    assert torch.allclose(quantized, reference, atol=0.1)
+
+
+def test_hashing_models_are_deterministic():
+    texts = ["dense passage retrieval", "sparse BM25 retrieval"]
+    a, b = HashingEncoder().encode(texts), HashingEncoder().encode(texts)
+    assert (a == b).all()
+    scores = HashingCrossEncoder().predict([("retrieval", t) for t in texts])
+    assert (scores == HashingCrossEncoder().predict([("retrieval", t) for t in texts])).all()
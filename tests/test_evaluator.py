@@ -0,0 +1,25 @@
+import pytest
+
+import config
+from evaluation.evaluator import retrieve_runs
+
+
+class Registry:
+    corpus_fingerprint = "f" * 40
+    bi_encoder_name = cross_encoder_name = "model"
+
+
+@pytest.mark.parametrize("name", ["IVF_NLIST", "IVF_NPROBE", "IVF_TRAIN_ITERS", "IVF_TRAIN_SAMPLE", "RANDOM_SEED"])
+def test_changed_ivf_setting_misses_the_run_cache(tmp_path, monkeypatch, name):
+    calls = []
+
+    def retrieve_batch(queries, top_k, papers=None, sections=None, text_chars=None):
+        calls.append(list(queries))
+        return [[{"chunk_id": f"c{len(calls)}"}] for _ in queries]
+
+    def runs():
+        return retrieve_runs("improved", retrieve_batch, Registry(), {"q1": "query"}, cache_dir=tmp_path)
+
+    assert runs() == runs() == {"q1": ["c1"]}
+    monkeypatch.setattr(config, name, getattr(config, name) + 1)
+    assert runs() == {"q1": ["c2"]}
@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from ingest import assign_paper_ids, chunk_words
+
+
+def test_colliding_file_names_get_distinct_ids():
+    ids = assign_paper_ids([Path("a-b.pdf"), Path("a_b.pdf"), Path("c.pdf")], {})
+    assert ids["a-b.pdf"] == "a_b"
+    assert ids["a_b.pdf"].startswith("a_b_")
+    assert len(set(ids.values())) == 3
+
+
+def test_recorded_ids_are_kept_when_a_colliding_file_appears():
+    manifest = {"a_b.pdf": {"paper_id": "a_b"}}
+    ids = assign_paper_ids([Path("a-b.pdf"), Path("a_b.pdf")], manifest)
+    assert ids["a_b.pdf"] == "a_b"
+    assert ids["a-b.pdf"] != "a_b"
+
+
+def test_chunk_windows_overlap_and_cover_the_body():
+    words = [f"w{i}" for i in range(25)]
+    chunks = chunk_words(" ".join(words), size=10, overlap=3)
+    assert [c.split()[0] for c in chunks] == ["w0", "w7", "w14", "w21"]
+    assert chunks[-1].split()[-1] == "w24"
@@ -0,0 +1,28 @@
+import numpy as np
+
+from retrieval.metadata import ChunkMetadata
+
+CHUNKS = [
+    {"paper_id": "p1", "section": "Methods"},
+    {"paper_id": "p2", "section": "methods"},
+    {"paper_id": "p1", "section": "Results"},
+    {"paper_id": "p3", "section": None},
+]
+
+
+def test_filters_match_papers_and_sections_case_insensitively():
+    metadata = ChunkMetadata(CHUNKS)
+    assert metadata.mask() is None
+    np.testing.assert_array_equal(metadata.mask(papers=["p1"]), [True, False, True, False])
+    np.testing.assert_array_equal(metadata.mask(sections=["METHODS"]), [True, True, False, False])
+    np.testing.assert_array_equal(metadata.mask(["p1", "p2"], ["methods"]), [True, True, False, False])
+
+
+def test_unknown_filter_values_match_nothing_and_are_not_cached():
+    metadata = ChunkMetadata(CHUNKS)
+    for i in range(100):
+        assert not metadata.mask(papers=[f"missing_{i}"], sections=[f"nope_{i}"]).any()
+    assert metadata._masks == {}
+    metadata.mask(papers=["p1"], sections=["Methods"])
+    metadata.mask(sections=["methods"])
+    assert len(metadata._masks) == 2  # one per interned value, whatever the spelling
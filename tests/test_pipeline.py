@@ -0,0 +1,94 @@
+from collections import Counter
+
+import pytest
+
+from pipeline import Stage, StageCache, run_stages
+
+
+class Dag:
+    """Two independent stages and a report stage on both; counts how often each runs."""
+
+    def __init__(self, out_dir):
+        self.calls = Counter()
+        self.inputs = {"a": 1, "b": 1}
+        self.outputs = {"a": 10, "b": 20}
+        self.report = out_dir / "report.md"
+
+    def _leaf(self, name):
+        def run(_):
+            self.calls[name] += 1
+            return {"value": self.outputs[name], "timings": {"ms": self.calls[name]}}
+
+        return Stage(name, run, inputs=lambda: {"x": self.inputs[name]}, volatile=("timings",))
+
+    def _write_report(self, upstream):
+        self.calls["report"] += 1
+        total = upstream["a"]["value"] + upstream["b"]["value"]
+        self.report.write_text(f"total {total}", encoding="utf-8")
+        return {"total": total}
+
+    def stages(self):
+        report = Stage("report", self._write_report, deps=("a", "b"), outputs=[self.report])
+        return [report, self._leaf("a"), self._leaf("b")]
+
+
+def _statuses(report):
+    return {name: info["status"] for name, info in report.items()}
+
+
+@pytest.fixture
+def dag(tmp_path):
+    return Dag(tmp_path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return StageCache(tmp_path / "stages")
+
+
+def test_unchanged_stages_come_from_the_cache(dag, cache):
+    results, report = run_stages(dag.stages(), cache)
+    assert results["report"] == {"total": 30}
+    assert set(_statuses(report).values()) == {"ran"}
+
+    dag.report.unlink()
+    results, report = run_stages(dag.stages(), cache)
+    assert set(_statuses(report).values()) == {"cached"}
+    assert results["report"] == {"total": 30}
+    assert dag.report.read_text(encoding="utf-8") == "total 30"  # output restored
+    assert dag.calls == Counter({"a": 1, "b": 1, "report": 1})
+
+
+def test_changed_input_reruns_the_stage_and_its_dependents(dag, cache):
+    run_stages(dag.stages(), cache)
+    dag.inputs["a"], dag.outputs["a"] = 2, 11
+    results, report = run_stages(dag.stages(), cache)
+    assert _statuses(report) == {"report": "ran", "a": "ran", "b": "cached"}
+    assert results["report"] == {"total": 31}
+
+
+def test_dependents_are_keyed_on_upstream_results_not_keys(dag, cache):
+    run_stages(dag.stages(), cache)
+    # "a" reruns (new input) but returns the same value with new timings
+    dag.inputs["a"] = 2
+    _, report = run_stages(dag.stages(), cache)
+    assert _statuses(report) == {"report": "cached", "a": "ran", "b": "cached"}
+
+
+def test_force_and_uncacheable_stages_always_run(dag, cache):
+    run_stages(dag.stages(), cache)
+    _, report = run_stages(dag.stages(), cache, force=True)
+    assert set(_statuses(report).values()) == {"ran"}
+
+    stages = dag.stages()
+    stages[1].cacheable = False
+    _, report = run_stages(stages, cache)
+    assert _statuses(report) == {"report": "cached", "a": "ran", "b": "cached"}
+
+
+def test_unknown_dependency_and_cycle_are_rejected(cache):
+    with pytest.raises(ValueError, match="unknown"):
+        run_stages([Stage("x", lambda _: 1, deps=("missing",))], cache)
+    cycle = [Stage("x", lambda _: 1, deps=("y",)), Stage("y", lambda _: 1, deps=("x",))]
+    with pytest.raises(ValueError, match="cycle"):
+        run_stages(cycle, cache)
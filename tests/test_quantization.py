@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from retrieval.dense_index import ExactIndex, IVFIndex
+from retrieval.quantization import QuantizedEmbeddings
+
+
+def _normalized(n: int, dim: int = 32, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    return _normalized(2000)
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return _normalized(20, seed=1)
+
+
+@pytest.mark.parametrize("storage, ratio", [("float16", 2), ("int8", 4)])
+def test_quantized_matrix_is_smaller(embeddings, storage, ratio):
+    quantized = QuantizedEmbeddings.build(embeddings, storage)
+    assert quantized.nbytes < embeddings.nbytes / ratio * 1.1
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_quantized_search_rescored_in_float32_matches_exact(embeddings, queries, storage):
+    quantized = QuantizedEmbeddings.build(embeddings, storage)
+    index = ExactIndex(quantized, exact=embeddings, rescore=100)
+    scores, idx = index.search(queries, 10)
+    exact_scores, exact_idx = ExactIndex(embeddings).search(queries, 10)
+    np.testing.assert_array_equal(idx, exact_idx)
+    # Rescored hits carry exact float32 similarities, not quantized ones
+    np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+
+def test_int8_ivf_rescoring(embeddings, queries):
+    quantized = QuantizedEmbeddings.build(embeddings, "int8")
+    ivf = IVFIndex.build(quantized, nlist=16, nprobe=16, exact=embeddings, rescore=100)
+    _, idx = ivf.search(queries, 10)
+    _, exact_idx = ExactIndex(embeddings).search(queries, 10)
+    np.testing.assert_array_equal(idx, exact_idx)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from retrieval.rerank_cache import RerankCache
+
+
+class CountingCrossEncoder:
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size=32):
+        self.pairs.extend(pairs)
+        return [float(len(q) + len(t)) for q, t in pairs]
+
+
+def test_repeated_pairs_are_scored_and_counted_once(tmp_path):
+    cache = RerankCache("model", max_entries=1, path=tmp_path / "scores.sqlite")
+    model = CountingCrossEncoder()
+    queries, texts, hashes = ["q", "q", "Q ", "q"], ["a", "a", "a", "bb"], ["ha", "ha", "ha", "hb"]
+    scores = cache.predict(model, queries, texts, hashes)
+    np.testing.assert_array_equal(scores, [2, 2, 2, 3])
+    assert model.pairs == [("q", "a"), ("q", "bb")]
+    assert cache.stats()["misses"] == 2
+
+    # "hb" is in memory (LRU of one), "ha" comes from SQLite; each counted once
+    again = cache.predict(model, queries, texts, hashes)
+    np.testing.assert_array_equal(again, scores)
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["hit_rate"] == 0.5
+    assert len(model.pairs) == 2
@@ -0,0 +1,29 @@
+from improved.improved_retrieval import ImprovedRetriever
+from retrieval.result_cache import SemanticResultCache
+
+
+def _ids(results):
+    return [[(r["chunk_id"], r["cross_encoder_score"]) for r in ranked] for ranked in results]
+
+
+def test_queries_sharing_an_expansion_do_not_share_results(registry):
+    # "rag" and "retrieval" expand with the same phrase: their expanded embeddings
+    # are ~0.91 similar under the hashing encoder, the queries themselves are not.
+    cache = SemanticResultCache(max_entries=16, threshold=0.9, ttl_s=None)
+    cached = ImprovedRetriever(registry=registry, result_cache=cache)
+    plain = ImprovedRetriever(registry=registry)
+
+    assert _ids(cached.retrieve_batch(["rag"])) == _ids(plain.retrieve_batch(["rag"]))
+    assert _ids(cached.retrieve_batch(["retrieval"])) == _ids(plain.retrieve_batch(["retrieval"]))
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_repeated_query_is_served_from_the_cache(registry):
+    cache = SemanticResultCache(max_entries=16, threshold=0.97, ttl_s=None)
+    retriever = ImprovedRetriever(registry=registry, result_cache=cache)
+    first = retriever.retrieve_batch(["dense passage retrieval"])
+    assert retriever.retrieve_batch(["Dense passage retrieval"]) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Different filters are a different scope
+    retriever.retrieve_batch(["dense passage retrieval"], papers=["paper_1"])
+    assert cache.misses == 2
@@ -0,0 +1,131 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+import retrieval.registry
+import retrieval.snapshots
+from config import SERVER_MAX_BODY_BYTES
+from server import MicroBatcher, RetrievalServer, _validate_request, watch_snapshots
+
+
+class FakeRetriever:
+    """Records each retrieve_batch call; fails any batch containing "boom"."""
+
+    def __init__(self):
+        self.calls = []
+
+    def retrieve_batch(self, queries, papers=None, sections=None, timer=None):
+        self.calls.append((list(queries), papers, sections))
+        if "boom" in queries:
+            raise ZeroDivisionError("boom")
+        return [[{"chunk_id": f"{q}:{papers}"}] for q in queries]
+
+
+def _serve(retriever, requests, max_batch_size=32, max_wait_ms=50.0):
+    """Submit ``requests`` (query, papers) concurrently; return (outcomes, batcher)."""
+
+    async def main():
+        batcher = MicroBatcher(retriever.retrieve_batch, max_batch_size, max_wait_ms)
+        worker = asyncio.create_task(batcher.run())
+        try:
+            outcomes = await asyncio.gather(
+                *(batcher.submit(q, papers) for q, papers in requests), return_exceptions=True
+            )
+        finally:
+            worker.cancel()
+        return outcomes, batcher
+
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_share_one_call():
+    retriever = FakeRetriever()
+    outcomes, batcher = _serve(retriever, [(f"q{i}", None) for i in range(5)])
+    assert retriever.calls == [([f"q{i}" for i in range(5)], None, None)]
+    assert outcomes == [[{"chunk_id": f"q{i}:None"}] for i in range(5)]
+    assert (batcher.batches, batcher.queries) == (1, 5)
+
+
+def test_batch_size_limit_and_filter_groups():
+    retriever = FakeRetriever()
+    requests = [("a", None), ("b", ["p1"]), ("c", None), ("d", ["p1"]), ("e", None)]
+    outcomes, batcher = _serve(retriever, requests, max_batch_size=4)
+    assert batcher.batches == 2
+    assert sorted(len(queries) for queries, _, _ in retriever.calls) == [1, 2, 2]
+    assert outcomes[1] == [{"chunk_id": "b:['p1']"}]
+
+
+def test_failing_request_does_not_fail_its_batch():
+    retriever = FakeRetriever()
+    outcomes, _ = _serve(retriever, [("x", None), ("boom", None), ("y", None)])
+    assert outcomes[0] == [{"chunk_id": "x:None"}]
+    assert isinstance(outcomes[1], ZeroDivisionError)
+    assert outcomes[2] == [{"chunk_id": "y:None"}]
+
+
+@pytest.mark.parametrize(
+    "body, ok",
+    [
+        ({"query": "attention"}, True),
+        ({"query": "attention", "papers": ["p1"], "sections": ["Methods"]}, True),
+        ({"query": "  "}, False),
+        ({"query": 3}, False),
+        ({"query": "attention", "papers": "p1"}, False),
+        ({"query": "attention", "sections": [1]}, False),
+        (["attention"], False),
+    ],
+)
+def test_validate_request(body, ok):
+    assert (_validate_request(body) is None) == ok
+
+
+def _post(app, body: bytes, content_length: int):
+    """Send one raw POST /retrieve to ``app``; return (status line, response body)."""
+
+    async def main():
+        server = await asyncio.start_server(app.serve_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                f"POST /retrieve HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        head, _, payload = response.partition(b"\r\n\r\n")
+        return head.split(b"\r\n")[0].decode("latin-1"), json.loads(payload)
+
+    return asyncio.run(main())
+
+
+def test_oversized_body_is_rejected_before_it_is_read():
+    app = RetrievalServer({"improved": MicroBatcher(FakeRetriever().retrieve_batch)})
+    status, payload = _post(app, b"{}", SERVER_MAX_BODY_BYTES + 1)
+    assert status.startswith("HTTP/1.1 413")
+    assert "exceeds" in payload["error"]
+
+
+def test_failed_snapshot_is_reported_and_retried(monkeypatch):
+    app = RetrievalServer({})
+    app.snapshot = "v000001"
+    attempts = []
+
+    def failing_registry():
+        attempts.append(1)
+        raise OSError("truncated embeddings")
+
+    monkeypatch.setattr(retrieval.snapshots, "current_snapshot", lambda: Path("snapshots/v000002"))
+    monkeypatch.setattr(retrieval.registry, "get_registry", failing_registry)
+
+    async def main():
+        watcher = asyncio.create_task(watch_snapshots(app, interval=0.01))
+        await asyncio.sleep(0.2)
+        watcher.cancel()
+
+    asyncio.run(main())
+    assert app.snapshot == "v000001"  # still serving, and reporting, the old version
+    assert app.failed_snapshot == {"version": "v000002", "error": "OSError: truncated embeddings"}
+    assert len(attempts) > 1
@@ -0,0 +1,43 @@
+import pytest
+
+from improved.improved_retrieval import ImprovedRetriever, ShardedImprovedRetriever
+
+QUERIES = [
+    "How does retrieval-augmented generation reduce hallucinations in LLMs?",
+    "dense passage retrieval training",
+    "transformer attention",
+]
+FILTERS = [
+    {},
+    {"papers": ["paper_1", "paper_10"]},
+    {"sections": ["Introduction"]},
+    {"papers": ["no_such_paper"]},
+]
+
+
+def _ranking(results):
+    return [[(r["chunk_id"], round(r["hybrid_score"], 6), r["cross_encoder_score"]) for r in rs] for rs in results]
+
+
+@pytest.mark.parametrize("fusion_mode", ["full", "rrf"])
+def test_sharded_results_match_in_process(registry, fusion_mode):
+    local = ImprovedRetriever(registry=registry, fusion_mode=fusion_mode)
+    sharded = ShardedImprovedRetriever(registry=registry, shards=3, fusion_mode=fusion_mode)
+    try:
+        for filters in FILTERS:
+            expected = local.retrieve_batch(QUERIES, top_k=10, **filters)
+            assert _ranking(sharded.retrieve_batch(QUERIES, top_k=10, **filters)) == _ranking(expected)
+    finally:
+        sharded.close()
+
+
+def test_shard_error_leaves_no_stale_replies(registry):
+    sharded = ShardedImprovedRetriever(registry=registry, shards=2)
+    try:
+        with pytest.raises(AttributeError):
+            sharded.pool.scatter("no_such_method", [()] * len(sharded.pool))
+        # The next call gets its own replies, not the failed call's leftovers
+        stats = sharded.pool.scatter("stats", [()] * len(sharded.pool))
+        assert sum(s["n_docs"] for s in stats) == len(registry.chunks)
+    finally:
+        sharded.close()
@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+
+from retrieval.bm25 import InvertedBM25, bm25_path
+from retrieval.chunk_store import load_chunks
+from retrieval.registry import ResourceRegistry
+from retrieval.snapshots import CHUNKS_FILE, apply_changes, current_snapshot, list_snapshots, read_manifest
+from retrieval.text import tokenize
+
+from conftest import SAMPLE_CHUNKS
+
+
+def _edit(root):
+    chunks = load_chunks(SAMPLE_CHUNKS)
+    v1 = apply_changes(chunks, [], root, encoder_backend="hashing")
+    updated = {**chunks[3], "text": "Retrieval augmented generation grounding reduces hallucination sharply."}
+    inserted = [
+        {"id": f"new_{i}", "paper_id": "paper_99", "section": "Methods", "text": f"hallucination mitigation method {i}"}
+        for i in range(3)
+    ]
+    v2 = apply_changes([updated] + inserted, [chunks[0]["id"], chunks[5]["id"]], root)
+    return chunks, v1, v2
+
+
+def test_apply_changes_matches_a_fresh_build(tmp_path):
+    chunks, v1, v2 = _edit(tmp_path / "snapshots")
+    assert current_snapshot(tmp_path / "snapshots") == v2
+    manifest = read_manifest(v2)
+    assert manifest["parent"] == v1.name
+    assert manifest["changes"] == {"inserted": 3, "updated": 1, "deleted": 2, "encoded": 4}
+
+    new_chunks = load_chunks(v2 / CHUNKS_FILE)
+    assert len(new_chunks) == len(chunks) + 1
+    incremental = InvertedBM25.load(bm25_path(manifest["fingerprint"], v2))
+    fresh = InvertedBM25.build([tokenize(c["text"]) for c in new_chunks])
+    assert sorted(incremental.vocab) == sorted(fresh.vocab)
+    for query in (["hallucination"], ["retrieval", "augmented", "generation"], ["mitigation", "method", "2"]):
+        np.testing.assert_allclose(incremental.get_scores(query), fresh.get_scores(query))
+
+
+def test_snapshot_registry_matches_chunk_store_registry(tmp_path):
+    _, _, v2 = _edit(tmp_path / "snapshots")
+    before = sorted((str(p), p.stat().st_mtime_ns) for p in v2.rglob("*"))
+    snapshot = ResourceRegistry.from_snapshot(v2, cache_dir=tmp_path / "cache", index_dir=tmp_path / "index")
+    fresh = ResourceRegistry(v2 / CHUNKS_FILE, "hashing", tmp_path / "fresh_cache", tmp_path / "fresh_index")
+
+    np.testing.assert_array_equal(np.asarray(snapshot.corpus_embeddings), np.asarray(fresh.corpus_embeddings))
+    query = ["hallucination", "retrieval"]
+    np.testing.assert_allclose(snapshot.bm25.get_scores(query), fresh.bm25.get_scores(query))
+    # Serving a snapshot never writes into it
+    assert sorted((str(p), p.stat().st_mtime_ns) for p in v2.rglob("*")) == before
+
+
+def test_concurrent_updates_are_serialized(tmp_path):
+    root = tmp_path / "snapshots"
+    apply_changes(load_chunks(SAMPLE_CHUNKS)[:5], [], root, encoder_backend="hashing")
+    inserts = [{"id": f"t{i}", "paper_id": "p", "section": "Methods", "text": f"thread {i} text"} for i in range(4)]
+    errors = []
+
+    def insert(chunk):
+        try:
+            apply_changes([chunk], [], root)
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=insert, args=(chunk,)) for chunk in inserts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert [p.name for p in list_snapshots(root)] == [f"v{i:06d}" for i in range(1, 6)]
+    # Each update built on the previous one, so no insert was lost
+    ids = {c["id"] for c in load_chunks(current_snapshot(root) / CHUNKS_FILE)}
+    assert {c["id"] for c in inserts} <= ids
+    assert read_manifest(current_snapshot(root))["chunks"] == 9
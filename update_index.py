@@ -0,0 +1,97 @@
+"""
+Maintain versioned index snapshots without full rebuilds.
+
+    python update_index.py sync                   # snapshot the chunk store (first run) or apply its diff
+    python update_index.py apply --upserts new.jsonl --delete paper_3_chunk_7
+    python update_index.py list
+    python update_index.py rollback v000004
+    python update_index.py prune --keep 3
+
+Each command that changes the corpus writes a new snapshot under
+data/snapshots/ and atomically repoints CURRENT at it; ``main.py`` and a
+running ``server.py`` pick the new version up without rebuilding anything.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+from config import ENCODER_BACKEND, SNAPSHOT_DIR, SNAPSHOT_KEEP
+from retrieval.chunk_store import iter_chunks, load_chunks, resolve_chunks_path
+from retrieval.snapshots import (
+    CHUNKS_FILE,
+    apply_changes,
+    current_snapshot,
+    diff_chunks,
+    list_snapshots,
+    prune,
+    publish,
+    read_manifest,
+    snapshot_lock,
+)
+
+
+def _report(snapshot: Path) -> None:
+    manifest = read_manifest(snapshot)
+    changes = manifest["changes"]
+    print(
+        f"Published {snapshot.name}: {manifest['chunks']} chunks "
+        f"(+{changes['inserted']} inserted, ~{changes['updated']} updated, "
+        f"-{changes['deleted']} deleted, {changes['encoded']} encoded)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally update versioned index snapshots.")
+    parser.add_argument("--root", type=Path, default=SNAPSHOT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser("sync", help="Bring the current snapshot in line with a chunk store.")
+    sync.add_argument("--chunks", type=Path, default=None, help="Default: data/chunks.jsonl or chunks.json.")
+    sync.add_argument("--encoder-backend", default=None, help=f"First snapshot only (default {ENCODER_BACKEND}).")
+
+    apply = commands.add_parser("apply", help="Apply explicit chunk upserts and deletes.")
+    apply.add_argument("--upserts", type=Path, default=None, help="JSONL file of chunks (with ids) to insert or replace.")
+    apply.add_argument("--delete", action="append", default=[], help="Chunk id to delete (repeatable).")
+    apply.add_argument("--deletes", type=Path, default=None, help="File with one chunk id to delete per line.")
+
+    commands.add_parser("list", help="List snapshots.")
+    rollback = commands.add_parser("rollback", help="Repoint CURRENT at an existing snapshot.")
+    rollback.add_argument("version")
+    prune_cmd = commands.add_parser("prune", help="Delete old snapshots.")
+    prune_cmd.add_argument("--keep", type=int, default=SNAPSHOT_KEEP)
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        current = current_snapshot(args.root)
+        old = load_chunks(current / CHUNKS_FILE) if current else []
+        upserts, deletes = diff_chunks(old, load_chunks(resolve_chunks_path(args.chunks)))
+        if current and not upserts and not deletes:
+            print(f"{current.name} is up to date")
+            return
+        _report(apply_changes(upserts, deletes, args.root, args.encoder_backend))
+    elif args.command == "apply":
+        upserts = list(iter_chunks(args.upserts)) if args.upserts else []
+        deletes = list(args.delete)
+        if args.deletes:
+            deletes += [line.strip() for line in args.deletes.read_text(encoding="utf-8").splitlines() if line.strip()]
+        _report(apply_changes(upserts, deletes, args.root))
+    elif args.command == "list":
+        current = current_snapshot(args.root)
+        for snapshot in list_snapshots(args.root):
+            manifest = read_manifest(snapshot)
+            marker = "*" if current and snapshot.name == current.name else " "
+            print(f"{marker} {snapshot.name}  {manifest['created']}  {manifest['chunks']} chunks  {json.dumps(manifest['changes'])}")
+    elif args.command == "rollback":
+        snapshot = args.root / args.version
+        read_manifest(snapshot)  # fails loudly on an unknown version
+        with snapshot_lock(args.root):
+            publish(snapshot, args.root)
+        print(f"CURRENT -> {snapshot.name}")
+    elif args.command == "prune":
+        for snapshot in prune(args.root, args.keep):
+            print(f"Removed {snapshot.name}")
+
+
+if __name__ == "__main__":
+    main()